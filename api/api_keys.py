@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_api_key.models import APIKey
+
+from helpers.caching import get_data_version, aget_data_version
+from helpers.db import closing_old_connections
+from helpers import metrics
+
+
+# Data version namespace of the API keys. The version is bumped when an API key
+# is saved or deleted, which clears the API key verification caches of all processes.
+API_KEYS_DATA_NAMESPACE = "api_keys"
+
+
+
+class APIKeyVerificationCache:
+    """
+    Process-local cache of API key verification results.
+
+    Verifying an API key takes a database lookup and a deliberately slow password hash check.
+    Results are cached by a SHA-256 digest of the presented key, for at most `ttl` seconds,
+    and never past the expiry date of the key. The presented keys themselves are not kept.
+
+    The cache is cleared whenever the API keys data version changes (see `api.signals`),
+    so revoked and deleted API keys are rejected by every process straight away.
+    """
+    def __init__(self, ttl: float = 60.0, max_size: int = 10000) -> None:
+        """
+        Create a new verification cache
+
+        :param ttl: Number of seconds verification results are cached for. Set to 0 to disable the cache.
+        :param max_size: Maximum number of cached results. The cache is cleared when it is full.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[float, bool]] = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def get_digest(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        return None
+
+
+    def get_cached(self, digest: str, version: int) -> bool | None:
+        """
+        Returns the cached verification result for the digest of an API key,
+        or None if there is no unexpired result for the current API keys data version.
+        """
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(digest, None)
+            if entry is not None and entry[0] > time.monotonic():
+                metrics.increment("api_keys.verification_cache.hits")
+                return entry[1]
+        metrics.increment("api_keys.verification_cache.misses")
+        return None
+
+
+    def set_cached(self, digest: str, version: int, valid: bool, ttl: float) -> None:
+        with self._lock:
+            # Skip results that were verified against API keys that have changed since
+            if version == self._version and ttl > 0:
+                if len(self._entries) >= self.max_size:
+                    self._entries.clear()
+                self._entries[digest] = (time.monotonic() + ttl, valid)
+        return None
+
+
+    def is_valid(self, key: str) -> bool:
+        """
+        Check if an API key is valid, usable and not expired
+
+        :param key: The presented API key
+        """
+        if not self.ttl:
+            return APIKey.objects.is_valid(key)
+
+        version = get_data_version(API_KEYS_DATA_NAMESPACE)
+        digest = self.get_digest(key)
+        valid = self.get_cached(digest, version)
+        if valid is None:
+            valid, ttl = self.verify(key)
+            self.set_cached(digest, version, valid, ttl)
+        return valid
+
+
+    async def ais_valid(self, key: str) -> bool:
+        """
+        Async version of `is_valid`. Only verifying uncached keys runs in a thread.
+
+        :param key: The presented API key
+        """
+        if not self.ttl:
+            return await sync_to_async(
+                closing_old_connections(APIKey.objects.is_valid), thread_sensitive=False
+            )(key)
+
+        version = await aget_data_version(API_KEYS_DATA_NAMESPACE)
+        digest = self.get_digest(key)
+        valid = self.get_cached(digest, version)
+        if valid is None:
+            valid, ttl = await sync_to_async(closing_old_connections(self.verify), thread_sensitive=False)(key)
+            self.set_cached(digest, version, valid, ttl)
+        return valid
+
+
+    def verify(self, key: str) -> Tuple[bool, float]:
+        """
+        Verify an API key against the database
+
+        :param key: The presented API key
+        :return: A tuple of whether the key is valid, and the number of seconds the result can be cached for
+        """
+        try:
+            api_key = APIKey.objects.get_from_key(key)
+        except APIKey.DoesNotExist:
+            return False, self.ttl
+
+        if api_key.has_expired:
+            return False, self.ttl
+        if api_key.expiry_date is None:
+            return True, self.ttl
+        return True, min(self.ttl, (api_key.expiry_date - timezone.now()).total_seconds())
+
+
+
+api_key_verification_cache = APIKeyVerificationCache(
+    ttl=settings.API_KEY_VERIFICATION_CACHE_TTL
+)
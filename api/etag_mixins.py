@@ -0,0 +1,42 @@
+from typing import Any
+from django.utils.cache import get_conditional_response
+from rest_framework import response, status
+
+from helpers.caching import get_data_version, get_query_etag
+
+
+
+class DataVersionETag:
+    """
+    View mixin that adds strong ETags, derived from a data version and the request query, to GET responses.
+
+    Requests with a matching "If-None-Match" header get a 304 (Not Modified) response,
+    without the view handling the request. The data version of `etag_data_namespace` must be bumped
+    whenever the data returned by the view changes (see `helpers.caching.bump_data_version`).
+
+    Permissions are checked before the ETag is compared, since the view's handler is called after `initial()`.
+    The negotiated media type is part of the ETag, so the JSON and browsable API representations
+    of the same data get different ETags.
+    """
+    etag_data_namespace: str = None
+
+    def get_data_version(self) -> int:
+        """Returns the data version of `etag_data_namespace`, fetched once per request"""
+        if not hasattr(self, "_data_version"):
+            self._data_version = get_data_version(self.etag_data_namespace)
+        return self._data_version
+    
+
+    def get(self, request, *args: Any, **kwargs: Any) -> response.Response:
+        etag = get_query_etag(
+            request, self.etag_data_namespace, self.get_data_version(), media_type=request.accepted_media_type
+        )
+        not_modified_response = get_conditional_response(request, etag=etag)
+        if not_modified_response is not None:
+            not_modified_response["ETag"] = etag
+            return not_modified_response
+        
+        get_response = super().get(request, *args, **kwargs)
+        if get_response.status_code == status.HTTP_200_OK:
+            get_response["ETag"] = etag
+        return get_response
@@ -1,10 +1,23 @@
 from rest_framework_api_key.permissions import HasAPIKey as BaseHasAPIKey
 
+from .api_keys import api_key_verification_cache
+
 
 
 class HasAPIKey(BaseHasAPIKey):
-    """Permits only requests made a valid API key"""
+    """
+    Permits only requests made a valid API key
+
+    Verification results are cached (see `api.api_keys.APIKeyVerificationCache`),
+    so repeat requests with the same key skip the database lookup and the key hash check.
+    """
     message = "Unauthorized request!"
 
+    def has_permission(self, request, view) -> bool:
+        key = self.get_key(request)
+        if not key:
+            return False
+        return api_key_verification_cache.is_valid(key)
+
 
 
@@ -0,0 +1,28 @@
+from django.dispatch import receiver
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from rest_framework_api_key.models import APIKey
+
+from .api_keys import API_KEYS_DATA_NAMESPACE, api_key_verification_cache
+from helpers.caching import bump_data_version
+
+
+
+def invalidate_api_key_verifications() -> None:
+    api_key_verification_cache.clear()
+    bump_data_version(API_KEYS_DATA_NAMESPACE)
+    return None
+
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def invalidate_api_key_verifications_on_change(sender: type[APIKey], **kwargs) -> None:
+    """
+    Clears the API key verification caches of all processes when an API key is
+    created, revoked, updated or deleted, once the write is committed.
+
+    Bulk updates do not send signals, so API keys revoked with `QuerySet.update`
+    are only rejected once the cached verifications expire.
+    """
+    transaction.on_commit(invalidate_api_key_verifications)
+    return
@@ -1,5 +1,8 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from rest_framework import response, views
+
+from helpers import metrics
 
 
 
@@ -13,3 +16,28 @@ def health_check_api_view(request, *args, **kwargs) -> JsonResponse:
         status=200
     )
 
+
+
+class MetricsAPIView(views.APIView):
+    """API view for retrieving the metrics of the API server process"""
+    http_method_names = ["get"]
+
+    def get(self, request, *args, **kwargs) -> response.Response:
+        """
+        Retrieve the counters and gauges of the server process that handles the request, 
+        e.g. the hits and misses of the EMA record response cache,
+        or the depth of the websocket send queues.
+
+        Counters are kept per process, and reset when the process restarts.
+        """
+        return response.Response(
+            data={
+                "status": "success",
+                "message": "Metrics retrieved successfully!",
+                "data": {**metrics.get_counters(), **metrics.get_gauges()}
+            },
+            status=200
+        )
+
+
+metrics_api_view = MetricsAPIView.as_view()
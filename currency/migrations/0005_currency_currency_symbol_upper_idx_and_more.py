@@ -0,0 +1,30 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:47
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(django.db.models.functions.text.Upper('symbol'), name='currency_symbol_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(django.db.models.functions.text.Upper('exchange'), name='currency_exchange_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(django.db.models.functions.text.Upper('category'), name='currency_category_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='currency',
+            index=models.Index(django.db.models.functions.text.Upper('subcategory'), name='currency_subcategory_upper_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 
 from .managers import CurrencyManager
@@ -30,6 +31,14 @@ class Currency(models.Model):
         ordering = ["symbol", '-added_at']
         verbose_name = _("Currency")
         verbose_name_plural = _("Currencies")
+        indexes = [
+            # Serve the case-insensitive lookups of currencies, which compare upper-cased values,
+            # e.g. the currency, category and subcategory filters of EMA records
+            models.Index(Upper("symbol"), name="currency_symbol_upper_idx"),
+            models.Index(Upper("exchange"), name="currency_exchange_upper_idx"),
+            models.Index(Upper("category"), name="currency_category_upper_idx"),
+            models.Index(Upper("subcategory"), name="currency_subcategory_upper_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.symbol} ({self.exchange})"
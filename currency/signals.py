@@ -0,0 +1,30 @@
+from django.dispatch import receiver
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import Currency
+from .symbols import currency_symbol_cache
+from helpers.caching import bump_data_version
+
+
+# Data version namespace of the currencies. The version is bumped
+# on every write to the currencies (see `helpers.caching`)
+CURRENCIES_DATA_NAMESPACE = "currencies"
+
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def bump_currencies_data_version(sender: type[Currency], **kwargs) -> None:
+    """Bumps the currencies data version once the write is committed"""
+    transaction.on_commit(lambda: bump_data_version(CURRENCIES_DATA_NAMESPACE))
+    return
+
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_symbol_cache(sender: type[Currency], **kwargs) -> None:
+    """Clears the currency symbol maps of all processes once the write is committed"""
+    currency_symbol_cache.invalidate_on_commit()
+    return
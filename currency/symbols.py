@@ -0,0 +1,214 @@
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, NamedTuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.functions import Upper
+
+from .models import Currency
+from helpers.logging import log_exception
+from helpers import metrics
+
+
+# Redis pub/sub channel on which currency changes are announced to all processes
+CURRENCY_SYMBOLS_INVALIDATION_CHANNEL = "currency_symbols:invalidate"
+
+
+class CachedCurrency(NamedTuple):
+    """Values of a currency, as kept in the currency symbol cache"""
+    id: uuid.UUID
+    symbol: str
+    category: str
+    subcategory: str
+    exchange: str
+
+    def to_currency(self) -> Currency:
+        """Returns a new currency instance with the cached values"""
+        return Currency.from_db(Currency.objects.db, self._fields, self)
+
+
+class CurrencySymbolCache:
+    """
+    Process-local map of upper-cased currency symbols to the ids and values of currencies, used to
+    resolve the currency symbols of EMA record writes without querying the database.
+
+    The map is loaded with all the currencies in a single query, on first use.
+    Symbols that are not in the map are looked up in the database, and added to the map if found,
+    unless they are looked up in a transaction. Every lookup returns new currency instances,
+    built from the cached values, so records never share a currency instance.
+
+    When a currency is created, updated or deleted, the map of the process that made the change is
+    cleared, and the change is published on a Redis pub/sub channel, once the write is committed
+    (see `currency.signals`). A background thread subscribed to the channel clears the maps of the
+    other processes. While the subscription is down, the map is not used, since changes may be missed.
+    Without a Redis pub/sub URL, changes cannot reach the other processes, so the map is never used.
+    """
+    def __init__(self, enabled: bool = True, redis_url: str | None = None, retry_interval: float = 5.0) -> None:
+        """
+        Create a new symbol cache. The subscriber thread is started on first use.
+
+        :param enabled: Whether to use the map. If False, every lookup queries the database
+        :param redis_url: URL of the Redis server to publish and subscribe to invalidations with.
+            If None, the map is disabled.
+        :param retry_interval: Number of seconds to wait before resubscribing after the subscription fails
+        """
+        self.enabled = enabled and redis_url is not None
+        self.redis_url = redis_url
+        self.retry_interval = retry_interval
+        self._currencies: Dict[str, CachedCurrency] | None = None
+        # Incremented on every invalidation, so lookups that started before an
+        # invalidation do not put currencies that may be stale in the map
+        self._generation = 0
+        self._subscribed = False
+        self._lock = threading.Lock()
+        self._subscriber: threading.Thread | None = None
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._currencies = None
+            self._generation += 1
+        return None
+
+
+    def _load(self) -> None:
+        with self._lock:
+            generation = self._generation
+        currencies = {
+            currency.symbol.upper(): currency
+            for currency in map(CachedCurrency._make, Currency.objects.values_list(*CachedCurrency._fields))
+        }
+        with self._lock:
+            if generation == self._generation:
+                self._currencies = currencies
+        return None
+
+
+    def resolve(self, symbols: Iterable[str]) -> Dict[str, Currency]:
+        """
+        Resolve currency symbols to currencies. The lookup is case-insensitive.
+
+        :param symbols: Currency symbols to resolve
+        :return: A mapping of upper-cased symbols to currencies. Unknown symbols are left out.
+        """
+        upper_cased_symbols = {symbol.upper() for symbol in symbols}
+        if not upper_cased_symbols:
+            return {}
+
+        return {symbol: currency.to_currency() for symbol, currency in self._resolve(upper_cased_symbols).items()}
+
+
+    def _resolve(self, upper_cased_symbols: set[str]) -> Dict[str, CachedCurrency]:
+        if not self.enabled:
+            return self.fetch(upper_cased_symbols)
+        self._ensure_subscriber()
+        if not self._subscribed:
+            return self.fetch(upper_cased_symbols)
+        # Currencies read in a transaction may be uncommitted, so they are not put in the map
+        can_store = not transaction.get_connection().in_atomic_block
+        if self._currencies is None:
+            if not can_store:
+                return self.fetch(upper_cased_symbols)
+            self._load()
+
+        with self._lock:
+            generation = self._generation
+            currencies = self._currencies or {}
+            resolved = {symbol: currencies[symbol] for symbol in upper_cased_symbols if symbol in currencies}
+        missing_symbols = upper_cased_symbols - resolved.keys()
+        metrics.increment("currencies.symbol_cache.hits", len(resolved))
+        if not missing_symbols:
+            return resolved
+
+        metrics.increment("currencies.symbol_cache.misses", len(missing_symbols))
+        fetched = self.fetch(missing_symbols)
+        with self._lock:
+            if can_store and generation == self._generation and self._currencies is not None:
+                self._currencies.update(fetched)
+        resolved.update(fetched)
+        return resolved
+
+
+    def get(self, symbol: str) -> Currency | None:
+        """Returns the currency with the symbol, or None if there is none. The lookup is case-insensitive."""
+        return self.resolve([symbol]).get(symbol.upper(), None)
+
+
+    @staticmethod
+    def get_queryset(upper_cased_symbols: Iterable[str]) -> QuerySet[Currency]:
+        """Returns the currencies with the upper-cased symbols, annotated with their upper-cased symbols"""
+        return Currency.objects.annotate(
+            symbol_upper=Upper("symbol")
+        ).filter(symbol_upper__in=upper_cased_symbols)
+
+
+    @classmethod
+    def fetch(cls, upper_cased_symbols: Iterable[str]) -> Dict[str, CachedCurrency]:
+        """Fetch the values of the currencies with the upper-cased symbols from the database, in a single query"""
+        rows = cls.get_queryset(upper_cased_symbols).values_list(*CachedCurrency._fields)
+        return {currency.symbol.upper(): currency for currency in map(CachedCurrency._make, rows)}
+
+
+    def invalidate_on_commit(self) -> None:
+        """
+        Clear the maps of all processes once the current transaction is committed.
+        Call this when a currency is created, updated or deleted.
+        """
+        transaction.on_commit(self.invalidate)
+        return None
+
+
+    def invalidate(self) -> None:
+        self.clear()
+        if not self.enabled:
+            return None
+        try:
+            self._get_client().publish(CURRENCY_SYMBOLS_INVALIDATION_CHANNEL, "1")
+        except Exception as exc:
+            log_exception(exc)
+        return None
+
+
+    def _get_client(self):
+        import redis
+        return redis.Redis.from_url(self.redis_url)
+
+
+    def _ensure_subscriber(self) -> None:
+        if not self.enabled:
+            return None
+        if self._subscriber is None or not self._subscriber.is_alive():
+            with self._lock:
+                if self._subscriber is None or not self._subscriber.is_alive():
+                    self._subscriber = threading.Thread(
+                        target=self._run_subscriber, name="currency-symbol-cache", daemon=True
+                    )
+                    self._subscriber.start()
+        return None
+
+
+    def _run_subscriber(self) -> None:
+        while True:
+            try:
+                pubsub = self._get_client().pubsub()
+                pubsub.subscribe(CURRENCY_SYMBOLS_INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    # Changes may have been missed before the subscription was confirmed
+                    self.clear()
+                    if message["type"] == "subscribe":
+                        self._subscribed = True
+            except Exception as exc:
+                log_exception(exc)
+            self._subscribed = False
+            self.clear()
+            time.sleep(self.retry_interval)
+
+
+
+currency_symbol_cache = CurrencySymbolCache(
+    enabled=settings.CURRENCY_SYMBOL_CACHE_ENABLED,
+    redis_url=settings.CURRENCY_SYMBOLS_REDIS_URL
+)
+
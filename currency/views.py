@@ -8,7 +8,9 @@ from typing import Dict
 from currency.models import Currency
 from currency.managers import CurrencyQuerySet
 from currency.serializers import CurrencySerializer
+from currency.signals import CURRENCIES_DATA_NAMESPACE
 from api.permission_mixins import AuthenticationRequired, AuthenticationRequiredOrReadOnly
+from api.etag_mixins import DataVersionETag
 
 from helpers.logging import log_exception
 
@@ -17,12 +19,13 @@ currency_qs = Currency.objects.all()
 
 
 
-class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, generics.ListCreateAPIView):
+class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, DataVersionETag, generics.ListCreateAPIView):
     """API view for listing and creating currencies"""
     model = Currency
     serializer_class = CurrencySerializer
     queryset = currency_qs
     url_search_param = "search"
+    etag_data_namespace = CURRENCIES_DATA_NAMESPACE
 
     def get_queryset(self) -> CurrencyQuerySet[Currency]:
         currency_qs = super().get_queryset()
@@ -39,6 +42,8 @@ class CurrencyListCreateAPIView(AuthenticationRequiredOrReadOnly, generics.ListC
 
         The following query parameters are supported:
         - search: Search query to filter currencies by name, symbol, category, or subcategory
+
+        Responses have an ETag. Send it in the "If-None-Match" header to get a 304 response if the currencies have not changed.
         """
         return super().get(request, *args, **kwargs)
     
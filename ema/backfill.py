@@ -0,0 +1,204 @@
+import csv
+import datetime
+from typing import Dict, List, Tuple
+import numpy as np
+from django.db import transaction
+from django.utils.dateparse import parse_duration
+
+from .engine import EMA_PERIODS, EMA_ALPHAS, get_ema_record_data, save_series_states
+from .models import EMASeriesState, EMARecord
+from .upserts import resolve_currencies, upsert_ema_records
+
+
+# A batch of candle series for a single timeframe, as 2-D arrays of shape (symbols, candles).
+# "symbols" is a 1-D array of the series' currency symbols. Missing candles are NaN
+# (or NaT for "time") and each row is ordered oldest to newest.
+CandleArrays = Dict[str, np.ndarray]
+
+
+def load_candles_from_csv(path: str) -> Dict[datetime.timedelta, CandleArrays]:
+    """
+    Load historical candles from a CSV file into 2-D arrays per timeframe.
+
+    The CSV file should have a header row with the columns
+    "currency_symbol", "timeframe", "time", "high", "low" and "close",
+    the same fields accepted by the candle ingestion endpoint.
+
+    :param path: Path to the CSV file
+    :return: A mapping of timeframes to candle arrays
+    """
+    series: Dict[datetime.timedelta, Dict[str, List[Tuple]]] = {}
+    with open(path, newline="") as file:
+        for row in csv.DictReader(file):
+            timeframe = parse_duration(row["timeframe"])
+            if timeframe is None:
+                raise ValueError(f"Invalid timeframe '{row['timeframe']}'")
+            time = datetime.datetime.fromisoformat(row["time"])
+            if time.tzinfo is not None:
+                time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            series.setdefault(timeframe, {}).setdefault(row["currency_symbol"].upper(), []).append(
+                (np.datetime64(time, "us"), float(row["high"]), float(row["low"]), float(row["close"]))
+            )
+
+    candle_arrays = {}
+    for timeframe, candles_by_symbol in series.items():
+        symbols = list(candles_by_symbol.keys())
+        length = max(len(candles) for candles in candles_by_symbol.values())
+        arrays = {
+            "time": np.full((len(symbols), length), np.datetime64("NaT"), dtype="datetime64[us]"),
+            "high": np.full((len(symbols), length), np.nan),
+            "low": np.full((len(symbols), length), np.nan),
+            "close": np.full((len(symbols), length), np.nan),
+        }
+        for row, symbol in enumerate(symbols):
+            candles = sorted(candles_by_symbol[symbol])
+            # Shorter series are padded at the start, so the latest candles line up
+            start = length - len(candles)
+            time, high, low, close = zip(*candles)
+            arrays["time"][row, start:] = time
+            arrays["high"][row, start:] = high
+            arrays["low"][row, start:] = low
+            arrays["close"][row, start:] = close
+        arrays["symbols"] = np.array(symbols)
+        candle_arrays[timeframe] = arrays
+    return candle_arrays
+
+
+def load_candles_from_npz(path: str, timeframe: datetime.timedelta) -> Dict[datetime.timedelta, CandleArrays]:
+    """
+    Load historical candles for a single timeframe from a NumPy `.npz` file.
+
+    The file should contain a 1-D "symbols" array, and 2-D "high", "low" and "close" arrays
+    of shape (symbols, candles). The "time" array can either be 2-D, or 1-D if all the series
+    share the same candle times. Times are taken to be in UTC.
+
+    :param path: Path to the `.npz` file
+    :param timeframe: The timeframe of the candles
+    :return: A mapping of the timeframe to its candle arrays
+    """
+    with np.load(path, allow_pickle=False) as file:
+        arrays = {
+            "symbols": np.char.upper(file["symbols"].astype(str)),
+            "high": file["high"].astype(np.float64),
+            "low": file["low"].astype(np.float64),
+            "close": file["close"].astype(np.float64),
+        }
+        time = file["time"].astype("datetime64[us]")
+
+    if time.ndim == 1:
+        time = np.broadcast_to(time, arrays["close"].shape)
+    arrays["time"] = time
+    for key in ("time", "high", "low"):
+        if arrays[key].shape != arrays["close"].shape:
+            raise ValueError(f"The shape of '{key}' does not match the shape of 'close'")
+    if arrays["symbols"].shape[0] != arrays["close"].shape[0]:
+        raise ValueError("There should be one symbol per row of 'close'")
+    return {timeframe: arrays}
+
+
+def compute_emas(closes: np.ndarray) -> np.ndarray:
+    """
+    Compute the final EMA of every series, for every EMA period, in a single pass over the candles.
+
+    Each step updates all the periods of all the series at once, so the Python loop only runs
+    once per candle column. The EMAs are computed exactly as `ema.engine.update_series_state` does,
+    so a backfilled state can be continued by the incremental engine. Missing (NaN) candles are skipped.
+
+    :param closes: 2-D array of candle closes of shape (symbols, candles)
+    :return: 2-D array of EMAs of shape (periods, symbols), in the order of `EMA_PERIODS`.
+        Series without any candle have NaN EMAs.
+    """
+    alphas = np.array([EMA_ALPHAS[period] for period in EMA_PERIODS])[:, np.newaxis]
+    emas = np.full((len(EMA_PERIODS), closes.shape[0]), np.nan)
+    seeded = np.zeros(closes.shape[0], dtype=bool)
+    for column in closes.T:
+        valid = ~np.isnan(column)
+        if seeded.all() and valid.all():
+            # Fast path for columns without missing candles
+            emas += alphas * (column - emas)
+            continue
+
+        # Seed series with the close of their first candle
+        first = valid & ~seeded
+        emas[:, first] = column[first]
+        seeded |= valid
+
+        update = valid & ~first
+        emas[:, update] += alphas * (column[update] - emas[:, update])
+    return emas
+
+
+def build_series_states(currencies: Dict, timeframe: datetime.timedelta, arrays: CandleArrays) -> List[EMASeriesState]:
+    """
+    Build the EMA states of a batch of series from their candle arrays.
+
+    :param currencies: A mapping of upper-cased symbols to currencies. Series of unknown currencies are skipped.
+    :param timeframe: The timeframe of the series
+    :param arrays: The candle arrays of the series
+    :return: The EMA states of the series
+    """
+    closes = arrays["close"]
+    valid = ~np.isnan(closes)
+    emas = compute_emas(closes)
+    candle_counts = valid.sum(axis=1)
+    # Index of the last valid candle of each series
+    last_indices = closes.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    rows = np.arange(closes.shape[0])
+    last_closes = closes[rows, last_indices]
+    last_times = arrays["time"][rows, last_indices]
+
+    # The monthly high and low only include the candles
+    # in the same month as the last candle of each series
+    months = arrays["time"].astype("datetime64[M]")
+    in_last_month = valid & (months == months[rows, last_indices][:, np.newaxis])
+    month_highs = np.where(in_last_month, arrays["high"], -np.inf).max(axis=1)
+    month_lows = np.where(in_last_month, arrays["low"], np.inf).min(axis=1)
+
+    states = []
+    for row, symbol in enumerate(arrays["symbols"]):
+        currency = currencies.get(str(symbol).upper(), None)
+        if currency is None or candle_counts[row] == 0:
+            continue
+        state = EMASeriesState(
+            currency=currency,
+            timeframe=timeframe,
+            candle_count=int(candle_counts[row]),
+            last_close=float(last_closes[row]),
+            last_candle_at=last_times[row].astype(datetime.datetime).replace(tzinfo=datetime.timezone.utc),
+            month_high=float(month_highs[row]),
+            month_low=float(month_lows[row]),
+        )
+        for index, period in enumerate(EMA_PERIODS):
+            setattr(state, f"ema{period}", float(emas[index, row]))
+        states.append(state)
+    return states
+
+
+def backfill_ema_states(
+    candle_arrays: Dict[datetime.timedelta, CandleArrays],
+    notify: bool = False
+) -> Tuple[List[EMARecord], List[str]]:
+    """
+    Seed the EMA states and EMA records of many series from their historical candles.
+
+    Existing states and records of the backfilled series are overwritten.
+
+    :param candle_arrays: A mapping of timeframes to candle arrays
+    :param notify: Whether to notify websocket clients of the created and updated records
+    :return: A tuple of the saved records and the symbols of unknown currencies
+    """
+    symbols = {str(symbol) for arrays in candle_arrays.values() for symbol in arrays["symbols"]}
+    currencies = resolve_currencies(list(symbols))
+    unknown_symbols = sorted(symbol for symbol in symbols if symbol.upper() not in currencies)
+
+    records: List[EMARecord] = []
+    for timeframe, arrays in candle_arrays.items():
+        states = build_series_states(currencies, timeframe, arrays)
+        if not states:
+            continue
+        with transaction.atomic():
+            save_series_states(states)
+            records.extend(
+                upsert_ema_records([get_ema_record_data(state) for state in states], notify=notify)
+            )
+    return records, unknown_symbols
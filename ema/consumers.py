@@ -1,33 +1,349 @@
+import asyncio
+import json
+import msgpack
+from typing import Any, Dict, List, Tuple
+from django.conf import settings
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from .event_log import get_current_ema_record_event_seq, get_ema_record_event_messages
+from .filters import EMARecordQSFilterer
+from .models import EMARecord
+from .row_renderers import EMARecordRowRenderer
+from .send_queues import WebsocketSendQueue
+from .snapshots import ema_record_snapshot
+from .subscriptions import EMARecordSubscription, ema_record_event_router
+from .utils import EMA_RECORDS_DATA_NAMESPACE
+from helpers.caching import get_data_version
+from helpers import metrics
+
+
+# Renders the EMA records sent in snapshots from the database
+ema_record_row_renderer = EMARecordRowRenderer()
+
+
+def get_ema_record_sync_records(filters: Dict[str, str], version: int) -> List[Dict]:
+    """
+    Returns the representations of the EMA records that match the filters, newest first.
+
+    Records are listed from the snapshot if it is enabled and holds the data version,
+    and from the database otherwise.
+
+    :param filters: Query parameters supported by `ema.filters.EMARecordQSFilterer`
+    :param version: The EMA records data version the records must include the changes of
+    """
+    if settings.EMA_RECORDS_SNAPSHOT_ENABLED:
+        records = ema_record_snapshot.filter(filters, version=version)
+        if records is not None:
+            return list(records)
+    queryset = EMARecordQSFilterer(filters).apply_filters(
+        EMARecord.objects.select_related("currency").order_by("-timestamp", "-id")
+    )
+    return ema_record_row_renderer.render_many(queryset.values_list(*ema_record_row_renderer.fields))
+
+
+@database_sync_to_async
+def get_ema_record_sync_state(since: int | None, filters: Dict) -> Tuple[int, List[Dict] | None, List[Dict] | None]:
+    """
+    Returns what a connection needs to catch up with the EMA record events.
+
+    The current sequence number is read before the data version, and the data version is bumped
+    before the events of a write are given sequence numbers. So the records, listed at that version
+    or a later one, include every event up to that sequence number. They may also include some
+    later events, which the connection gets again, and which are safe to apply again.
+
+    :param since: The last sequence number the client received, if it is resuming
+    :param filters: The filters of the connection's subscription
+    :return: A tuple of the current sequence number, the buffered messages after `since`
+        (None if the client cannot resume), and the records (None if the client can resume)
+    """
+    seq = get_current_ema_record_event_seq()
+    if since is not None:
+        messages = get_ema_record_event_messages(since, seq)
+        if messages is not None:
+            return seq, messages, None
+    version = get_data_version(EMA_RECORDS_DATA_NAMESPACE)
+    records = get_ema_record_sync_records({key: str(value) for key, value in filters.items()}, version)
+    return seq, None, records
+
 
 
 class EMARecordEventsConsumer(AsyncJsonWebsocketConsumer):
-    """Websocket consumer for EMA record events"""
+    """
+    Websocket consumer for EMA record events
+
+    Connections get every EMA record event by default. To only get the events for some records,
+    send a subscribe message with the same filters supported by the EMA record list endpoint:
+
+    `{"action": "subscribe", "filters": {"watch": "C", "timeframe": "1:00:00"}}`
+
+    Events are sent for records that match the filters before or after they change.
+    Send `{"action": "subscribe", "filters": {}}` to get every event again,
+    or `{"action": "unsubscribe"}` to stop getting events.
+
+    Every event frame has a "seq", the sequence number of the broadcast it is part of. Sequence numbers
+    increase with every broadcast, and connections only get the broadcasts that match their subscription.
+    Broadcasts published by different server processes at the same time can arrive out of sequence
+    order, so clients apply the events of a record in the order of their sequence numbers.
+    On connect, the server sends a snapshot of all the records, as
+    `{"code": "snapshot", "seq": <seq>, "data": [<records>]}`, followed by the events after `seq`.
+
+    - Connect with `?since=<seq>`, the last sequence number the client received, to resume instead.
+      The events missed since then are sent again, or a snapshot if they are no longer buffered.
+    - Connect with `?snapshot=false` to skip the initial snapshot.
+    - Add `"snapshot": true` or `"since": <seq>` to a subscribe message to get a snapshot
+      of the records that match the new filters, or the missed events that match them.
+
+    If an event could not be published in sequence, or was dropped from a full send queue,
+    subscribed connections are sent a new snapshot, which replaces everything the client received before it.
+
+    Clients that request the "msgpack" subprotocol get every frame as a binary MessagePack frame instead,
+    and can send their messages as binary MessagePack frames too.
+
+    Frames are sent through a bounded send queue (see `ema.send_queues.WebsocketSendQueue`),
+    so slow connections do not hold up the events sent to the other connections.
+    Connections closed for lagging behind get the `SLOW_CONSUMER_CLOSE_CODE` close code.
+    """
     channel_layer_alias = 'default'
-      
+    router = ema_record_event_router
+    MSGPACK_SUBPROTOCOL = "msgpack"
+    SLOW_CONSUMER_CLOSE_CODE = 4008
+
     async def connect(self):
-        self.group_name = 'ema_record_updates'
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
+        # Messages for live events are held back while the connection catches up
+        self.pending_messages: List[Dict] | None = None
+        self.send_queue = WebsocketSendQueue(
+            self.send_queue_item,
+            max_size=settings.EMA_RECORDS_WEBSOCKET_SEND_QUEUE_SIZE,
+            policy=settings.EMA_RECORDS_WEBSOCKET_SEND_QUEUE_POLICY,
+            max_lag=settings.EMA_RECORDS_WEBSOCKET_MAX_LAG,
+            resync=self.resync,
+            close=self.close_slow_consumer
         )
-        await self.accept()
+        if self.MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            self.encoding = "msgpack"
+            await self.accept(subprotocol=self.MSGPACK_SUBPROTOCOL)
+        else:
+            self.encoding = "json"
+            await self.accept()
+        self.send_queue.start()
+        await self.router.subscribe(self, EMARecordSubscription())
+
+        query_params = parse_qs(self.scope.get("query_string", b"").decode())
+        since = query_params.get("since", [None])[-1]
+        snapshot = query_params.get("snapshot", ["true"])[-1].lower() != "false"
+        if since is not None or snapshot:
+            await self.sync(since)
 
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        self.router.unsubscribe(self)
+        self.send_queue.stop()
+
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.encoding == "msgpack":
+            try:
+                content = msgpack.unpackb(bytes_data)
+            except Exception:
+                await self.send_json(content={
+                    "code": "error",
+                    "data": {"message": ["Invalid MessagePack frame"]}
+                })
+                return
+            await self.receive_json(content, **kwargs)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
 
 
     async def receive_json(self, content, **kwargs):
+        action = content.get("action", None) if isinstance(content, dict) else None
+        if action == "subscribe":
+            await self.subscribe(
+                content.get("filters", None) or {},
+                since=content.get("since", None),
+                snapshot=content.get("snapshot", False) is True
+            )
+            return
+        if action == "unsubscribe":
+            self.router.unsubscribe(self)
+            await self.send_json(content={"code": "unsubscribed", "data": {}})
+            return
         await self.send_json(content=content)
-    
+
+
+    async def subscribe(self, filters, since=None, snapshot: bool = False):
+        if not isinstance(filters, dict):
+            await self.send_json(content={
+                "code": "error",
+                "data": {"filters": ["Filters should be an object"]}
+            })
+            return
+
+        try:
+            subscription = EMARecordSubscription(filters)
+        except EMARecordSubscription.ParseError as exc:
+            await self.send_json(content={
+                "code": "error",
+                "data": exc.detail
+            })
+            return
+
+        await self.router.subscribe(self, subscription)
+        await self.send_json(content={
+            "code": "subscribed",
+            "data": {"filters": subscription.filters}
+        })
+        if since is not None or snapshot:
+            await self.sync(since, subscription.filters)
+
+
+    async def sync(self, since=None, filters: Dict | None = None):
+        """
+        Catch the connection up with the EMA record events, by sending the events missed since
+        the `since` sequence number, or a snapshot of the records that match the filters.
+        Live events received in the meantime are sent afterwards, without repeating events.
+        """
+        try:
+            since = None if since is None else int(since)
+        except (TypeError, ValueError):
+            await self.send_json(content={
+                "code": "error",
+                "data": {"since": [f"Invalid value '{since}' for since parameter"]}
+            })
+            return
+
+        self.pending_messages = []
+        seq = None
+        try:
+            seq, messages, records = await get_ema_record_sync_state(since, filters or {})
+            if messages is None:
+                await self.send_json(content={
+                    "code": "snapshot",
+                    "seq": seq,
+                    "data": records
+                })
+            else:
+                for message in messages:
+                    message = self.router.filter_message(self, message)
+                    if message is not None:
+                        await self.enqueue(message)
+        finally:
+            pending_messages, self.pending_messages = self.pending_messages, None
+            for message in pending_messages:
+                message_seq = message.get("seq", None)
+                if seq is None or message_seq is None or message_seq > seq:
+                    await self.enqueue(message)
+
+
+    def get_frame(self, message: Dict) -> Dict:
+        """Returns the frame sent to the client for an EMA record updates group message"""
+        if message["type"] == "send.ema_record_updates":
+            # Events collected within the coalescing window are sent as a single frame
+            frame = {
+                "code": "batch",
+                "data": message['data']
+            }
+        else:
+            frame = dict(message['data'])
+        if message.get("seq", None) is not None:
+            frame["seq"] = message["seq"]
+        return frame
+
+
+    def encode(self, content: Any) -> str | bytes:
+        """Encodes a frame with the encoding of the connection"""
+        metrics.increment("websocket.frames.encoded")
+        if self.encoding == "msgpack":
+            return msgpack.packb(content)
+        return json.dumps(content)
+
+
+    def get_encoded_frame(self, message: Dict) -> str | bytes:
+        """
+        Returns the encoded frame for an EMA record updates group message.
+
+        Encoded frames are cached in the message's "frames", which the router shares between
+        the consumers it sends the same message to, so each frame is encoded once per encoding.
+        """
+        frames = message.get("frames", None)
+        if frames is not None and self.encoding in frames:
+            return frames[self.encoding]
+        frame = self.encode(self.get_frame(message))
+        if frames is not None:
+            frames[self.encoding] = frame
+        return frame
+
+
+    async def send_encoded(self, frame: str | bytes, close: bool = False) -> None:
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame, close=close)
+        else:
+            await self.send(text_data=frame, close=close)
+
+
+    async def send_json(self, content, close=False):
+        if close:
+            await self.send_encoded(self.encode(content), close=close)
+            return
+        await self.send_event({"type": "frame", "frame": self.encode(content)})
+
+
+    async def send_event(self, event: Dict) -> None:
+        if self.pending_messages is not None and event.get("type", None) != "frame":
+            self.pending_messages.append(event)
+            return
+        await self.enqueue(event)
+
+
+    async def enqueue(self, event: Dict) -> None:
+        """
+        Add an EMA record updates group message, or a control message, to the send queue.
+        The connection is closed if it is lagging too far behind.
+        """
+        if not self.send_queue.put(event):
+            await self.close_slow_consumer()
+
+
+    async def close_slow_consumer(self) -> None:
+        """Close the connection for lagging too far behind"""
+        metrics.increment("websocket.send_queue.disconnected")
+        self.router.unsubscribe(self)
+        self.send_queue.stop()
+        await self.close(code=self.SLOW_CONSUMER_CLOSE_CODE)
+
+
+    async def send_queue_item(self, item: Dict) -> None:
+        if item["type"] == "frame":
+            await self.send_encoded(item["frame"])
+            return
+        await self.send_encoded(self.get_encoded_frame(item))
+
 
     async def send_ema_record_update(self, event):
-        await self.send_json(content=event['data'])
+        await self.send_event(event)
+
+
+    async def send_ema_record_updates(self, event):
+        await self.send_event(event)
+
+
+    async def send_ema_record_resync(self, event):
+        # An event could not be published in sequence, so the client is sent a new snapshot
+        await self.resync()
+
+
+    async def resync(self) -> None:
+        """
+        Send the client a new snapshot of the records that match its subscription,
+        after it missed events. The snapshot is taken in a task, so the router
+        and the send queue are not held up by the connections' queries.
+        """
+        subscription = self.router.index.subscriptions.get(self, None)
+        if subscription is None:
+            return
+        self.resync_task = asyncio.get_running_loop().create_task(self.sync(filters=subscription.filters))
 
 
 
@@ -0,0 +1,230 @@
+from typing import Any, Dict, List, Tuple
+from django.db import transaction
+from rest_framework import exceptions
+
+from .models import EMARecord, EMASeriesState, TrendChoices
+from .serializers import CandleSerializer
+from .upserts import resolve_currencies, upsert_ema_records
+from .utils import get_series_keys_q
+
+
+EMA_PERIODS = (20, 50, 100, 200)
+
+# Smoothing factor for each EMA period
+EMA_ALPHAS = {period: 2 / (period + 1) for period in EMA_PERIODS}
+
+EMA_SERIES_STATE_UPSERT_FIELDS = [
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "candle_count",
+    "last_close",
+    "last_candle_at",
+    "month_high",
+    "month_low",
+    "updated_at",
+]
+
+
+def update_series_state(state: EMASeriesState, candle: Dict) -> None:
+    """
+    Update the EMA state of a series with a new closed candle, in constant time.
+
+    Every EMA is updated in a single pass using `ema = alpha * close + (1 - alpha) * ema`,
+    where `alpha = 2 / (period + 1)`. A series' EMAs are seeded with the close of its first candle.
+
+    :param state: The state of the series the candle belongs to
+    :param candle: Validated candle data
+    """
+    close: float = candle["close"]
+    for period, alpha in EMA_ALPHAS.items():
+        attr = f"ema{period}"
+        previous_ema = getattr(state, attr)
+        if previous_ema is None:
+            setattr(state, attr, close)
+            continue
+        setattr(state, attr, previous_ema + alpha * (close - previous_ema))
+
+    candle_time = candle["time"]
+    previous_candle_time = state.last_candle_at
+    if (
+        previous_candle_time is None
+        or (previous_candle_time.year, previous_candle_time.month) != (candle_time.year, candle_time.month)
+    ):
+        # Start tracking the high and low of a new month
+        state.month_high = candle["high"]
+        state.month_low = candle["low"]
+    else:
+        state.month_high = max(state.month_high, candle["high"])
+        state.month_low = min(state.month_low, candle["low"])
+
+    state.candle_count += 1
+    state.last_close = close
+    state.last_candle_at = candle_time
+    return None
+
+
+def _greater_than(value1: float | None, value2: float | None) -> bool:
+    if value1 is None or value2 is None:
+        return False
+    return value1 > value2
+
+
+def get_ema_record_data(state: EMASeriesState) -> Dict[str, Any]:
+    """
+    Derive the EMA record data for a series from its EMA state.
+
+    An EMA is only reported once the series has at least as many candles as the EMA's period.
+    Comparisons involving an unreported EMA are False.
+
+    The trend is upwards when EMA20 > EMA50 > EMA100, downwards when
+    EMA20 < EMA50 < EMA100 and sideways otherwise.
+
+    :param state: The state of the series
+    :return: Validated EMA record data that can be upserted
+    """
+    emas = {
+        period: getattr(state, f"ema{period}") if state.candle_count >= period else None
+        for period in EMA_PERIODS
+    }
+    twenty_greater_than_fifty = _greater_than(emas[20], emas[50])
+    fifty_greater_than_hundred = _greater_than(emas[50], emas[100])
+    if twenty_greater_than_fifty and fifty_greater_than_hundred:
+        trend = TrendChoices.UPWARDS
+    elif _greater_than(emas[50], emas[20]) and _greater_than(emas[100], emas[50]):
+        trend = TrendChoices.DOWNWORDS
+    else:
+        trend = TrendChoices.SIDEWAYS
+
+    return {
+        "currency": state.currency,
+        "timeframe": state.timeframe,
+        "close": state.last_close,
+        "ema20": emas[20],
+        "ema50": emas[50],
+        "ema100": emas[100],
+        "ema200": emas[200],
+        "trend": trend,
+        "monhigh": state.month_high,
+        "monlow": state.month_low,
+        "monmid": (state.month_high + state.month_low) / 2,
+        "twenty_greater_than_fifty": twenty_greater_than_fifty,
+        "fifty_greater_than_hundred": fifty_greater_than_hundred,
+        "hundred_greater_than_twohundred": _greater_than(emas[100], emas[200]),
+        "close_greater_than_hundred": _greater_than(state.last_close, emas[100]),
+    }
+
+
+def get_series_states(keys: List[Tuple[Any, Any]]) -> Dict[Tuple[Any, Any], EMASeriesState]:
+    """
+    Fetch and lock the EMA states for the given (currency_id, timeframe) keys.
+
+    Empty states are first inserted for the series that have none, with
+    `INSERT ... ON CONFLICT DO NOTHING`, so the states of new series are locked too.
+    Otherwise, concurrent ingestion of the first candles of a new series would
+    both start from an empty state, and the state saved last would drop the other's candles.
+    Must be called in a transaction.
+
+    :param keys: (currency_id, timeframe) pairs
+    :return: A mapping of (currency_id, timeframe) pairs to states
+    """
+    if not keys:
+        return {}
+
+    # Rows are inserted and locked in a consistent order, so concurrent ingestion does not deadlock
+    sorted_keys = sorted(set(keys), key=lambda key: (str(key[0]), key[1]))
+    EMASeriesState.objects.bulk_create(
+        [EMASeriesState(currency_id=currency_id, timeframe=timeframe) for currency_id, timeframe in sorted_keys],
+        ignore_conflicts=True,
+    )
+    # Only the requested series are locked, so ingests of unrelated series do not wait for each other
+    states = EMASeriesState.objects.select_related("currency").select_for_update(of=("self",)).filter(
+        get_series_keys_q(sorted_keys)
+    ).order_by("currency_id", "timeframe")
+    return {(state.currency_id, state.timeframe): state for state in states}
+
+
+def save_series_states(states: List[EMASeriesState]) -> None:
+    """
+    Save EMA states using a single `INSERT ... ON CONFLICT (currency_id, timeframe) DO UPDATE` query.
+
+    :param states: The states to save. Only one state should be provided per currency and timeframe.
+    """
+    EMASeriesState.objects.bulk_create(
+        states,
+        update_conflicts=True,
+        unique_fields=["currency", "timeframe"],
+        update_fields=EMA_SERIES_STATE_UPSERT_FIELDS,
+    )
+    return None
+
+
+def ingest_candles(data: List[Dict]) -> Tuple[List[EMARecord], Dict[int, Dict]]:
+    """
+    Update the EMA states and EMA records of the series the given candles belong to.
+
+    The candles of each series are applied in time order. Candles that are not newer
+    than the last candle applied to their series are rejected, so candles can be
+    safely re-sent. The updated states and records are saved in the same transaction.
+
+    :param data: A list of raw candle payloads
+    :return: A tuple of the saved EMA records and a mapping of
+        the indices of invalid candles to their errors
+    """
+    serializer = CandleSerializer()
+    errors: Dict[int, Dict] = {}
+    validated_candles: Dict[int, Dict] = {}
+    for index, item in enumerate(data):
+        try:
+            validated_candles[index] = dict(serializer.run_validation(item))
+        except exceptions.ValidationError as exc:
+            errors[index] = exc.detail
+
+    currencies = resolve_currencies(
+        [candle["currency_symbol"] for candle in validated_candles.values()]
+    )
+    candles_by_key: Dict[Tuple[Any, Any], List[Tuple[int, Dict]]] = {}
+    for index, candle in validated_candles.items():
+        currency = currencies.get(candle["currency_symbol"].upper(), None)
+        if currency is None:
+            errors[index] = {
+                "currency_symbol": [f"Currency symbol provided, '{candle['currency_symbol']}', is not recognized."]
+            }
+            continue
+        candle["currency"] = currency
+        candles_by_key.setdefault((currency.pk, candle["timeframe"]), []).append((index, candle))
+
+    if not candles_by_key:
+        return [], errors
+
+    with transaction.atomic():
+        # Lock the states, including those of new series, so concurrent ingestion
+        # of the same series cannot apply candles to a stale state
+        states = get_series_states(list(candles_by_key.keys()))
+        updated_states: List[EMASeriesState] = []
+        for key, indexed_candles in candles_by_key.items():
+            state = states.get(key, None)
+            if state is None:
+                currency = indexed_candles[0][1]["currency"]
+                state = EMASeriesState(currency=currency, timeframe=key[1])
+
+            updated = False
+            for index, candle in sorted(indexed_candles, key=lambda indexed_candle: indexed_candle[1]["time"]):
+                if state.last_candle_at is not None and candle["time"] <= state.last_candle_at:
+                    errors[index] = {
+                        "time": ["Candle is not newer than the last candle received for this currency and timeframe."]
+                    }
+                    continue
+                update_series_state(state, candle)
+                updated = True
+
+            if updated:
+                updated_states.append(state)
+
+        if not updated_states:
+            return [], errors
+
+        save_series_states(updated_states)
+        records = upsert_ema_records([get_ema_record_data(state) for state in updated_states])
+    return records, errors
@@ -0,0 +1,70 @@
+from typing import Dict, List
+from django.conf import settings
+from django.core.cache import cache
+
+
+EMA_RECORD_EVENT_SEQUENCE_KEY = "ema_record_events:seq"
+# Group message sent when a message could not be published, so clients get a new snapshot
+EMA_RECORD_RESYNC_MESSAGE_TYPE = "send.ema_record_resync"
+
+
+def get_ema_record_event_key(seq: int) -> str:
+    return f"ema_record_events:{seq}"
+
+
+def get_current_ema_record_event_seq() -> int:
+    """
+    Returns the sequence number of the last EMA record updates message that was published,
+    or 0 if none has been published yet.
+    """
+    return cache.get(EMA_RECORD_EVENT_SEQUENCE_KEY, 0)
+
+
+def log_ema_record_event_message(message: Dict) -> int:
+    """
+    Assign the next sequence number to an EMA record updates message, and keep the message
+    in the recent events buffer, so clients that reconnect can resume from their last sequence number.
+
+    Sequence numbers and the buffer are shared through the default cache, so they are
+    the same for all processes. Buffered messages expire after `EMA_RECORDS_WEBSOCKET_RESUME_TIMEOUT` seconds.
+
+    Messages are given their sequence numbers without a lock, so messages published by different
+    processes at the same time can reach the channel layer out of sequence order.
+
+    :param message: The channel layer message. Its "seq" is set in place.
+    :return: The sequence number of the message
+    """
+    try:
+        seq = cache.incr(EMA_RECORD_EVENT_SEQUENCE_KEY)
+    except ValueError:
+        # The sequence does not exist yet. It never expires, so it never
+        # restarts at a number that was already used
+        cache.add(EMA_RECORD_EVENT_SEQUENCE_KEY, 0, timeout=None)
+        seq = cache.incr(EMA_RECORD_EVENT_SEQUENCE_KEY)
+    message["seq"] = seq
+    cache.set(
+        get_ema_record_event_key(seq),
+        message,
+        timeout=settings.EMA_RECORDS_WEBSOCKET_RESUME_TIMEOUT
+    )
+    return seq
+
+
+def get_ema_record_event_messages(after: int, until: int) -> List[Dict] | None:
+    """
+    Returns the buffered EMA record updates messages with sequence numbers after `after`, up to `until`.
+
+    :param after: The last sequence number the client received
+    :param until: The last sequence number to return
+    :return: The messages in order, or None if any of them is no longer buffered,
+        in which case the client has to start over from a snapshot.
+    """
+    if after > until or until - after > settings.EMA_RECORDS_WEBSOCKET_RESUME_BUFFER_SIZE:
+        return None
+    keys = [get_ema_record_event_key(seq) for seq in range(after + 1, until + 1)]
+    if not keys:
+        return []
+    messages = cache.get_many(keys)
+    if len(messages) != len(keys):
+        return None
+    return [messages[key] for key in keys]
@@ -2,9 +2,12 @@ import functools
 from typing import Any, List, Mapping, Generator
 import itertools
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.dateparse import parse_duration
 
 from helpers.queryset_filterers import QueryDictQuerySetFilterer
+from .utils import get_watch_code
+from currency.models import Currency
 
 
 WATCH_VALUE_QUERY_FILTERS = {
@@ -95,10 +98,34 @@ def sideways_watch_filters():
             yield filter
 
 
+# The watch filters above, as watch codes (see `ema.utils.get_watch_code`).
+# These are computed once, so watch filters do not need to be regenerated on every request
+WATCH_VALUE_CODES = {
+    watch_value: get_watch_code(filters) for watch_value, filters in WATCH_VALUE_QUERY_FILTERS.items()
+}
+
+SIDEWAYS_WATCH_CODES = sorted({get_watch_code(filters) for filters in sideways_watch_filters()})
+
+
+
+
+def split_filter_values(value: str) -> List[str]:
+    """
+    Split a comma-separated filter value into its values, e.g. "BTCUSD,ETHUSD" into ["BTCUSD", "ETHUSD"].
+    Blank values are dropped.
+    """
+    return [item.strip() for item in str(value).split(",") if item.strip()]
+
+
 
 
 class EMARecordQSFilterer(QueryDictQuerySetFilterer):
-    """Filters EmaRecord queryset by request query dict"""
+    """
+    Filters EmaRecord queryset by request query dict
+
+    The `currency` and `timeframe` filters accept comma-separated lists of values,
+    and match records with any of the values.
+    """
     def parse_ema20(self, value: str) -> models.Q:
         return models.Q(ema20=float(value))
     
@@ -112,26 +139,34 @@ class EMARecordQSFilterer(QueryDictQuerySetFilterer):
         return models.Q(ema200=float(value))
     
     def parse_currency(self, value: str) -> models.Q:
-        return models.Q(currency__symbol__iexact=value) | models.Q(currency__exchange__iexact=value)
+        # Match the upper-cased symbols and exchanges with a single IN lookup each,
+        # in a subquery, so any number of currencies are filtered in the same query
+        values = {item.upper() for item in split_filter_values(value)}
+        currency_ids = Currency.objects.annotate(
+            symbol_upper=Upper("symbol"),
+            exchange_upper=Upper("exchange")
+        ).filter(
+            models.Q(symbol_upper__in=values) | models.Q(exchange_upper__in=values)
+        ).values("pk")
+        return models.Q(currency_id__in=currency_ids)
     
     def parse_timeframe(self, value: str) -> models.Q:
-        return models.Q(timeframe=parse_duration(value))
+        # Values that are not valid durations match no records
+        timeframes = [parse_duration(item) for item in split_filter_values(value)]
+        return models.Q(timeframe__in=[timeframe for timeframe in timeframes if timeframe is not None])
     
     def parse_trend(self, value: str) -> models.Q:
         return models.Q(trend=int(value))
     
     def parse_watch(self, value: str) -> models.Q:
-        q = models.Q()
-        # If value is 'sideways', add all possible sideways watch filters
+        # If value is 'sideways', match any of the sideways watch codes
         if value.lower().strip() == "sideways":
-            for filter in sideways_watch_filters():
-                q.add(models.Q(**filter), models.Q.OR)
-        else:
-            filters = WATCH_VALUE_QUERY_FILTERS.get(value.upper().strip(), None)
-            if filters is None:
-                raise self.ParseError([f"Invalid value '{value}' for watch parameter"])
-            q = models.Q(**filters)
-        return q
+            return models.Q(watch_code__in=SIDEWAYS_WATCH_CODES)
+        
+        watch_code = WATCH_VALUE_CODES.get(value.upper().strip(), None)
+        if watch_code is None:
+            raise self.ParseError([f"Invalid value '{value}' for watch parameter"])
+        return models.Q(watch_code=watch_code)
     
     def parse_category(self, value: str) -> models.Q:
         return models.Q(currency__category__iexact=value)
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_duration
+
+from ema.backfill import load_candles_from_csv, load_candles_from_npz, backfill_ema_states
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds the EMA states and EMA records of many currencies from their historical candles. "
+        "Candles are loaded into 2-D NumPy arrays and the EMAs of all the series are computed together."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "path", type=str,
+            help=(
+                "Path to a CSV file with the columns currency_symbol, timeframe, time, high, low and close, "
+                "or to a NumPy .npz file with the arrays symbols, time, high, low and close"
+            )
+        )
+        parser.add_argument(
+            "--timeframe", type=str, default=None,
+            help="Timeframe of the candles in a .npz file, in the format \"HH:MM:SS\" e.g. \"1:00:00\" for 1 hour"
+        )
+        parser.add_argument(
+            "--notify", action="store_true",
+            help="Notify websocket clients of the created and updated EMA records"
+        )
+
+    def handle(self, *args, **options) -> None:
+        path: str = options["path"]
+        start = time.perf_counter()
+        if path.endswith(".npz"):
+            timeframe = parse_duration(options["timeframe"] or "")
+            if timeframe is None:
+                raise CommandError("A valid --timeframe is required when loading candles from a .npz file")
+            candle_arrays = load_candles_from_npz(path, timeframe)
+        elif path.endswith(".csv"):
+            candle_arrays = load_candles_from_csv(path)
+        else:
+            raise CommandError("Candles can only be loaded from .csv or .npz files")
+
+        series_count = sum(arrays["close"].shape[0] for arrays in candle_arrays.values())
+        self.stdout.write(f"Loaded {series_count} series in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        records, unknown_symbols = backfill_ema_states(candle_arrays, notify=options["notify"])
+        if unknown_symbols:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(unknown_symbols)} unknown currency symbol(s): {', '.join(unknown_symbols)}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {len(records)} EMA record(s) in {time.perf_counter() - start:.2f}s"
+        ))
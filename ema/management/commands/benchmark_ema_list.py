@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Callable, Dict, List
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, override_settings
+from rest_framework_api_key.models import APIKey
+
+from ema.models import EMARecord
+from ema.views import AsyncEMARecordListView, EMARecordListCreateAPIView
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput and latency of the async EMA record list view with the sync view, "
+        "under concurrent GET requests made in-process, the way the ASGI handler runs each view. "
+        "A temporary API key is created for the benchmark and deleted afterwards."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--requests", type=int, default=2000,
+            help="Number of requests to make per view and concurrency level"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, nargs="+", default=[1, 50, 500],
+            help="Numbers of requests in flight at once"
+        )
+        parser.add_argument(
+            "--query", type=str, default="limit=50",
+            help="Query string of the requests, e.g. 'timeframe=1:00:00&limit=50'"
+        )
+        parser.add_argument(
+            "--no-response-cache", action="store_true",
+            help="Disable the EMA record response cache, so every request lists the records"
+        )
+
+    def handle(self, *args, **options) -> None:
+        self.stdout.write(f"{EMARecord.objects.count()} EMA records | query: '{options['query']}'")
+        api_key, key = APIKey.objects.create_key(name="EMA list benchmark")
+        timeout = 0 if options["no_response_cache"] else settings.EMA_RECORDS_RESPONSE_CACHE_TIMEOUT
+        try:
+            with override_settings(EMA_RECORDS_RESPONSE_CACHE_TIMEOUT=timeout):
+                asyncio.run(self.run_benchmarks(key, options))
+        finally:
+            api_key.delete()
+        self.stdout.write(self.style.SUCCESS("Benchmark complete."))
+
+
+    async def run_benchmarks(self, key: str, options: Dict) -> None:
+        factory = AsyncRequestFactory()
+        path = f"/api/v1/ema-records/?{options['query']}"
+        make_request = lambda: factory.get(path, headers={"X-API-KEY": key})
+
+        # Sync views are run, and their responses rendered, in the single thread-sensitive executor under ASGI
+        list_view = EMARecordListCreateAPIView.as_view()
+        sync_view = sync_to_async(lambda request: list_view(request).render())
+        async_view = AsyncEMARecordListView.as_view()
+        views = {
+            "sync": lambda: sync_view(make_request()),
+            "async": lambda: async_view(make_request()),
+        }
+        # Warm up the API key verification cache, the snapshot and the response cache
+        for call in views.values():
+            await call()
+
+        for concurrency in options["concurrency"]:
+            results = {}
+            for label, call in views.items():
+                results[label] = await self.run_benchmark(call, options["requests"], concurrency)
+            self.stdout.write(
+                f"concurrency {concurrency}: " + " | ".join(
+                    f"{label}: {rate:,.0f} req/sec, p50 {p50:.1f}ms, p99 {p99:.1f}ms"
+                    for label, (rate, p50, p99) in results.items()
+                ) + f" | speedup: {results['async'][0] / results['sync'][0]:.1f}x"
+            )
+
+
+    async def run_benchmark(self, call: Callable, request_count: int, concurrency: int):
+        """
+        Make `request_count` requests, with at most `concurrency` requests in flight at once
+
+        :return: A tuple of the requests per second, and the 50th and 99th percentile latencies in milliseconds
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+
+        async def make_request() -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await call()
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Request failed with status {response.status_code}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(make_request() for _ in range(request_count)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return (
+            request_count / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        )
@@ -0,0 +1,99 @@
+import datetime
+import random
+import time
+import uuid
+from typing import Callable, List, Tuple
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from currency.models import Currency
+from ema.models import EMARecord, TrendChoices
+from ema.row_renderers import EMARecordRowRenderer
+from ema.serializers import EMARecordSerializer
+
+
+
+def make_rows(count: int) -> List[Tuple]:
+    """Returns `count` synthetic EMA record rows, with the fields of `EMARecordRowRenderer().fields`"""
+    now = timezone.now()
+    rows = []
+    for index in range(count):
+        close = random.uniform(1, 1000)
+        watch_values = [random.random() > 0.5 for _ in range(4)]
+        rows.append((
+            uuid.uuid4(),
+            datetime.timedelta(hours=random.choice([1, 4, 24])),
+            close,
+            *(None if random.random() < 0.1 else close * random.uniform(0.9, 1.1) for _ in range(4)),
+            random.choice(TrendChoices.values),
+            close * 1.2,
+            close * 0.8,
+            close,
+            *watch_values,
+            now - datetime.timedelta(seconds=index),
+            now,
+            f"SYM{index}",
+            "Crypto",
+            "Coins",
+            "BINANCE",
+        ))
+    return rows
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the time taken to render EMA record list pages with the `EMARecordSerializer` "
+        "and with the `EMARecordRowRenderer`, and checks that both render the same JSON. "
+        "Synthetic records are used, so no database records are needed."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--rows", type=int, nargs="+", default=[50, 500, 5000],
+            help="Numbers of records per page"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Number of times each page is rendered. The fastest time is reported"
+        )
+
+    def handle(self, *args, **options) -> None:
+        renderer = EMARecordRowRenderer()
+        json_renderer = JSONRenderer()
+        for count in options["rows"]:
+            rows = make_rows(count)
+            # Model instances are built beforehand, as the serializer gets them from the queryset
+            records = []
+            for row in rows:
+                values = dict(zip(renderer.fields, row))
+                currency = Currency(**{
+                    field[len("currency__"):]: values.pop(field) for field in list(values)
+                    if field.startswith("currency__")
+                })
+                records.append(EMARecord(currency=currency, **values))
+
+            serialized = json_renderer.render(EMARecordSerializer(records, many=True).data)
+            rendered = json_renderer.render(renderer.render_many(rows))
+            if serialized != rendered:
+                raise CommandError(f"Rendered JSON differs from the serializer's for {count} rows")
+
+            serializer_time = self.time(lambda: EMARecordSerializer(records, many=True).data, options["repeat"])
+            renderer_time = self.time(lambda: renderer.render_many(rows), options["repeat"])
+            self.stdout.write(
+                f"{count} rows: serializer {serializer_time * 1000:.2f}ms | "
+                f"row renderer {renderer_time * 1000:.2f}ms | "
+                f"speedup: {serializer_time / renderer_time:.1f}x"
+            )
+        self.stdout.write(self.style.SUCCESS("Benchmark complete."))
+
+
+    def time(self, call: Callable, repeat: int) -> float:
+        """Returns the fastest time taken by `call`, in seconds"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
@@ -0,0 +1,111 @@
+import time
+import random
+from typing import Dict, List
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ema.serializers import EMARecordSerializer
+from ema.upserts import bulk_upsert_ema_records
+from currency.models import Currency, Categories
+
+
+TIMEFRAMES = ["0:05:00", "0:15:00", "0:30:00", "1:00:00", "4:00:00", "1 00:00:00"]
+
+
+def make_payload(symbol: str, timeframe: str) -> Dict:
+    close = random.uniform(1, 1000)
+    return {
+        "currency_symbol": symbol,
+        "timeframe": timeframe,
+        "close": close,
+        "ema20": close * random.uniform(0.9, 1.1),
+        "ema50": close * random.uniform(0.9, 1.1),
+        "ema100": close * random.uniform(0.9, 1.1),
+        "ema200": close * random.uniform(0.9, 1.1),
+        "trend": random.choice(["1", "-1", "0"]),
+        "monhigh": close * 1.2,
+        "monlow": close * 0.8,
+        "monmid": close,
+        "20>50": random.choice([True, False]),
+        "50>100": random.choice([True, False]),
+        "100>200": random.choice([True, False]),
+        "close>100": random.choice([True, False]),
+    }
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the write throughput (rows/sec) of the per-record EMA record create path "
+        "with the bulk upsert path. All changes are rolled back when the benchmark completes."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--symbols", type=int, default=500,
+            help="Number of temporary currencies to create for the benchmark"
+        )
+        parser.add_argument(
+            "--timeframes", type=int, default=len(TIMEFRAMES), choices=range(1, len(TIMEFRAMES) + 1),
+            help="Number of timeframes to write per currency"
+        )
+
+    def handle(self, *args, **options) -> None:
+        symbol_count: int = options["symbols"]
+        timeframes = TIMEFRAMES[:options["timeframes"]]
+
+        with transaction.atomic():
+            Currency.objects.bulk_create([
+                Currency(
+                    symbol=f"BENCH{index}",
+                    category=Categories.CRYPTO,
+                    subcategory="Benchmark",
+                    exchange="BENCH"
+                )
+                for index in range(symbol_count)
+            ])
+            symbols = [f"BENCH{index}" for index in range(symbol_count)]
+
+            for label in ("insert", "update"):
+                if label == "update":
+                    # Seed existing records so that both paths update existing records
+                    bulk_upsert_ema_records([make_payload(symbol, timeframe) for symbol in symbols for timeframe in timeframes])
+
+                payloads = [make_payload(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+                per_record_rate = self.run_rolled_back(self.time_per_record_path, payloads)
+                bulk_rate = self.run_rolled_back(self.time_bulk_path, payloads)
+                self.stdout.write(
+                    f"{label}: {len(payloads)} rows | "
+                    f"per-record: {per_record_rate:,.0f} rows/sec | "
+                    f"bulk: {bulk_rate:,.0f} rows/sec | "
+                    f"speedup: {bulk_rate / per_record_rate:.1f}x"
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS("Benchmark complete. All changes were rolled back."))
+
+
+    def run_rolled_back(self, func, payloads: List[Dict]) -> float:
+        """Run the benchmark function in a savepoint that is rolled back afterwards"""
+        sid = transaction.savepoint()
+        try:
+            return func(payloads)
+        finally:
+            transaction.savepoint_rollback(sid)
+
+
+    def time_per_record_path(self, payloads: List[Dict]) -> float:
+        start = time.perf_counter()
+        for payload in payloads:
+            serializer = EMARecordSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        return len(payloads) / (time.perf_counter() - start)
+
+
+    def time_bulk_path(self, payloads: List[Dict]) -> float:
+        start = time.perf_counter()
+        records, errors = bulk_upsert_ema_records(payloads)
+        if errors:
+            raise RuntimeError(f"Bulk upsert failed with errors: {errors}")
+        return len(payloads) / (time.perf_counter() - start)
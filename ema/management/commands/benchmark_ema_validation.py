@@ -0,0 +1,115 @@
+import random
+import time
+from typing import Any, Callable, Dict, List
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from ema.serializers import EMARecordSerializer
+from ema.validators import EMARecordIngestValidator
+
+
+WATCH_VALUE_NAMES = [
+    ("20>50", "twenty_greater_than_fifty"),
+    ("50>100", "fifty_greater_than_hundred"),
+    ("100>200", "hundred_greater_than_twohundred"),
+    ("close>100", "close_greater_than_hundred"),
+]
+
+# Changes that make a payload invalid, or valid in less common ways
+PAYLOAD_VARIANTS = [
+    lambda payload: payload.pop("close"),
+    lambda payload: payload.update(close=None),
+    lambda payload: payload.update(close="abc"),
+    lambda payload: payload.update(close="12.5"),
+    lambda payload: payload.update(ema200=None),
+    lambda payload: payload.pop("ema20"),
+    lambda payload: payload.update(trend="2"),
+    lambda payload: payload.update(trend=-1),
+    lambda payload: payload.update(timeframe="1 hour"),
+    lambda payload: payload.update(timeframe=3600),
+    lambda payload: payload.update(currency_symbol=""),
+    lambda payload: payload.update(currency_symbol=["BTCUSD"]),
+    lambda payload: payload.update(currency_symbol="  btcusd "),
+    lambda payload: payload.update(currency_symbol="BTC\x00USD"),
+    lambda payload: payload.update(currency_symbol="BTCÜSD"),
+    lambda payload: payload.update({"20>50": "yes", "twenty_greater_than_fifty": False}),
+    lambda payload: payload.update({"50>100": "maybe"}),
+]
+
+
+def make_payload(index: int) -> Dict:
+    close = random.uniform(1, 1000)
+    payload = {
+        "currency_symbol": f"SYM{index}",
+        "timeframe": random.choice(["1:00:00", "4:00:00", "1 00:00:00"]),
+        "close": close,
+        "ema20": close * random.uniform(0.9, 1.1),
+        "ema50": close * random.uniform(0.9, 1.1),
+        "ema100": close * random.uniform(0.9, 1.1),
+        "ema200": close * random.uniform(0.9, 1.1),
+        "trend": random.choice(["1", "-1", "0"]),
+        "monhigh": close * 1.2,
+        "monlow": close * 0.8,
+        "monmid": close,
+    }
+    # Watch values are sent by their external or internal names
+    for external_name, internal_name in WATCH_VALUE_NAMES:
+        payload[random.choice([external_name, internal_name])] = random.random() > 0.5
+    return payload
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the time taken to validate EMA record payloads with the `EMARecordSerializer` "
+        "and with the `EMARecordIngestValidator`, and checks that both give the same results and errors."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--payloads", type=int, default=10000,
+            help="Number of valid payloads to validate"
+        )
+
+    def handle(self, *args, **options) -> None:
+        serializer = EMARecordSerializer()
+        validator = EMARecordIngestValidator(serializer)
+
+        payloads = [make_payload(index) for index in range(options["payloads"])]
+        variants = []
+        for index, change in enumerate(PAYLOAD_VARIANTS):
+            payload = make_payload(index)
+            change(payload)
+            variants.append(payload)
+        checked_payloads = payloads[:100] + variants
+        for payload in checked_payloads:
+            expected = self.get_result(lambda: dict(serializer.run_validation(payload)))
+            result = self.get_result(lambda: validator.validate(payload))
+            if result != expected:
+                raise CommandError(f"Validation results differ for {payload}: {result} != {expected}")
+        self.stdout.write(f"Results and errors match for {len(checked_payloads)} payloads")
+
+        serializer_time = self.time(lambda: [serializer.run_validation(payload) for payload in payloads])
+        validator_time = self.time(lambda: [validator.validate(payload) for payload in payloads])
+        self.stdout.write(
+            f"{len(payloads)} payloads: "
+            f"serializer {serializer_time / len(payloads) * 1e6:.1f}us/record | "
+            f"validator {validator_time / len(payloads) * 1e6:.1f}us/record | "
+            f"speedup: {serializer_time / validator_time:.1f}x"
+        )
+        self.stdout.write(self.style.SUCCESS("Benchmark complete."))
+
+
+    def get_result(self, validate: Callable[[], Dict]) -> Any:
+        """Returns the validated data, or the errors"""
+        try:
+            return validate()
+        except ValidationError as exc:
+            return {"errors": exc.detail}
+
+
+    def time(self, call: Callable[[], List]) -> float:
+        """Returns the time taken by `call`, in seconds"""
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
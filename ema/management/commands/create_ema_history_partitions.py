@@ -0,0 +1,75 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ema.models import EMARecordHistory
+
+
+def add_months(date: datetime.date, months: int) -> datetime.date:
+    month_index = date.month - 1 + months
+    return datetime.date(date.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates monthly partitions of the EMA record history table, from the current month up to a number of months ahead. "
+        "Rows that were written to the default partition for these months are moved into the new partitions. "
+        "Run this regularly (e.g. daily) so that new rows are always written to a monthly partition."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--months-ahead", type=int, default=3,
+            help="Number of months after the current month to create partitions for"
+        )
+        parser.add_argument(
+            "--months-behind", type=int, default=0,
+            help="Number of months before the current month to create partitions for"
+        )
+
+    def handle(self, *args, **options) -> None:
+        table = EMARecordHistory._meta.db_table
+        current_month = timezone.now().date().replace(day=1)
+
+        for offset in range(-options["months_behind"], options["months_ahead"] + 1):
+            start = add_months(current_month, offset)
+            end = add_months(start, 1)
+            partition = f"{table}_p{start.year}_{start.month:02d}"
+            if self.create_partition(table, partition, start, end):
+                self.stdout.write(self.style.SUCCESS(f"Created partition {partition} for [{start}, {end})"))
+
+
+    def create_partition(self, table: str, partition: str, start: datetime.date, end: datetime.date) -> bool:
+        """
+        Create a partition of `table` for rows with `ts` in [start, end), if it does not exist.
+
+        The partition is created as a standalone table, rows in the range are moved into it from
+        the default partition, and it is then attached. Attaching fails if the default partition
+        still has rows in the range, so this must run in a single transaction.
+
+        :return: True if the partition was created, False if it already exists.
+        """
+        quote_name = connection.ops.quote_name
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [partition])
+            if cursor.fetchone()[0] is not None:
+                return False
+
+            cursor.execute(
+                f"CREATE TABLE {quote_name(partition)} "
+                f"(LIKE {quote_name(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+            cursor.execute(
+                f"WITH moved AS ("
+                f"DELETE FROM {quote_name(table + '_default')} WHERE ts >= %s AND ts < %s RETURNING *"
+                f") INSERT INTO {quote_name(partition)} SELECT * FROM moved",
+                [start, end]
+            )
+            cursor.execute(
+                f"ALTER TABLE {quote_name(table)} ATTACH PARTITION {quote_name(partition)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, end]
+            )
+        return True
@@ -0,0 +1,50 @@
+from __future__ import annotations
+from typing import Iterable, List, TYPE_CHECKING
+from django.db import models
+
+if TYPE_CHECKING:
+    from .models import EMARecord, EMARecordHistory
+
+
+# Fields copied from an EMA record into its history
+EMA_RECORD_HISTORY_FIELDS = [
+    "currency_id",
+    "timeframe",
+    "close",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "trend",
+    "monhigh",
+    "monlow",
+    "monmid",
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+]
+
+
+class EMARecordHistoryManager(models.Manager):
+    """Custom manager for the `EMARecordHistory` model."""
+
+    def record(self, records: Iterable[EMARecord]) -> List[EMARecordHistory]:
+        """
+        Append the current values of the given EMA records to the history, in a single query.
+
+        Should be called in the same transaction in which the records are saved.
+
+        :param records: Saved EMA records
+        :return: The created history rows
+        """
+        history = [
+            self.model(
+                ts=record.updated_at,
+                **{field: getattr(record, field) for field in EMA_RECORD_HISTORY_FIELDS}
+            )
+            for record in records
+        ]
+        if not history:
+            return []
+        return self.bulk_create(history)
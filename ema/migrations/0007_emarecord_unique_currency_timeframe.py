@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-17 00:57
+
+from django.db import migrations, models
+
+
+def delete_duplicate_ema_records(apps, schema_editor):
+    """
+    Keep only the most recently updated record for each currency and timeframe,
+    so that the unique constraint can be added.
+    """
+    EMARecord = apps.get_model("ema", "EMARecord")
+    seen = set()
+    duplicate_ids = []
+    records = EMARecord.objects.order_by("-updated_at").values_list("id", "currency_id", "timeframe")
+    for record_id, currency_id, timeframe in records.iterator():
+        if (currency_id, timeframe) in seen:
+            duplicate_ids.append(record_id)
+            continue
+        seen.add((currency_id, timeframe))
+
+    if duplicate_ids:
+        EMARecord.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+        ('ema', '0006_alter_emarecord_currency'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_ema_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='emarecord',
+            constraint=models.UniqueConstraint(fields=('currency', 'timeframe'), name='unique_ema_record_per_currency_timeframe'),
+        ),
+    ]
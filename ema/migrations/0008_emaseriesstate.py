@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:01
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+        ('ema', '0007_emarecord_unique_currency_timeframe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EMASeriesState',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('timeframe', models.DurationField()),
+                ('ema20', models.FloatField(blank=True, null=True)),
+                ('ema50', models.FloatField(blank=True, null=True)),
+                ('ema100', models.FloatField(blank=True, null=True)),
+                ('ema200', models.FloatField(blank=True, null=True)),
+                ('candle_count', models.PositiveIntegerField(default=0)),
+                ('last_close', models.FloatField(blank=True, null=True)),
+                ('last_candle_at', models.DateTimeField(blank=True, null=True)),
+                ('month_high', models.FloatField(blank=True, null=True)),
+                ('month_low', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ema_series_states', to='currency.currency')),
+            ],
+            options={
+                'verbose_name': 'EMA Series State',
+                'verbose_name_plural': 'EMA Series States',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='emaseriesstate',
+            constraint=models.UniqueConstraint(fields=('currency', 'timeframe'), name='unique_ema_series_state_per_currency_timeframe'),
+        ),
+    ]
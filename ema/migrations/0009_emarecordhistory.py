@@ -0,0 +1,85 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+CREATE_PARTITIONED_TABLE_SQL = """
+CREATE TABLE "ema_emarecordhistory" (
+    "id" bigint NOT NULL GENERATED BY DEFAULT AS IDENTITY,
+    "timeframe" interval NOT NULL,
+    "ts" timestamp with time zone NOT NULL,
+    "close" double precision NOT NULL,
+    "ema20" double precision NULL,
+    "ema50" double precision NULL,
+    "ema100" double precision NULL,
+    "ema200" double precision NULL,
+    "trend" varchar NOT NULL,
+    "monhigh" double precision NOT NULL,
+    "monlow" double precision NOT NULL,
+    "monmid" double precision NOT NULL,
+    "twenty_greater_than_fifty" boolean NOT NULL,
+    "fifty_greater_than_hundred" boolean NOT NULL,
+    "hundred_greater_than_twohundred" boolean NOT NULL,
+    "close_greater_than_hundred" boolean NOT NULL,
+    "currency_id" uuid NOT NULL REFERENCES "currency_currency" ("id") ON DELETE CASCADE,
+    PRIMARY KEY ("id", "ts")
+) PARTITION BY RANGE ("ts");
+CREATE TABLE "ema_emarecordhistory_default" PARTITION OF "ema_emarecordhistory" DEFAULT;
+CREATE INDEX "ema_history_series_ts_idx" ON "ema_emarecordhistory" ("currency_id", "timeframe", "ts");
+"""
+
+DROP_PARTITIONED_TABLE_SQL = """
+DROP TABLE "ema_emarecordhistory" CASCADE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+        ('ema', '0008_emaseriesstate'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # The table is created with raw SQL so that it can be range-partitioned by `ts`.
+            # The primary key of a partitioned table must include the partition key,
+            # so the primary key is (id, ts) in the database.
+            database_operations=[
+                migrations.RunSQL(
+                    sql=CREATE_PARTITIONED_TABLE_SQL,
+                    reverse_sql=DROP_PARTITIONED_TABLE_SQL,
+                ),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='EMARecordHistory',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('timeframe', models.DurationField()),
+                        ('ts', models.DateTimeField()),
+                        ('close', models.FloatField()),
+                        ('ema20', models.FloatField(blank=True, null=True)),
+                        ('ema50', models.FloatField(blank=True, null=True)),
+                        ('ema100', models.FloatField(blank=True, null=True)),
+                        ('ema200', models.FloatField(blank=True, null=True)),
+                        ('trend', models.CharField(choices=[('1', 'Upwards'), ('-1', 'Downwards'), ('0', 'Sideways')])),
+                        ('monhigh', models.FloatField()),
+                        ('monlow', models.FloatField()),
+                        ('monmid', models.FloatField()),
+                        ('twenty_greater_than_fifty', models.BooleanField()),
+                        ('fifty_greater_than_hundred', models.BooleanField()),
+                        ('hundred_greater_than_twohundred', models.BooleanField()),
+                        ('close_greater_than_hundred', models.BooleanField()),
+                        ('currency', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ema_record_history', to='currency.currency')),
+                    ],
+                    options={
+                        'verbose_name': 'EMA Record History',
+                        'verbose_name_plural': 'EMA Record History',
+                        'indexes': [models.Index(fields=['currency', 'timeframe', 'ts'], name='ema_history_series_ts_idx')],
+                    },
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ema', '0009_emarecordhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emarecord',
+            name='watch_code',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+            preserve_default=False,
+        ),
+        # Compute the watch codes of existing records. See `ema.utils.WATCH_VALUE_BITS`
+        migrations.RunSQL(
+            sql="""
+            UPDATE "ema_emarecord" SET "watch_code" = (
+                ("twenty_greater_than_fifty"::int << 3)
+                | ("fifty_greater_than_hundred"::int << 2)
+                | ("hundred_greater_than_twohundred"::int << 1)
+                | "close_greater_than_hundred"::int
+            );
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
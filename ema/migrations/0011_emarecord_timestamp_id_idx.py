@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0004_alter_currency_category_alter_currency_symbol'),
+        ('ema', '0010_emarecord_watch_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emarecord',
+            index=models.Index(fields=['timestamp', 'id'], name='ema_record_timestamp_id_idx'),
+        ),
+    ]
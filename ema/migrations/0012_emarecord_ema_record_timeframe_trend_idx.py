@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-17 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('currency', '0005_currency_currency_symbol_upper_idx_and_more'),
+        ('ema', '0011_emarecord_timestamp_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emarecord',
+            index=models.Index(fields=['timeframe', 'trend'], name='ema_record_timeframe_trend_idx'),
+        ),
+    ]
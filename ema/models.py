@@ -1,7 +1,11 @@
 from django.db import models
 import uuid
+from typing import Any, Dict, List
 from django.utils.translation import gettext_lazy as _
 
+from .managers import EMARecordHistoryManager
+from .utils import WATCH_VALUE_BITS, get_watch_code
+
 
 class TrendChoices(models.TextChoices):
     """Choices for trend direction"""
@@ -29,6 +33,9 @@ class EMARecord(models.Model):
     fifty_greater_than_hundred = models.BooleanField()
     hundred_greater_than_twohundred = models.BooleanField()
     close_greater_than_hundred = models.BooleanField()
+    # The four watch values above packed into a single indexed column,
+    # so that watch filters can be applied with a single lookup.
+    watch_code = models.PositiveSmallIntegerField(editable=False, db_index=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -36,7 +43,181 @@ class EMARecord(models.Model):
         ordering = ["-timestamp"]
         verbose_name = _("EMA Record")
         verbose_name_plural = _("EMA Records")
+        indexes = [
+            # Serves the default ordering and keyset pagination of EMA records
+            models.Index(fields=["timestamp", "id"], name="ema_record_timestamp_id_idx"),
+            # Serves the timeframe and trend filters of EMA records
+            models.Index(fields=["timeframe", "trend"], name="ema_record_timeframe_trend_idx"),
+        ]
+        constraints = [
+            # Only the latest record is kept per currency and timeframe.
+            # This also serves as the conflict target for bulk upserts
+            models.UniqueConstraint(
+                fields=["currency", "timeframe"], 
+                name="unique_ema_record_per_currency_timeframe"
+            ),
+        ]
 
 
     def __str__(self) -> str:
         return f"{self.currency.symbol} at {self.timestamp.strftime('%H:%M:%S %d-%m-%Y (%Z)')}"
+    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the loaded values, so changes to the record can be found without querying the database
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+
+    def save(self, *args, **kwargs) -> None:
+        self.update_watch_code()
+        update_fields = kwargs.get("update_fields", None)
+        if update_fields is not None and not WATCH_VALUE_BITS.keys().isdisjoint(update_fields):
+            kwargs["update_fields"] = {*update_fields, "watch_code"}
+        super().save(*args, **kwargs)
+        self.reset_loaded_values()
+        return None
+    
+
+    def get_field_values(self) -> Dict[str, Any]:
+        """Returns the current values of the record's loaded fields, keyed by attname"""
+        return {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+    
+
+    def reset_loaded_values(self) -> None:
+        """
+        Mark the current values of the record as the values in the database.
+
+        Must be called after the record is saved if `save()` is bypassed, e.g. by `bulk_create`
+        """
+        self._loaded_values = self.get_field_values()
+        return None
+
+
+    def get_changed_fields(self) -> List[str] | None:
+        """
+        Returns the attnames of the fields that changed since the record was loaded from, or saved to, the database.
+
+        Returns None if the changes are not known, e.g. if the record was not loaded from the
+        database, or fields were deferred when it was loaded.
+        """
+        loaded_values: Dict[str, Any] | None = getattr(self, "_loaded_values", None)
+        if loaded_values is None:
+            return None
+        values = self.get_field_values()
+        if values.keys() != loaded_values.keys():
+            return None
+        return [name for name, value in values.items() if value != loaded_values[name]]
+    
+
+    def apply_values(self, values: Dict[str, Any]) -> bool:
+        """
+        Set the given field values on the record, and update its watch code.
+
+        :param values: Field values, keyed by field name
+        :return: False if the record is known to be unchanged from its values in the database,
+            in which case it does not need to be saved. True otherwise.
+        """
+        for field_name, value in values.items():
+            setattr(self, field_name, value)
+        self.update_watch_code()
+        return self._state.adding or self.get_changed_fields() != []
+    
+
+    def update_watch_code(self) -> None:
+        """
+        Update the record's watch code from its watch values.
+
+        Must be called before the record is saved if `save()` is bypassed, e.g. by `bulk_create`
+        """
+        self.watch_code = get_watch_code({name: getattr(self, name) for name in WATCH_VALUE_BITS})
+        return None
+
+
+
+class EMASeriesState(models.Model):
+    """
+    Model for storing the running EMA state of a currency's candle series in a timeframe.
+
+    The state is updated in constant time for every new candle, so 
+    EMAs never have to be recomputed from the full candle history.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    timeframe = models.DurationField()
+    currency = models.ForeignKey("currency.Currency", on_delete=models.CASCADE, related_name="ema_series_states")
+    ema20 = models.FloatField(null=True, blank=True)
+    ema50 = models.FloatField(null=True, blank=True)
+    ema100 = models.FloatField(null=True, blank=True)
+    ema200 = models.FloatField(null=True, blank=True)
+    candle_count = models.PositiveIntegerField(default=0)
+    last_close = models.FloatField(null=True, blank=True)
+    last_candle_at = models.DateTimeField(null=True, blank=True)
+    month_high = models.FloatField(null=True, blank=True)
+    month_low = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("EMA Series State")
+        verbose_name_plural = _("EMA Series States")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["currency", "timeframe"], 
+                name="unique_ema_series_state_per_currency_timeframe"
+            ),
+        ]
+
+
+    def __str__(self) -> str:
+        return f"{self.currency.symbol} EMA state ({self.timeframe})"
+
+
+
+class EMARecordHistory(models.Model):
+    """
+    Model for storing the history of EMA records.
+
+    A row is appended every time an EMA record is created or updated, and rows
+    are never updated. In Postgres, the table is range-partitioned by `ts`.
+    See `ema/migrations/0009_emarecordhistory.py` and the `create_ema_history_partitions` command.
+    """
+    id = models.BigAutoField(primary_key=True)
+    # The currency foreign key is enforced (with `ON DELETE CASCADE`) by the database. 
+    # Django must not collect history rows to delete them when a currency is deleted.
+    currency = models.ForeignKey(
+        "currency.Currency", on_delete=models.DO_NOTHING, 
+        related_name="ema_record_history", db_constraint=False, db_index=False
+    )
+    timeframe = models.DurationField()
+    ts = models.DateTimeField()
+    close = models.FloatField()
+    ema20 = models.FloatField(null=True, blank=True)
+    ema50 = models.FloatField(null=True, blank=True)
+    ema100 = models.FloatField(null=True, blank=True)
+    ema200 = models.FloatField(null=True, blank=True)
+    trend = models.CharField(choices=TrendChoices.choices)
+    monhigh = models.FloatField()
+    monlow = models.FloatField()
+    monmid = models.FloatField()
+    twenty_greater_than_fifty = models.BooleanField()
+    fifty_greater_than_hundred = models.BooleanField()
+    hundred_greater_than_twohundred = models.BooleanField()
+    close_greater_than_hundred = models.BooleanField()
+
+    objects = EMARecordHistoryManager()
+
+    class Meta:
+        verbose_name = _("EMA Record History")
+        verbose_name_plural = _("EMA Record History")
+        indexes = [
+            models.Index(fields=["currency", "timeframe", "ts"], name="ema_history_series_ts_idx"),
+        ]
+
+
+    def __str__(self) -> str:
+        return f"{self.currency_id} at {self.ts.strftime('%H:%M:%S %d-%m-%Y (%Z)')}"
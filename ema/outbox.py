@@ -0,0 +1,308 @@
+import atexit
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .event_log import EMA_RECORD_RESYNC_MESSAGE_TYPE, log_ema_record_event_message
+from helpers.logging import log_exception
+from helpers import metrics
+
+
+EMA_RECORD_UPDATE_MESSAGE_TYPES = ("send.ema_record_update", "send.ema_record_updates")
+
+
+class WebsocketEventOutbox:
+    """
+    In-memory outbox of channel layer group messages.
+
+    Messages are only added to the outbox once the transaction they were created in is committed,
+    so messages for rolled-back writes are never sent. A background thread runs an asyncio event loop
+    that drains the outbox in batches and sends the messages to the channel layer, in the order they
+    were added. Writers never wait on the channel layer.
+
+    If a coalescing window is set, the publisher collects the messages added within the window
+    after the first one, and each run of consecutive EMA record update messages is sent as a single
+    batched message per group, with the events for the same record merged (see `coalesce_ema_record_messages`).
+    If coalescing fails, the messages are sent as they were added.
+
+    EMA record update messages are given a sequence number just before they are sent, and kept in
+    the recent events buffer (see `ema.event_log`), so clients can resume after reconnecting.
+    Messages of one process are sent in sequence order. Messages of different processes are not
+    ordered with each other, so clients order events by sequence number. If a message cannot be given
+    a sequence number or sent, the connections are told to resync instead, since their clients could
+    not tell they missed it.
+
+    Messages still in the outbox when the process exits are lost, since the outbox is not persisted.
+    """
+    def __init__(
+        self, 
+        channel_layer_alias: str = "default", 
+        batch_size: int = 500,
+        coalesce_window: float = 0.0
+    ) -> None:
+        """
+        Create a new outbox. The publisher thread is started when the first message is added.
+
+        :param channel_layer_alias: Alias of the channel layer to send messages with
+        :param batch_size: Maximum number of messages taken from the outbox at once, when not coalescing
+        :param coalesce_window: Number of seconds to collect messages for before sending them
+            as batched messages. Set to 0 to send every message on its own.
+        """
+        self.channel_layer_alias = channel_layer_alias
+        self.batch_size = batch_size
+        self.coalesce_window = coalesce_window
+        self._messages: Deque[Tuple[str, Dict]] = deque()
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._publisher: threading.Thread | None = None
+
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+    def put(self, group_name: str, message: Dict) -> None:
+        """
+        Add a message to the outbox, to be sent to a channel layer group
+
+        :param group_name: The name of the group to send the message to
+        :param message: The channel layer message
+        """
+        with self._condition:
+            self._messages.append((group_name, message))
+            self._ensure_publisher()
+            self._condition.notify()
+        return None
+
+
+    def put_on_commit(self, group_name: str, message: Dict) -> None:
+        """
+        Add a message to the outbox once the current transaction is committed.
+        The message is dropped if the transaction is rolled back.
+
+        Outside a transaction, the message is added immediately.
+        """
+        transaction.on_commit(lambda: self.put(group_name, message))
+        return None
+
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until all the messages in the outbox have been sent
+
+        :param timeout: Maximum number of seconds to wait for
+        :return: True if the outbox was drained, False if the wait timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._messages or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
+    def _ensure_publisher(self) -> None:
+        if self._publisher is None or not self._publisher.is_alive():
+            self._publisher = threading.Thread(
+                target=self._run_publisher, name="websocket-event-outbox", daemon=True
+            )
+            self._publisher.start()
+
+
+    def _take_batch(self) -> List[Tuple[str, Dict]]:
+        """
+        Wait for messages and take up to `batch_size` of them from the outbox,
+        or all the messages added within the coalescing window
+        """
+        with self._condition:
+            while not self._messages:
+                self._condition.wait()
+        if self.coalesce_window:
+            # Let messages accumulate for the rest of the window
+            time.sleep(self.coalesce_window)
+
+        with self._condition:
+            count = len(self._messages)
+            if not self.coalesce_window:
+                count = min(self.batch_size, count)
+            batch = [self._messages.popleft() for _ in range(count)]
+            self._in_flight = len(batch)
+            return batch
+
+
+    def _finish_batch(self) -> None:
+        with self._condition:
+            self._in_flight = 0
+            self._condition.notify_all()
+
+
+    def _run_publisher(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        channel_layer = get_channel_layer(self.channel_layer_alias)
+        while True:
+            batch = self._take_batch()
+            try:
+                loop.run_until_complete(self._publish(channel_layer, batch))
+            finally:
+                self._finish_batch()
+
+
+    async def _publish(self, channel_layer, batch: List[Tuple[str, Dict]]) -> None:
+        if self.coalesce_window:
+            try:
+                batch = coalesce_ema_record_messages(batch)
+            except Exception as exc:
+                # Send the messages as they were added, rather than lose them
+                log_exception(exc)
+        sent = 0
+        for group_name, message in batch:
+            try:
+                if message.get("type", None) in EMA_RECORD_UPDATE_MESSAGE_TYPES:
+                    log_ema_record_event_message(message)
+                await channel_layer.group_send(group_name, message)
+                sent += 1
+            except Exception as exc:
+                log_exception(exc)
+                if message.get("type", None) in EMA_RECORD_UPDATE_MESSAGE_TYPES:
+                    await self._request_resync(channel_layer, group_name)
+        metrics.increment("websocket.outbox.sent", sent)
+        if sent < len(batch):
+            metrics.increment("websocket.outbox.failed", len(batch) - sent)
+        return None
+
+
+    async def _request_resync(self, channel_layer, group_name: str) -> None:
+        """Tell the connections in the group to get a new snapshot, after an EMA record updates message was missed"""
+        try:
+            await channel_layer.group_send(group_name, {"type": EMA_RECORD_RESYNC_MESSAGE_TYPE})
+            metrics.increment("websocket.outbox.resyncs")
+        except Exception as exc:
+            log_exception(exc)
+        return None
+
+
+
+def merge_ema_record_event_data(data: Dict, new_data: Dict) -> Dict:
+    """Merge the data of a later event for a record into the data of an earlier one"""
+    merged_data = dict(data)
+    for key, value in new_data.items():
+        if isinstance(value, dict) and isinstance(merged_data.get(key, None), dict):
+            value = merge_ema_record_event_data(merged_data[key], value)
+        merged_data[key] = value
+    return merged_data
+
+
+def coalesce_ema_record_events(messages: List[Dict]) -> List[Dict]:
+    """
+    Merge the "create", "update" and "delete" events for the same record, last write wins.
+
+    - Updates are merged into the preceding create or update of the record.
+    - A create or delete replaces all the preceding events of the record.
+
+    Each merged event takes the place of the last event it was merged from. The routing states
+    of merged events are combined, so the merged event reaches every subscriber of the events.
+
+    :param messages: EMA record update messages, in the order they happened
+    :return: At most one message per record
+    """
+    coalesced_messages: Dict[str, Dict] = {}
+    for message in messages:
+        event = message["data"]
+        record_id = str(event["data"]["id"])
+        previous_message = coalesced_messages.pop(record_id, None)
+        if previous_message is None:
+            coalesced_messages[record_id] = message
+            continue
+
+        previous_event = previous_message["data"]
+        previous_states = previous_message.get("states", None)
+        states = message.get("states", None)
+        if previous_states is None or states is None:
+            states = None
+        else:
+            states = [*previous_states, *states]
+
+        if event["code"] != "update" or previous_event["code"] == "delete":
+            coalesced_messages[record_id] = {**message, "states": states}
+            continue
+        
+        data = merge_ema_record_event_data(previous_event["data"], event["data"])
+        if previous_event["code"] == "update":
+            # The id always comes last in update events
+            data["id"] = data.pop("id")
+        coalesced_messages[record_id] = {
+            **message,
+            "data": {
+                "code": previous_event["code"],
+                "data": data
+            },
+            "states": states
+        }
+    return list(coalesced_messages.values())
+
+
+def batch_ema_record_messages(messages: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict]]:
+    """
+    Combine EMA record update messages into a single batched message per group
+
+    :param messages: (group_name, message) pairs of "send.ema_record_update" messages
+    :return: (group_name, message) pairs, with one "send.ema_record_updates" message per group,
+        in the order the groups first appear in
+    """
+    messages_by_group: Dict[str, List[Dict]] = {}
+    for group_name, message in messages:
+        messages_by_group.setdefault(group_name, []).append(message)
+
+    batched_messages = []
+    for group_name, group_messages in messages_by_group.items():
+        coalesced_messages = coalesce_ema_record_events(group_messages)
+        metrics.increment("websocket.outbox.coalesced", len(group_messages) - len(coalesced_messages))
+        batched_messages.append((
+            group_name, 
+            {
+                "type": "send.ema_record_updates",
+                "data": [message["data"] for message in coalesced_messages],
+                # The routing states of each event, used by `ema.subscriptions.EMARecordEventRouter`
+                "states": [message.get("states", None) for message in coalesced_messages]
+            }
+        ))
+    return batched_messages
+
+
+def coalesce_ema_record_messages(messages: List[Tuple[str, Dict]]) -> List[Tuple[str, Dict]]:
+    """
+    Combine each run of consecutive EMA record update messages into batched messages (see `batch_ema_record_messages`).
+    Other messages are returned unchanged, and keep their place between the runs, so they are 
+    never sent before the updates that were added ahead of them.
+
+    :param messages: (group_name, message) pairs
+    :return: (group_name, message) pairs
+    """
+    coalesced_messages: List[Tuple[str, Dict]] = []
+    run: List[Tuple[str, Dict]] = []
+    for group_name, message in messages:
+        if message.get("type", None) == "send.ema_record_update":
+            run.append((group_name, message))
+            continue
+        if run:
+            coalesced_messages.extend(batch_ema_record_messages(run))
+            run = []
+        coalesced_messages.append((group_name, message))
+    if run:
+        coalesced_messages.extend(batch_ema_record_messages(run))
+    return coalesced_messages
+
+
+websocket_event_outbox = WebsocketEventOutbox(
+    coalesce_window=settings.EMA_RECORDS_WEBSOCKET_COALESCE_WINDOW
+)
+# Give the publisher a chance to send the remaining messages, e.g. at the end of management commands
+atexit.register(websocket_event_outbox.flush, timeout=5)
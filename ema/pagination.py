@@ -0,0 +1,121 @@
+import datetime
+import uuid
+from base64 import b64decode, b64encode
+from typing import List, Tuple
+from urllib import parse
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from .models import EMARecord
+
+
+class EMARecordCursorPagination(pagination.CursorPagination):
+    """
+    Keyset (cursor) pagination for EMA records.
+
+    Pages are fetched by seeking to the position of the previous page in the
+    (timestamp, id) index, so deep pages cost the same as the first page.
+    Unlike `LimitOffsetPagination`, the total count is not computed.
+
+    DRF's `CursorPagination` only keeps the first ordering field in the cursor, with an
+    offset for the records that share it. Records share timestamps when they are written
+    in bulk, so the cursor holds the (timestamp, id) position of a record instead.
+    """
+    ordering = ("-timestamp", "-id")
+    page_size_query_param = "limit"
+
+    def paginate_queryset(self, queryset, request, view=None) -> List[EMARecord] | None:
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+
+        # Previous pages are fetched in ascending order, from the position up
+        if reverse:
+            queryset = queryset.order_by("timestamp", "id")
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            timestamp, pk = position
+            lookup = "gt" if reverse else "lt"
+            queryset = queryset.filter(
+                models.Q(**{f"timestamp__{lookup}": timestamp})
+                | models.Q(timestamp=timestamp, **{f"id__{lookup}": pk})
+            )
+
+        # An extra record is fetched to know if there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following_page = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following_page
+        else:
+            self.has_next = has_following_page
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+    def get_next_link(self) -> str | None:
+        if not self.has_next:
+            return None
+        position = self.get_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=False, position=position))
+
+
+    def get_previous_link(self) -> str | None:
+        if not self.has_previous:
+            return None
+        position = self.get_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(pagination.Cursor(offset=0, reverse=True, position=position))
+
+
+    def get_position(self, record: EMARecord) -> Tuple[datetime.datetime, uuid.UUID]:
+        """Returns the (timestamp, id) position of the record in the cursor ordering"""
+        return record.timestamp, record.pk
+
+
+    def decode_cursor(self, request) -> pagination.Cursor | None:
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode("ascii")).decode("ascii")
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get("r", ["0"])[0]))
+            position = None
+            if "p" in tokens:
+                timestamp = parse_datetime(tokens["p"][0])
+                if timestamp is None:
+                    raise ValueError("Invalid cursor timestamp")
+                position = (timestamp, uuid.UUID(tokens["i"][0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return pagination.Cursor(offset=0, reverse=reverse, position=position)
+
+
+    def encode_cursor(self, cursor: pagination.Cursor) -> str:
+        tokens = {}
+        if cursor.reverse:
+            tokens["r"] = "1"
+        if cursor.position is not None:
+            timestamp, pk = cursor.position
+            tokens["p"] = timestamp.isoformat()
+            tokens["i"] = str(pk)
+
+        querystring = parse.urlencode(tokens)
+        encoded = b64encode(querystring.encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
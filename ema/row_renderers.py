@@ -0,0 +1,151 @@
+import datetime
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+
+from .serializers import EMARecordSerializer
+from .utils import WATCH_VALUES_INTERNAL_TO_EXTERNAL_NAME_MAPPING
+
+
+def get_timezone() -> datetime.tzinfo | None:
+    """Returns the timezone datetimes are represented in, the same as `serializers.DateTimeField.default_timezone`"""
+    return timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+def enforce_timezone(value: datetime.datetime, field_timezone: datetime.tzinfo | None) -> datetime.datetime:
+    """Same as `serializers.DateTimeField.enforce_timezone`, with the timezone resolved beforehand"""
+    if field_timezone is not None:
+        if timezone.is_aware(value):
+            return value.astimezone(field_timezone)
+        return timezone.make_aware(value, field_timezone)
+    if timezone.is_aware(value):
+        return timezone.make_naive(value, datetime.timezone.utc)
+    return value
+
+
+def get_datetime_format(field: serializers.Field) -> str | None:
+    """
+    Returns the output format of a datetime serializer field, if its values can be
+    formatted with `enforce_timezone` and `strftime`. Otherwise, returns None.
+    """
+    if not isinstance(field, serializers.DateTimeField) or hasattr(field, "timezone"):
+        return None
+    output_format = getattr(field, "format", None)
+    if not output_format or output_format.lower() == "iso-8601":
+        return None
+    return output_format
+
+
+def get_field_converter(field: serializers.Field) -> Callable[[Any], Any]:
+    """
+    Returns a function that converts a (non-null) model field value to its representation,
+    the same way as the serializer field's `to_representation`, with less overhead.
+    """
+    if isinstance(field, serializers.ChoiceField):
+        choices = field.choice_strings_to_values
+        return lambda value: choices.get(str(value), value)
+    elif isinstance(field, serializers.BooleanField):
+        return bool
+    elif isinstance(field, serializers.FloatField):
+        return float
+    elif isinstance(field, serializers.IntegerField):
+        return int
+    elif isinstance(field, serializers.UUIDField) and field.uuid_format == "hex_verbose":
+        return str
+    elif type(field) is serializers.CharField:
+        return str
+    return field.to_representation
+
+
+
+class EMARecordRowRenderer:
+    """
+    Renders EMA record rows, tuples of values as returned by `QuerySet.values_list`, with the currency
+    values joined in, to the same representation as the `EMARecordSerializer`.
+
+    The serializer fields are compiled once into a list of value converters, so rendering a row
+    does not build model instances or run the nested currency serializer, and the external
+    watch value names are applied as the representation is built.
+    """
+    def __init__(
+        self,
+        fieldset: Dict[str, List[str] | None] | None = None,
+        row_fields: Sequence[str] | None = None
+    ) -> None:
+        """
+        Create a new renderer
+
+        :param fieldset: A sparse fieldset (see `ema.serializers.parse_fieldset`) to render the rows with
+        :param row_fields: The model fields of the row values, in order. Currency fields are given
+            as "currency__<field>". Defaults to `fields`, the model fields the renderer needs.
+        """
+        serializer = EMARecordSerializer(fieldset=fieldset)
+        readable_fields = list(serializer._readable_fields)
+        currency_fields = [
+            (currency_field, f"currency__{currency_field.field_name}")
+            for field in readable_fields if field.field_name == "currency"
+            for currency_field in field._readable_fields
+        ]
+        # Model fields the renderer needs
+        self.fields: List[str] = [
+            field.field_name for field in readable_fields if field.field_name != "currency"
+        ] + [row_field for _, row_field in currency_fields]
+
+        if row_fields is None:
+            row_fields = self.fields
+        row_indices = {field: index for index, field in enumerate(row_fields)}
+        # Steps to render a row, in the order of the serializer fields, as tuples of the
+        # representation key, the index of the value in the row, the value converter, and
+        # the output format of datetimes. The nested currency is rendered from the whole row,
+        # which is marked by a None index
+        self._steps: List[Tuple[str, int | None, Callable, str | None]] = [
+            ("currency", None, self.render_currency, None) if field.field_name == "currency" else (
+                WATCH_VALUES_INTERNAL_TO_EXTERNAL_NAME_MAPPING.get(field.field_name, field.field_name),
+                row_indices[field.field_name],
+                get_field_converter(field),
+                get_datetime_format(field)
+            )
+            for field in readable_fields
+        ]
+        self._currency_steps: List[Tuple[str, int, Callable, str | None]] = [
+            (field.field_name, row_indices[row_field], get_field_converter(field), get_datetime_format(field))
+            for field, row_field in currency_fields
+        ]
+
+
+    def render(self, row: Sequence, field_timezone: datetime.tzinfo | None = None) -> Dict:
+        """
+        Returns the representation of a row
+
+        :param row: The row values
+        :param field_timezone: The timezone to represent datetimes in, if it was already fetched with `get_timezone`
+        """
+        return self._render(row, self._steps, field_timezone or get_timezone())
+
+
+    def render_currency(self, row: Sequence, field_timezone: datetime.tzinfo | None) -> Dict:
+        return self._render(row, self._currency_steps, field_timezone)
+
+
+    @staticmethod
+    def _render(row: Sequence, steps: List[Tuple], field_timezone: datetime.tzinfo | None) -> Dict:
+        representation = {}
+        for name, index, converter, output_format in steps:
+            if index is None:
+                representation[name] = converter(row, field_timezone)
+                continue
+            value = row[index]
+            if value is None:
+                representation[name] = None
+            elif output_format is None:
+                representation[name] = converter(value)
+            else:
+                representation[name] = enforce_timezone(value, field_timezone).strftime(output_format)
+        return representation
+
+
+    def render_many(self, rows: Sequence[Sequence]) -> List[Dict]:
+        """Returns the representations of the rows, in order"""
+        field_timezone = get_timezone()
+        return [self._render(row, self._steps, field_timezone) for row in rows]
@@ -0,0 +1,233 @@
+import asyncio
+import time
+import weakref
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Tuple
+
+from .outbox import EMA_RECORD_UPDATE_MESSAGE_TYPES, coalesce_ema_record_events
+from helpers.logging import log_exception
+from helpers import metrics
+
+
+class WebsocketSendQueue:
+    """
+    Bounded queue of the frames to send to a websocket connection, drained by a writer task.
+
+    Putting a frame in the queue never waits on the connection, so slow connections do not hold up
+    the delivery of events to the other connections. When the queue is full, its policy decides what happens:
+
+    - "coalesce": The queued EMA record events are merged by record, last write wins,
+        into batched event messages (see `ema.outbox.coalesce_ema_record_events`).
+        Events are not merged across control messages, so they keep their order relative to them.
+        If the queue is still full after merging, the event messages are dropped, as with "drop_oldest".
+    - "drop_oldest": The queued EMA record event messages are dropped, and the connection is resynced
+        (sent a new snapshot) before the next message is sent, since the client could not tell it missed them.
+        The snapshot replaces everything sent before it, so every queued event message is dropped at once.
+    - "disconnect": The connection is closed. The connection is also closed once the oldest
+        queued message has waited for more than `max_lag` seconds, when it is added or about to be sent.
+
+    Queue items are either EMA record updates group messages, or control messages,
+    `{"type": "frame", "frame": <encoded frame>}`, which are never merged or dropped.
+    If the queue is full of control messages, the connection is closed, whatever the policy.
+    """
+    POLICIES = ("coalesce", "drop_oldest", "disconnect")
+
+    def __init__(
+        self,
+        send: Callable[[Dict], Awaitable],
+        max_size: int = 1000,
+        policy: str = "coalesce",
+        max_lag: float = 30.0,
+        resync: Callable[[], Awaitable] | None = None,
+        close: Callable[[], Awaitable] | None = None
+    ) -> None:
+        """
+        Create a new send queue. Call `start` to start the writer task.
+
+        :param send: Coroutine function that sends a queue item to the connection
+        :param max_size: Maximum number of messages in the queue
+        :param policy: What to do when the queue is full. One of `POLICIES`.
+        :param max_lag: Number of seconds messages can wait in the queue, with the "disconnect" policy
+        :param resync: Coroutine function that sends the connection a new snapshot, after event messages were dropped
+        :param close: Coroutine function that closes the connection, when the writer task finds it lagging too far behind
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Invalid send queue policy '{policy}'. Should be one of {self.POLICIES}")
+        self.send = send
+        self.max_size = max_size
+        self.policy = policy
+        self.max_lag = max_lag
+        self.resync = resync
+        self.close = close
+        self._resync_pending = False
+        self._items: Deque[Tuple[float, Dict]] = deque()
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        send_queues.add(self)
+
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return None
+
+
+    def stop(self) -> None:
+        """Stop the writer task and drop the queued messages"""
+        if self._task is not None:
+            # The writer task is not cancelled when it stops the queue itself, while closing the connection
+            if self._task is not asyncio.current_task():
+                self._task.cancel()
+            self._task = None
+        self._items.clear()
+        send_queues.discard(self)
+        return None
+
+
+    @property
+    def lag(self) -> float:
+        """Number of seconds the oldest queued message has waited for"""
+        try:
+            queued_at = self._items[0][0]
+        except IndexError:
+            return 0.0
+        return time.monotonic() - queued_at
+
+
+    def put(self, item: Dict) -> bool:
+        """
+        Add a message to the queue, applying the queue's policy if it is full
+
+        :param item: An EMA record updates group message, or a control message
+        :return: False if the connection should be closed, in which case the message is not added
+        """
+        if self.is_lagging():
+            return False
+
+        if len(self._items) >= self.max_size:
+            if self.policy == "disconnect":
+                return False
+            if self.policy == "coalesce":
+                self._coalesce()
+            # Merging could not make room if control messages come between the events
+            if len(self._items) >= self.max_size and not self._drop_events():
+                return False
+
+        self._items.append((time.monotonic(), item))
+        self._ready.set()
+        return True
+
+
+    def is_lagging(self) -> bool:
+        """Returns True if the connection should be closed for lagging behind"""
+        return self.policy == "disconnect" and self.lag > self.max_lag
+
+
+    def _drop_events(self) -> bool:
+        """
+        Drop the queued EMA record event messages, and have the connection resynced
+
+        :return: False if there is no event message to drop
+        """
+        items = deque(queued_item for queued_item in self._items if queued_item[1].get("type", None) == "frame")
+        dropped = len(self._items) - len(items)
+        if not dropped:
+            return False
+        self._items = items
+        self._resync_pending = True
+        metrics.increment("websocket.send_queue.dropped", dropped)
+        return True
+
+
+    def _coalesce(self) -> None:
+        """
+        Merge the queued EMA record event messages between control messages into batched messages.
+
+        Each run of consecutive event messages is merged into a single batched message, in the place
+        of the run, so events queued before a control message (such as a snapshot) are still
+        sent before it, and events queued after it are still sent after it.
+        """
+        items: Deque[Tuple[float, Dict]] = deque()
+        run: List[Tuple[float, Dict]] = []
+        for queued_item in self._items:
+            if queued_item[1].get("type", None) in EMA_RECORD_UPDATE_MESSAGE_TYPES:
+                run.append(queued_item)
+                continue
+            items.extend(self._merge(run))
+            run = []
+            items.append(queued_item)
+        items.extend(self._merge(run))
+        self._items = items
+        return None
+
+
+    def _merge(self, run: List[Tuple[float, Dict]]) -> List[Tuple[float, Dict]]:
+        """Merge consecutive queued EMA record event messages into a single batched message"""
+        if len(run) < 2:
+            return run
+        seq = None
+        events = []
+        for _, item in run:
+            if item["type"] == "send.ema_record_update":
+                events.append({"data": item["data"], "states": None})
+            else:
+                events.extend({"data": event, "states": None} for event in item["data"])
+            seq = item.get("seq", seq)
+
+        coalesced_events = coalesce_ema_record_events(events)
+        metrics.increment("websocket.send_queue.coalesced", len(events) - len(coalesced_events))
+        batch = {
+            "type": "send.ema_record_updates",
+            "data": [event["data"] for event in coalesced_events],
+        }
+        if seq is not None:
+            batch["seq"] = seq
+        # The batch keeps the time the oldest event was queued at, so the lag is not reset
+        return [(run[0][0], batch)]
+
+
+    async def _run(self) -> None:
+        while True:
+            while not self._items:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.is_lagging() and self.close is not None:
+                self._items.clear()
+                await self.close()
+                return
+            if self._resync_pending and self.resync is not None:
+                self._resync_pending = False
+                try:
+                    await self.resync()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    log_exception(exc)
+
+            _, item = self._items.popleft()
+            try:
+                await self.send(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                log_exception(exc)
+
+
+
+# Send queues of the open websocket connections of this process
+send_queues: "weakref.WeakSet[WebsocketSendQueue]" = weakref.WeakSet()
+
+metrics.register_gauge("websocket.send_queue.connections", lambda: len(send_queues))
+metrics.register_gauge("websocket.send_queue.depth", lambda: sum(len(queue) for queue in list(send_queues)))
+metrics.register_gauge(
+    "websocket.send_queue.max_depth",
+    lambda: max((len(queue) for queue in list(send_queues)), default=0)
+)
+metrics.register_gauge(
+    "websocket.send_queue.max_lag",
+    lambda: max((queue.lag for queue in list(send_queues)), default=0.0)
+)
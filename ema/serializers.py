@@ -1,21 +1,38 @@
 from rest_framework import serializers, exceptions
-from typing import Any, Dict
+from django.conf import settings
+from django.db import transaction
+from typing import Any, Dict, Iterable, List
 
 
-from .models import EMARecord
+from .models import EMARecord, EMARecordHistory
 from currency.serializers import StrippedCurrencySerializer
-from currency.models import Currency
+from currency.symbols import currency_symbol_cache
+from helpers import metrics
 from .utils import (
+    EMA_RECORD_LOCK_NAMESPACE,
+    lock_series_keys,
     convert_watch_values_external_names_to_internal_names,
-    convert_watch_values_internal_names_to_external_names
+    convert_watch_values_internal_names_to_external_names,
+    WATCH_VALUES_EXTERNAL_TO_INTERNAL_NAME_MAPPING
 )
 
 
+# Fields of the nested currency representation of EMA records
+CURRENCY_FIELDS = ["symbol", "category", "subcategory", "exchange"]
+
 
 class EMARecordSerializer(serializers.ModelSerializer):
-    """Model serializer for EMA records"""
+    """
+    Model serializer for EMA records
+
+    Pass a sparse fieldset (see `parse_fieldset`) as `fieldset` to only represent some of the fields.
+    """
     currency = StrippedCurrencySerializer(read_only=True)
     currency_symbol = serializers.CharField(write_only=True)
+    watch_code = serializers.IntegerField(read_only=True)
+
+    # Fields that are only represented when they are requested in a sparse fieldset
+    optional_fields = ["watch_code"]
 
     class Meta:
         model = EMARecord
@@ -37,6 +54,7 @@ class EMARecordSerializer(serializers.ModelSerializer):
             "fifty_greater_than_hundred",
             "hundred_greater_than_twohundred",
             "close_greater_than_hundred",
+            "watch_code",
             "timestamp",
             "updated_at",
         ]
@@ -47,6 +65,30 @@ class EMARecordSerializer(serializers.ModelSerializer):
             "updated_at": {"format": "%H:%M:%S %d-%m-%Y %z"},
         }
 
+    def __init__(self, *args, fieldset: Dict[str, List[str] | None] | None = None, **kwargs) -> None:
+        self.fieldset = fieldset
+        super().__init__(*args, **kwargs)
+
+
+    def get_fields(self) -> Dict[str, serializers.Field]:
+        fields = super().get_fields()
+        if self.fieldset is None:
+            for name in self.optional_fields:
+                fields.pop(name)
+            return fields
+
+        for name, field in list(fields.items()):
+            if not field.write_only and name not in self.fieldset:
+                fields.pop(name)
+        currency_fields = self.fieldset.get("currency", None)
+        if currency_fields is not None:
+            currency_serializer = fields["currency"]
+            for name in list(currency_serializer.fields):
+                if name not in currency_fields:
+                    currency_serializer.fields.pop(name)
+        return fields
+    
+
     def to_representation(self, instance) -> Dict:
         representation = super().to_representation(instance)
         # Convert internal watchlist names to external watchlist names
@@ -54,6 +96,24 @@ class EMARecordSerializer(serializers.ModelSerializer):
         return convert_watch_values_internal_names_to_external_names(representation)
     
 
+    def to_partial_representation(self, instance, field_names: Iterable[str]) -> Dict:
+        """
+        Returns the representation of only the given fields of the instance,
+        in the same order and format as `to_representation`.
+        
+        :param instance: The instance to represent
+        :param field_names: Names of the serializer fields to include
+        """
+        field_names = set(field_names)
+        representation = {}
+        for field in self._readable_fields:
+            if field.field_name not in field_names:
+                continue
+            attribute = field.get_attribute(instance)
+            representation[field.field_name] = None if attribute is None else field.to_representation(attribute)
+        return convert_watch_values_internal_names_to_external_names(representation)
+    
+
     def run_validation(self, data: Dict):
         # Incase the watch values are provided in external names,
         # convert the external watch value names to internal watchlist names
@@ -71,18 +131,101 @@ class EMARecordSerializer(serializers.ModelSerializer):
                 "currency_symbol": ["This field is required."]
             })
         
-        try:
-            currency = Currency.objects.get(symbol__iexact=currency_symbol)
-        except Currency.DoesNotExist:
+        currency = currency_symbol_cache.get(currency_symbol)
+        if currency is None:
             raise exceptions.ValidationError({
                 "currency_symbol": [f"Currency symbol provided, '{currency_symbol}', is not recognized."]
             })
+        validated_data["currency"] = currency
+
+        with transaction.atomic():
+            # Wait for concurrent writes of the same record, including bulk writes (see `ema.upserts`)
+            lock_series_keys(EMA_RECORD_LOCK_NAMESPACE, [(currency.pk, timeframe)])
+            existing_instance = self.Meta.model.objects.filter(currency=currency, timeframe=timeframe).first()
+            if (
+                existing_instance 
+                and settings.EMA_RECORDS_SKIP_UNCHANGED_WRITES 
+                and not existing_instance.apply_values(validated_data)
+            ):
+                # Nothing changed, so the record is not written, added to the history or broadcast
+                metrics.increment("ema_records.writes.skipped")
+                return existing_instance
+            if existing_instance:
+                # Update the existing instance, instead of creating a new one
+                instance = self.update(existing_instance, validated_data)
+            else:
+                instance = super().create(validated_data)
+            EMARecordHistory.objects.record([instance])
+        metrics.increment("ema_records.writes.saved")
+        return instance
+
+
+
+
+# Fields that can be requested in a sparse fieldset
+FIELDSET_FIELDS = [name for name in EMARecordSerializer.Meta.fields if name != "currency_symbol"]
+
+
+def parse_fieldset(value: str | None) -> Dict[str, List[str] | None] | None:
+    """
+    Parse the "fields" query parameter of the EMA record list endpoint into a sparse fieldset.
+
+    The parameter is a comma-separated list of the fields to return, e.g. "currency.symbol,close,trend,watch_code".
+    Watch values can be given by their external or internal names. "currency" returns the whole nested
+    currency, while "currency.<field>" only returns the given fields of the currency. Unknown fields are ignored.
+
+    :param value: The value of the "fields" query parameter
+    :return: A mapping of the requested serializer field names to the requested currency fields
+        ("currency") or None (other fields). None if no known fields are requested, in which case all fields are returned.
+    """
+    if not value:
+        return None
+    fieldset = {}
+    for item in value.split(","):
+        name, _, subfield = item.strip().partition(".")
+        name = WATCH_VALUES_EXTERNAL_TO_INTERNAL_NAME_MAPPING.get(name, name)
+        if name not in FIELDSET_FIELDS:
+            continue
+        if name != "currency":
+            fieldset[name] = None
+        elif not subfield:
+            fieldset[name] = list(CURRENCY_FIELDS)
+        elif subfield in CURRENCY_FIELDS:
+            currency_fields = fieldset.setdefault(name, [])
+            if subfield not in currency_fields:
+                currency_fields.append(subfield)
+    return fieldset or None
+
+
+def get_fieldset_model_fields(fieldset: Dict[str, List[str] | None]) -> List[str]:
+    """
+    Returns the model fields to load for a sparse fieldset, for use with `QuerySet.only`
+
+    :param fieldset: A sparse fieldset, as returned by `parse_fieldset`
+    """
+    model_fields = []
+    for name, currency_fields in fieldset.items():
+        if name == "currency":
+            model_fields.extend(f"currency__{field}" for field in currency_fields)
         else:
-            validated_data["currency"] = currency
+            model_fields.append(name)
+    return model_fields
+
 
-        existing_instance = self.Meta.model.objects.filter(currency=currency, timeframe=timeframe).first()
-        if existing_instance:
-            # Update the existing instance, instead of creating a new one
-            return self.update(existing_instance, validated_data)
-        return super().create(validated_data)
 
+class CandleSerializer(serializers.Serializer):
+    """Serializer for raw OHLC candles used to compute EMA records on the server"""
+    currency_symbol = serializers.CharField()
+    timeframe = serializers.DurationField()
+    time = serializers.DateTimeField()
+    open = serializers.FloatField()
+    high = serializers.FloatField()
+    low = serializers.FloatField()
+    close = serializers.FloatField()
+
+    def validate(self, attrs: Dict) -> Dict:
+        if attrs["high"] < attrs["low"]:
+            raise exceptions.ValidationError({
+                "high": ["Candle high cannot be less than candle low."]
+            })
+        return attrs
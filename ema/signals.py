@@ -1,46 +1,81 @@
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_delete
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 
 from .models import EMARecord
 from .serializers import EMARecordSerializer
-from .utils import get_dict_diff, notify_group_of_ema_record_update_via_websocket
+from .snapshots import apply_ema_record_changes, invalidate_ema_records
+from .upserts import get_ema_record_change_event
+from .subscriptions import get_ema_record_routing_states
+from .utils import notify_group_of_ema_record_update_via_websocket
+from currency.models import Currency
 
 
+# Building the serializer fields is expensive, so a single
+# serializer instance is used to represent all the records
+ema_record_serializer = EMARecordSerializer()
+
+
+
+@receiver(post_save, sender=EMARecord)
+def apply_saved_ema_record(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+    """
+    Adds or updates the saved EMA record in the EMA record snapshot and bumps
+    the EMA records data version, once the write is committed.
+
+    Registered before the websocket receivers, so the snapshot is updated before the event
+    is given a sequence number (see `ema.consumers.get_ema_record_sync_state`).
+    """
+    transaction.on_commit(lambda: apply_ema_record_changes(saved_records=[instance]))
+    return
+
+
+@receiver(post_delete, sender=EMARecord)
+def apply_deleted_ema_record(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+    """
+    Removes the deleted EMA record from the EMA record snapshot and bumps
+    the EMA records data version, once the delete is committed
+    """
+    record_id = instance.pk
+    transaction.on_commit(lambda: apply_ema_record_changes(deleted_record_ids=[record_id]))
+    return
+
 
 @receiver(pre_save, sender=EMARecord)
+def prepare_updates_for_websocket(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
+    """
+    Prepares the websocket message for changes to an EMA record, before the record is saved.
+    The message is sent by `send_updates_via_websocket` once the record is saved.
+
+    Changes are found from the values the record was loaded with (see `EMARecord.get_changed_fields`),
+    so only the changed fields are serialized, without fetching the previous record.
+    """
+    try:
+        created = instance._state.adding
+        instance._websocket_message = (
+            get_ema_record_change_event(ema_record_serializer, instance, created=created),
+            get_ema_record_routing_states(instance, created=created),
+        )
+    except Exception:
+        # Ignore any errors that occur while preparing the notification
+        instance._websocket_message = None
+    return
+
+
+@receiver(post_save, sender=EMARecord)
 def send_updates_via_websocket(sender: type[EMARecord], instance: EMARecord, **kwargs) -> None:
     """
-    Updates the frontend via websocket on changes to EMA records
+    Updates the frontend via websocket on changes to EMA records, once the changes are committed
 
     - A "create" code is sent when a new record is created alongside the new record data.
 
     - An "update" code is sent when an existing record is updated alongside the changes made to the record.
     """
+    data, states = instance.__dict__.pop("_websocket_message", None) or (None, None)
+    if not data:
+        return
     try:
-        try:
-            previous_record = EMARecord.objects.get(pk=instance.pk)
-        except EMARecord.DoesNotExist:
-            # It is a new record
-            data = EMARecordSerializer(instance).data
-            data = {
-                "code": "create",
-                "data": data
-            }
-            notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
-            return
-        
-        previous_record_dict = EMARecordSerializer(previous_record).data
-        record_dict = EMARecordSerializer(instance).data
-        # Get the changes made to the record
-        change_data = get_dict_diff(previous_record_dict, record_dict)
-        if change_data:
-            # Add the id of the record to the change_data
-            change_data["id"] = str(instance.pk)
-            data = {
-                "code": "update",
-                "data": change_data
-            }
-            notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
+        notify_group_of_ema_record_update_via_websocket("ema_record_updates", data, states=states)
     except Exception:
         # Ignore any errors that occur while sending the notification
         pass
@@ -62,8 +97,21 @@ def send_deletes_via_websocket(sender: type[EMARecord], instance: EMARecord, **k
                 "id": str(instance.pk)
             }
         }
-        notify_group_of_ema_record_update_via_websocket("ema_record_updates", data)
+        states = get_ema_record_routing_states(instance)
+        notify_group_of_ema_record_update_via_websocket("ema_record_updates", data, states=states)
     except Exception:
         # Ignore any errors that occur while sending the notification
         pass
     return
+
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_ema_records_on_currency_change(sender: type[Currency], **kwargs) -> None:
+    """
+    Invalidates the EMA record snapshot and cached EMA record responses when a currency changes,
+    since they hold the currency details of every record.
+    """
+    transaction.on_commit(invalidate_ema_records)
+    return
@@ -0,0 +1,583 @@
+import threading
+import time
+import datetime
+from collections.abc import Sequence
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_duration
+
+from .models import EMARecord
+from .row_renderers import EMARecordRowRenderer
+from .filters import WATCH_VALUE_CODES, SIDEWAYS_WATCH_CODES, split_filter_values
+from .utils import EMA_RECORDS_DATA_NAMESPACE
+from currency.models import Currency
+from helpers.queryset_filterers import QueryDictQuerySetFilterer
+from helpers.caching import get_data_version, bump_data_version
+from helpers.logging import log_exception
+from helpers import metrics
+
+
+# Values kept for each record in the snapshot
+ROW_FIELDS = [
+    "id",
+    "timeframe",
+    "close",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "trend",
+    "monhigh",
+    "monlow",
+    "monmid",
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+    "watch_code",
+    "timestamp",
+    "updated_at",
+    "currency__symbol",
+    "currency__category",
+    "currency__subcategory",
+    "currency__exchange",
+]
+ROW_FIELD_INDICES = {field: index for index, field in enumerate(ROW_FIELDS)}
+
+CURRENCY_ROW_FIELDS = ["symbol", "category", "subcategory", "exchange"]
+
+# Filterable columns of the snapshot and their dtypes
+COLUMN_DTYPES = {
+    "symbol": np.int32,
+    "exchange": np.int32,
+    "category": np.int32,
+    "subcategory": np.int32,
+    "timeframe": np.int64,
+    "trend": np.int8,
+    "watch_code": np.int8,
+    "ema20": np.float64,
+    "ema50": np.float64,
+    "ema100": np.float64,
+    "ema200": np.float64,
+    "timestamp": np.int64,
+}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_microseconds(value: datetime.timedelta) -> int:
+    return value // datetime.timedelta(microseconds=1)
+
+
+def get_row(record: EMARecord) -> Tuple:
+    """Returns the snapshot row of a saved EMA record"""
+    currency: Currency = record.currency
+    return (
+        *(getattr(record, field) for field in ROW_FIELDS[:-len(CURRENCY_ROW_FIELDS)]),
+        *(getattr(currency, field) for field in CURRENCY_ROW_FIELDS),
+    )
+
+
+
+class EMARecordSnapshotFilterer:
+    """
+    Evaluates the filters of `ema.filters.EMARecordQSFilterer` against an `EMARecordSnapshot`.
+
+    Each `parse_<key>` method returns a function that takes the snapshot and returns a
+    boolean mask of the rows matching the filter. Filters that cannot be parsed raise the
+    same errors as they do in `EMARecordQSFilterer`.
+    """
+    ParseError = QueryDictQuerySetFilterer.ParseError
+
+    def __init__(self, querydict: Mapping[str, Any]) -> None:
+        self.masks: List[Callable[["EMARecordSnapshot"], np.ndarray]] = []
+        errors = {}
+        for key, value in querydict.items():
+            if not value:
+                continue
+            try:
+                mask = getattr(self, f"parse_{key}")(value)
+            except AttributeError:
+                continue
+            except self.ParseError as exc:
+                errors[key] = exc.detail
+            else:
+                self.masks.append(mask)
+        if errors:
+            raise self.ParseError(errors)
+
+
+    def apply_filters(self, snapshot: "EMARecordSnapshot") -> np.ndarray:
+        """Returns a boolean mask of the snapshot rows that match all the filters"""
+        mask = snapshot.alive.copy()
+        for get_mask in self.masks:
+            mask &= get_mask(snapshot)
+        return mask
+
+
+    def _ema_mask(self, column: str, value: str) -> Callable:
+        value = float(value)
+        return lambda snapshot: snapshot.columns[column] == value
+
+    def parse_ema20(self, value: str) -> Callable:
+        return self._ema_mask("ema20", value)
+
+    def parse_ema50(self, value: str) -> Callable:
+        return self._ema_mask("ema50", value)
+
+    def parse_ema100(self, value: str) -> Callable:
+        return self._ema_mask("ema100", value)
+
+    def parse_ema200(self, value: str) -> Callable:
+        return self._ema_mask("ema200", value)
+
+    def parse_currency(self, value: str) -> Callable:
+        values = split_filter_values(value)
+        def mask(snapshot: "EMARecordSnapshot") -> np.ndarray:
+            codes = [snapshot.get_code(item) for item in values]
+            return np.isin(snapshot.columns["symbol"], codes) | np.isin(snapshot.columns["exchange"], codes)
+        return mask
+
+    def parse_timeframe(self, value: str) -> Callable:
+        # Values that are not valid durations match no records, like they do in the queryset filter
+        timeframes = [parse_duration(item) for item in split_filter_values(value)]
+        timeframes = [to_microseconds(timeframe) for timeframe in timeframes if timeframe is not None]
+        return lambda snapshot: np.isin(snapshot.columns["timeframe"], timeframes)
+
+    def parse_trend(self, value: str) -> Callable:
+        trend = int(value)
+        return lambda snapshot: snapshot.columns["trend"] == trend
+
+    def parse_watch(self, value: str) -> Callable:
+        if value.lower().strip() == "sideways":
+            return lambda snapshot: np.isin(snapshot.columns["watch_code"], SIDEWAYS_WATCH_CODES)
+
+        watch_code = WATCH_VALUE_CODES.get(value.upper().strip(), None)
+        if watch_code is None:
+            raise self.ParseError([f"Invalid value '{value}' for watch parameter"])
+        return lambda snapshot: snapshot.columns["watch_code"] == watch_code
+
+    def parse_category(self, value: str) -> Callable:
+        return lambda snapshot: snapshot.columns["category"] == snapshot.get_code(value)
+
+    def parse_subcategory(self, value: str) -> Callable:
+        return lambda snapshot: snapshot.columns["subcategory"] == snapshot.get_code(value)
+
+
+
+class EMARecordSnapshot:
+    """
+    In-memory, column-oriented snapshot of all EMA records.
+
+    The filterable values of the records are kept in NumPy columns, so list filters can be
+    evaluated with vectorized masks instead of database queries. Case-insensitive string
+    values (symbol, exchange, category and subcategory) are stored as integer codes.
+
+    The snapshot is kept current by the EMA record write paths of this process (see `apply_ema_record_changes`).
+    The snapshot tracks the EMA records data version it holds, and is reloaded when the version
+    is bumped by a write in another process. It is also reloaded after `max_age` seconds, in case
+    the data version is not shared between processes (when a local-memory cache is used).
+    Only the first load is made in the request path. Later reloads run in a background thread.
+    While a reload runs, `filter` returns None for data versions the snapshot does not hold,
+    so callers list the records from the database instead of serving outdated records.
+    """
+    def __init__(self, max_age: float = 5.0) -> None:
+        """
+        Create a new snapshot. The snapshot is loaded on first use.
+
+        :param max_age: Number of seconds after which the snapshot is reloaded from the database
+        """
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        # Held while the snapshot is reloaded, so only one reload runs at a time
+        self._reload_lock = threading.Lock()
+        self._reloader: threading.Thread | None = None
+        self._reloading = False
+        # Changes and data versions applied while the snapshot is reloaded,
+        # which are applied again to the reloaded snapshot
+        self._pending_changes: List[Tuple[Tuple | None, Any]] = []
+        self._pending_versions: List[int] = []
+        self._renderer = EMARecordRowRenderer(row_fields=ROW_FIELDS)
+        self._loaded_at = None
+        self._version = None
+        self._stale = False
+        self._reset(capacity=0)
+
+
+    def _reset(self, capacity: int) -> None:
+        # Rows and their cached representations are kept in object arrays,
+        # so the rows matching a filter can be picked out with a single fancy index
+        self.rows = np.full(capacity, None, dtype=object)
+        self.rendered_rows = np.full(capacity, None, dtype=object)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+        self._row_indices: Dict[Any, int] = {}
+        self._free_row_indices: List[int] = []
+        self._codes: Dict[str, int] = {}
+        self._order: np.ndarray | None = None
+
+
+    def get_code(self, value: str) -> int:
+        """
+        Returns the integer code of a case-insensitive string value.
+
+        Unknown values get a code of -1, which matches no rows.
+        """
+        return self._codes.get(value.upper(), -1)
+
+
+    @staticmethod
+    def _get_or_create_code(codes: Dict[str, int], value: str) -> int:
+        value = value.upper()
+        code = codes.get(value, None)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+
+    def _grow(self, capacity: int) -> None:
+        """Increase the number of rows that the snapshot can hold"""
+        extra = capacity - len(self.rows)
+        self.rows = np.concatenate([self.rows, np.full(extra, None, dtype=object)])
+        self.rendered_rows = np.concatenate([self.rendered_rows, np.full(extra, None, dtype=object)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.zeros(extra, dtype=column.dtype)])
+
+
+    def _get_columns(self, values: Mapping[str, Sequence], codes: Dict[str, int]) -> Dict[str, List]:
+        """
+        Convert sequences of row values, keyed by row field, to the values of the filterable columns
+
+        :param values: A mapping of row fields to the values of one or more rows
+        :param codes: The codes of case-insensitive string values. Codes are added for new values.
+        :return: A mapping of column names to column values
+        """
+        columns = {
+            name: [self._get_or_create_code(codes, value) for value in values[f"currency__{name}"]]
+            for name in ("symbol", "exchange", "category", "subcategory")
+        }
+        for name in ("ema20", "ema50", "ema100", "ema200"):
+            columns[name] = [np.nan if value is None else value for value in values[name]]
+        columns["timeframe"] = [to_microseconds(value) for value in values["timeframe"]]
+        columns["trend"] = [int(value) for value in values["trend"]]
+        columns["watch_code"] = list(values["watch_code"])
+        columns["timestamp"] = [to_microseconds(value - EPOCH) for value in values["timestamp"]]
+        return columns
+
+
+    def _set_row(self, row: Tuple) -> None:
+        record_id = row[ROW_FIELD_INDICES["id"]]
+        index = self._row_indices.get(record_id, None)
+        if index is None:
+            if not self._free_row_indices:
+                self._grow(max(16, len(self.rows) * 2))
+                self._free_row_indices.extend(
+                    index for index in range(len(self.rows) - 1, -1, -1) if not self.alive[index]
+                )
+            index = self._free_row_indices.pop()
+            self._row_indices[record_id] = index
+
+        self.rows[index] = row
+        self.rendered_rows[index] = None
+        self.alive[index] = True
+        columns = self._get_columns({field: (value,) for field, value in zip(ROW_FIELDS, row)}, self._codes)
+        for name, column in columns.items():
+            self.columns[name][index] = column[0]
+        self._order = None
+
+
+    def _remove_row(self, record_id: Any) -> None:
+        index = self._row_indices.pop(record_id, None)
+        if index is None:
+            return
+        self.rows[index] = None
+        self.rendered_rows[index] = None
+        self.alive[index] = False
+        self._free_row_indices.append(index)
+        self._order = None
+
+
+    def reload(self) -> None:
+        """
+        Reload the snapshot from the database.
+
+        The records are loaded and their columns are built without holding the snapshot lock,
+        so the current arrays keep being served until the new ones are swapped in. Changes
+        applied to the snapshot while it is reloaded are applied again to the new arrays.
+        """
+        with self._reload_lock:
+            self._reload()
+
+
+    def _reload(self) -> None:
+        # Must be called with the reload lock held
+        with self._lock:
+            self._pending_changes = []
+            self._pending_versions = []
+            self._reloading = True
+        try:
+            # The version is read first, so a write made while loading
+            # causes another reload, instead of being missed
+            version = get_data_version(EMA_RECORDS_DATA_NAMESPACE)
+            rows = list(EMARecord.objects.order_by().values_list(*ROW_FIELDS))
+            values = {field: [row[index] for row in rows] for index, field in enumerate(ROW_FIELDS)}
+            codes: Dict[str, int] = {}
+            columns = {
+                name: np.array(column, dtype=COLUMN_DTYPES[name])
+                for name, column in self._get_columns(values, codes).items()
+            }
+        except BaseException:
+            with self._lock:
+                self._reloading = False
+            raise
+
+        with self._lock:
+            self._reset(capacity=0)
+            self.rows = np.fromiter(rows, dtype=object, count=len(rows))
+            self.rendered_rows = np.full(len(rows), None, dtype=object)
+            self.alive = np.ones(len(rows), dtype=bool)
+            self._row_indices = {record_id: index for index, record_id in enumerate(values["id"])}
+            self._codes = codes
+            self.columns = columns
+            self._loaded_at = time.monotonic()
+            self._version = version
+            self._stale = False
+            self._reloading = False
+            for row, record_id in self._pending_changes:
+                if row is not None:
+                    self._set_row(row)
+                else:
+                    self._remove_row(record_id)
+            # Versions bumped by this process's own changes, which were applied again above
+            for pending_version in sorted(self._pending_versions):
+                if pending_version == self._version + 1:
+                    self._version = pending_version
+            self._pending_changes = []
+            self._pending_versions = []
+
+
+    def _reload_in_background(self) -> None:
+        try:
+            self.reload()
+        except Exception as exc:
+            log_exception(exc)
+        finally:
+            # The thread's database connection is not closed by a request cycle
+            connection.close()
+
+
+    def _start_background_reload(self) -> None:
+        """Start reloading the snapshot in a background thread, unless it is already being reloaded"""
+        if self._reloading or (self._reloader is not None and self._reloader.is_alive()):
+            return
+        self._reloader = threading.Thread(
+            target=self._reload_in_background, name="ema-record-snapshot-reload", daemon=True
+        )
+        self._reloader.start()
+
+
+    def invalidate(self) -> None:
+        """Mark the snapshot as stale, so it is reloaded on next use"""
+        with self._lock:
+            self._stale = True
+
+
+    def _ensure_loaded(self, version: int) -> None:
+        """
+        Load the snapshot if it was never loaded. Stale snapshots are reloaded in the background.
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                if (
+                    self._stale
+                    or version != self._version
+                    or time.monotonic() - self._loaded_at > self.max_age
+                ):
+                    self._start_background_reload()
+                return
+
+        # Requests made before the first load wait for the same load
+        with self._reload_lock:
+            if self._loaded_at is None:
+                self._reload()
+
+
+    def update_version(self, version: int) -> None:
+        """
+        Update the data version held by the snapshot, after this process applied 
+        its own changes to the snapshot and bumped the data version.
+
+        If the version was also bumped by another process,
+        the snapshot is missing its changes, and is marked as stale.
+        """
+        with self._lock:
+            if self._reloading:
+                self._pending_versions.append(version)
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+            else:
+                self._stale = True
+
+
+    def upsert(self, records: Iterable[EMARecord]) -> None:
+        """Add or update saved EMA records in the snapshot"""
+        with self._lock:
+            rows = [get_row(record) for record in records]
+            if self._reloading:
+                self._pending_changes.extend((row, None) for row in rows)
+            if self._loaded_at is None:
+                # The records will be included when the snapshot is loaded
+                return
+            for row in rows:
+                self._set_row(row)
+
+
+    def remove(self, record_ids: Iterable[Any]) -> None:
+        """Remove deleted EMA records from the snapshot"""
+        with self._lock:
+            record_ids = list(record_ids)
+            if self._reloading:
+                self._pending_changes.extend((None, record_id) for record_id in record_ids)
+            for record_id in record_ids:
+                self._remove_row(record_id)
+
+
+    def holds(self, version: int) -> bool:
+        """
+        Returns True if the snapshot holds all the changes up to the data version.
+        Must be called with the snapshot lock held.
+        """
+        return (
+            self._loaded_at is not None
+            and not self._stale
+            and self._version is not None
+            and self._version >= version
+        )
+
+
+    def render(self, rendered_rows: np.ndarray, index: int, row: Tuple) -> Dict:
+        """
+        Returns the representation of a row, as returned by the `EMARecordSerializer`.
+
+        Representations are cached until the row at the index changes.
+
+        :param rendered_rows: The array of cached representations the row's index refers to.
+            Reloads swap in new arrays, so results keep the array they were filtered from.
+        """
+        rendered_row = rendered_rows[index]
+        if rendered_row is not None and rendered_row[0] is row:
+            return rendered_row[1]
+        data = self._renderer.render(row)
+        rendered_rows[index] = (row, data)
+        return data
+
+
+    def filter(
+        self, 
+        querydict: Mapping[str, Any], 
+        version: int | None = None,
+        fieldset: Dict[str, List[str] | None] | None = None
+    ) -> "EMARecordSnapshotResults | None":
+        """
+        Returns the EMA records that match the filters in the querydict,
+        ordered by timestamp (newest first).
+
+        Returns None if the snapshot does not hold the data version yet, e.g. while it is reloaded
+        after a write made by another process. List the records from the database in that case,
+        so responses for the version never hold older records.
+
+        :param querydict: Query parameters supported by `ema.filters.EMARecordQSFilterer`
+        :param version: The current EMA records data version, if it was already fetched
+        :param fieldset: A sparse fieldset (see `ema.serializers.parse_fieldset`) to render the records with.
+            Records rendered with a sparse fieldset are not cached.
+        :raises: `ParseError` (or `ValueError`) if the filters cannot be parsed
+        """
+        filterer = EMARecordSnapshotFilterer(querydict)
+        if version is None:
+            version = get_data_version(EMA_RECORDS_DATA_NAMESPACE)
+        self._ensure_loaded(version)
+        with self._lock:
+            if not self.holds(version):
+                metrics.increment("ema_records.snapshot.misses")
+                return None
+            if self._order is None:
+                # Newest first. Rows that are not alive are filtered out by the mask
+                self._order = np.argsort(-self.columns["timestamp"], kind="stable")
+            order = self._order
+            mask = filterer.apply_filters(self)
+            indices = order[mask[order]]
+            renderer = None if fieldset is None else EMARecordRowRenderer(fieldset, row_fields=ROW_FIELDS)
+            return EMARecordSnapshotResults(self, indices, self.rows[indices], self.rendered_rows, renderer)
+
+
+
+class EMARecordSnapshotResults(Sequence):
+    """
+    EMA records matched by a snapshot filter.
+
+    Records are only rendered when they are accessed, so paginating
+    the results only renders the records on the requested page.
+    """
+    def __init__(
+        self, 
+        snapshot: EMARecordSnapshot, 
+        indices: np.ndarray, 
+        rows: np.ndarray,
+        rendered_rows: np.ndarray,
+        renderer: EMARecordRowRenderer | None = None
+    ) -> None:
+        self.snapshot = snapshot
+        self.indices = indices
+        # The matched rows are kept, so later writes to the snapshot do not change the results
+        self.rows = rows
+        # The indices refer to the arrays the rows were filtered from,
+        # which reloads and growing the snapshot replace
+        self.rendered_rows = rendered_rows
+        self.renderer = renderer
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, item: int | slice) -> Dict | List[Dict]:
+        if isinstance(item, slice):
+            return [self[index] for index in range(*item.indices(len(self)))]
+        if self.renderer is not None:
+            return self.renderer.render(self.rows[item])
+        return self.snapshot.render(self.rendered_rows, int(self.indices[item]), self.rows[item])
+
+
+
+ema_record_snapshot = EMARecordSnapshot(
+    max_age=settings.EMA_RECORDS_SNAPSHOT_MAX_AGE
+)
+
+
+def apply_ema_record_changes(
+    saved_records: Iterable[EMARecord] = (), 
+    deleted_record_ids: Iterable[Any] = ()
+) -> None:
+    """
+    Apply committed changes to EMA records to the snapshot, and bump the EMA records data version.
+
+    Call this once the changes have been committed.
+
+    :param saved_records: The created and updated records
+    :param deleted_record_ids: The ids of the deleted records
+    """
+    ema_record_snapshot.upsert(saved_records)
+    ema_record_snapshot.remove(deleted_record_ids)
+    ema_record_snapshot.update_version(bump_data_version(EMA_RECORDS_DATA_NAMESPACE))
+    return None
+
+
+def invalidate_ema_records() -> None:
+    """
+    Invalidate the snapshot and the data version of the EMA records, 
+    after changes that affect many records, such as changes to currencies.
+    """
+    ema_record_snapshot.invalidate()
+    bump_data_version(EMA_RECORDS_DATA_NAMESPACE)
+    return None
@@ -0,0 +1,419 @@
+import asyncio
+import math
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Set, Tuple
+from channels.layers import get_channel_layer
+from django.utils.dateparse import parse_duration
+
+from .models import EMARecord
+from .event_log import EMA_RECORD_RESYNC_MESSAGE_TYPE
+from .filters import WATCH_VALUE_CODES, SIDEWAYS_WATCH_CODES, split_filter_values
+from .snapshots import to_microseconds
+from currency.models import Currency
+from helpers.queryset_filterers import QueryDictQuerySetFilterer
+from helpers.logging import log_exception
+
+
+# Values of an EMA record that subscriptions can filter on
+ROUTING_STATE_FIELDS = [
+    "symbol",
+    "exchange",
+    "category",
+    "subcategory",
+    "timeframe",
+    "trend",
+    "watch_code",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+]
+
+
+def get_routing_state(values: Mapping[str, Any], currency: Currency) -> Dict[str, Any]:
+    """
+    Returns the values of an EMA record that subscriptions filter on.
+
+    :param values: The record's field values, keyed by attname
+    :param currency: The record's currency
+    """
+    return {
+        "symbol": currency.symbol.upper(),
+        "exchange": currency.exchange.upper(),
+        "category": currency.category.upper(),
+        "subcategory": currency.subcategory.upper(),
+        "timeframe": to_microseconds(values["timeframe"]),
+        "trend": int(values["trend"]),
+        "watch_code": values["watch_code"],
+        "ema20": values["ema20"],
+        "ema50": values["ema50"],
+        "ema100": values["ema100"],
+        "ema200": values["ema200"],
+    }
+
+
+def get_ema_record_routing_states(record: EMARecord, created: bool = False) -> List[Dict[str, Any]] | None:
+    """
+    Returns the routing states of an EMA record event, used to find the subscriptions the event is sent to.
+
+    An event is sent to the subscriptions that match the record before or after the change,
+    so subscribers also learn about records that no longer match their filters.
+    The record's watch code must be up to date.
+
+    :param record: The record that is about to be created or updated, or that was deleted
+    :param created: Whether the record is about to be created
+    :return: The routing states, or None if they could not be determined,
+        in which case the event is sent to every subscription
+    """
+    try:
+        currency = record.currency
+        states = [get_routing_state(record.get_field_values(), currency)]
+        loaded_values = getattr(record, "_loaded_values", None)
+        if not created and loaded_values is not None and loaded_values.get("currency_id") == record.currency_id:
+            previous_state = get_routing_state(loaded_values, currency)
+            if previous_state != states[0]:
+                states.insert(0, previous_state)
+        return states
+    except Exception:
+        return None
+
+
+
+class EMARecordSubscription:
+    """
+    Filters for the EMA record events sent to a websocket connection.
+
+    Supports the same filters as `ema.filters.EMARecordQSFilterer`. Each filter is parsed into a predicate,
+    a tuple of the routing state fields it checks and the values it allows. A state matches a predicate
+    if any of the fields has an allowed value, and matches the subscription if it matches all the predicates.
+    """
+    ParseError = QueryDictQuerySetFilterer.ParseError
+
+    # Order in which predicates are picked to index subscriptions by. More selective filters come first
+    INDEX_PRIORITY = ["currency", "ema20", "ema50", "ema100", "ema200", "watch", "category", "subcategory", "timeframe", "trend"]
+
+    def __init__(self, filters: Mapping[str, Any] | None = None) -> None:
+        """
+        Create a new subscription. A subscription without filters matches every record.
+
+        :param filters: Filters, as accepted by `ema.filters.EMARecordQSFilterer`
+        :raises: `ParseError` if any filter is invalid
+        """
+        self.filters = {key: value for key, value in (filters or {}).items() if value}
+        self.predicates: Dict[str, Tuple[Tuple[str, ...], FrozenSet]] = {}
+        errors = {}
+        for key, value in self.filters.items():
+            try:
+                predicate = getattr(self, f"parse_{key}")(str(value))
+            except AttributeError:
+                continue
+            except self.ParseError as exc:
+                errors[key] = exc.detail
+            except ValueError:
+                errors[key] = [f"Invalid value '{value}' for {key} parameter"]
+            else:
+                self.predicates[key] = predicate
+        if errors:
+            raise self.ParseError(errors)
+
+
+    def matches(self, state: Mapping[str, Any]) -> bool:
+        """Returns True if the routing state matches all the predicates of the subscription"""
+        for fields, values in self.predicates.values():
+            if not any(state[field] in values for field in fields):
+                return False
+        return True
+
+
+    def get_index_keys(self) -> List[Tuple[str, Any]]:
+        """
+        Returns the (field, value) keys the subscription is indexed by.
+        A state can only match the subscription if it has one of these keys.
+        An empty list means the subscription has to be checked against every state.
+        """
+        for key in self.INDEX_PRIORITY:
+            if key in self.predicates:
+                fields, values = self.predicates[key]
+                return [(field, value) for field in fields for value in values]
+        return []
+
+
+    def _ema_predicate(self, field: str, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        value = float(value)
+        # NaN never equals anything, like it never matches in the database
+        return (field,), frozenset() if math.isnan(value) else frozenset([value])
+
+    def parse_ema20(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return self._ema_predicate("ema20", value)
+
+    def parse_ema50(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return self._ema_predicate("ema50", value)
+
+    def parse_ema100(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return self._ema_predicate("ema100", value)
+
+    def parse_ema200(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return self._ema_predicate("ema200", value)
+
+    def parse_currency(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return ("symbol", "exchange"), frozenset(item.upper() for item in split_filter_values(value))
+
+    def parse_timeframe(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        timeframes = set()
+        for item in split_filter_values(value):
+            timeframe = parse_duration(item)
+            if timeframe is None:
+                raise self.ParseError([f"Invalid value '{item}' for timeframe parameter"])
+            timeframes.add(to_microseconds(timeframe))
+        return ("timeframe",), frozenset(timeframes)
+
+    def parse_trend(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return ("trend",), frozenset([int(value)])
+
+    def parse_watch(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        if value.lower().strip() == "sideways":
+            return ("watch_code",), frozenset(SIDEWAYS_WATCH_CODES)
+
+        watch_code = WATCH_VALUE_CODES.get(value.upper().strip(), None)
+        if watch_code is None:
+            raise self.ParseError([f"Invalid value '{value}' for watch parameter"])
+        return ("watch_code",), frozenset([watch_code])
+
+    def parse_category(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return ("category",), frozenset([value.upper()])
+
+    def parse_subcategory(self, value: str) -> Tuple[Tuple[str, ...], FrozenSet]:
+        return ("subcategory",), frozenset([value.upper()])
+
+
+
+class SubscriptionIndex:
+    """
+    Index of the subscriptions of the websocket connections in this process.
+
+    Subscriptions are indexed by the (field, value) keys of one of their predicates
+    (see `EMARecordSubscription.get_index_keys`), so finding the subscriptions that match
+    a state only checks the subscriptions that share a key with it, and the subscriptions without filters.
+    """
+    def __init__(self) -> None:
+        self.subscriptions: Dict[Any, EMARecordSubscription] = {}
+        self._index: Dict[Tuple[str, Any], Set[Any]] = {}
+        self._unindexed: Set[Any] = set()
+        self._index_fields: Dict[str, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+
+    def add(self, subscriber: Any, subscription: EMARecordSubscription) -> None:
+        """Add or replace the subscription of a subscriber"""
+        self.remove(subscriber)
+        self.subscriptions[subscriber] = subscription
+        keys = subscription.get_index_keys()
+        if not keys:
+            self._unindexed.add(subscriber)
+            return None
+        for key in keys:
+            self._index.setdefault(key, set()).add(subscriber)
+            self._index_fields[key[0]] = self._index_fields.get(key[0], 0) + 1
+        return None
+
+
+    def remove(self, subscriber: Any) -> None:
+        """Remove the subscription of a subscriber, if any"""
+        subscription = self.subscriptions.pop(subscriber, None)
+        if subscription is None:
+            return None
+        self._unindexed.discard(subscriber)
+        for key in subscription.get_index_keys():
+            subscribers = self._index.get(key, None)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._index[key]
+            self._index_fields[key[0]] -= 1
+            if not self._index_fields[key[0]]:
+                del self._index_fields[key[0]]
+        return None
+
+
+    def match(self, states: Iterable[Mapping[str, Any]] | None) -> Set[Any]:
+        """
+        Returns the subscribers whose subscriptions match any of the states
+
+        :param states: Routing states of an event. If None, all the subscribers are returned.
+        """
+        if states is None:
+            return set(self.subscriptions)
+
+        matches = set()
+        for state in states:
+            candidates = set(self._unindexed)
+            for field in self._index_fields:
+                candidates.update(self._index.get((field, state[field]), ()))
+            for subscriber in candidates - matches:
+                if self.subscriptions[subscriber].matches(state):
+                    matches.add(subscriber)
+        return matches
+
+
+
+class EMARecordEventRouter:
+    """
+    Routes EMA record events to the websocket connections of this process.
+
+    Instead of every connection joining the EMA record updates group, the router joins
+    the group once per process, receives every event once, and sends each event only to
+    the connections whose subscriptions match it (see `SubscriptionIndex`).
+    """
+    # Group memberships expire in the channel layer, so the router rejoins the group periodically
+    GROUP_REJOIN_INTERVAL = 60 * 60
+
+    def __init__(self, group_name: str, channel_layer_alias: str = "default") -> None:
+        self.group_name = group_name
+        self.channel_layer_alias = channel_layer_alias
+        self.index = SubscriptionIndex()
+        self._task: asyncio.Task | None = None
+        # Resolved once the router has joined the group
+        self._joined: asyncio.Future | None = None
+
+
+    async def subscribe(self, consumer: Any, subscription: EMARecordSubscription) -> None:
+        """
+        Add or replace the subscription of a consumer.
+        The router starts receiving events when the first consumer subscribes.
+        Returns once the router has joined the group.
+        """
+        self.index.add(consumer, subscription)
+        if self._task is None or self._task.done():
+            # The task is stored before the first await, so consumers that subscribe
+            # concurrently wait for the same task to join, instead of starting their own
+            loop = asyncio.get_running_loop()
+            self._joined = loop.create_future()
+            self._task = loop.create_task(self._run(self._joined))
+        await asyncio.shield(self._joined)
+        return None
+
+
+    def unsubscribe(self, consumer: Any) -> None:
+        """Remove the subscription of a consumer"""
+        self.index.remove(consumer)
+        return None
+
+
+    async def _run(self, joined: asyncio.Future) -> None:
+        try:
+            channel_layer = get_channel_layer(self.channel_layer_alias)
+            channel_name = await channel_layer.new_channel()
+            await channel_layer.group_add(self.group_name, channel_name)
+        except asyncio.CancelledError:
+            joined.cancel()
+            raise
+        except Exception as exc:
+            # Raised in the subscribing consumers. The next subscription starts a new task
+            joined.set_exception(exc)
+            return
+        joined.set_result(None)
+
+        # The group is rejoined on a timer, since no events may be received for longer than the membership lasts
+        rejoin_task = asyncio.get_running_loop().create_task(self._rejoin_periodically(channel_layer, channel_name))
+        try:
+            while True:
+                try:
+                    message = await channel_layer.receive(channel_name)
+                    await self.dispatch(message)
+                    # Let the send queues of the consumers drain between messages,
+                    # since receiving buffered messages does not yield to the event loop
+                    await asyncio.sleep(0)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    log_exception(exc)
+        finally:
+            rejoin_task.cancel()
+
+
+    async def _rejoin_periodically(self, channel_layer, channel_name: str) -> None:
+        while True:
+            await asyncio.sleep(self.GROUP_REJOIN_INTERVAL)
+            try:
+                await channel_layer.group_add(self.group_name, channel_name)
+            except Exception as exc:
+                log_exception(exc)
+
+
+    async def dispatch(self, message: Dict) -> None:
+        """
+        Send an EMA record updates group message to the matching consumers.
+
+        Consumers that get the same events are sent the same message, with a shared "frames" dict
+        that consumers cache their encoded frames in, so each frame is encoded once per encoding.
+        """
+        message_type = message.get("type", None)
+        if message_type == "send.ema_record_update":
+            consumers = self.index.match(message.get("states", None))
+            message = {**message, "frames": {}}
+            for consumer in consumers:
+                await self._send(consumer, "send_ema_record_update", message)
+
+        elif message_type == "send.ema_record_updates":
+            states = message.get("states", None) or [None] * len(message["data"])
+            indices_by_consumer: Dict[Any, List[int]] = {}
+            for index, event_states in enumerate(states):
+                for consumer in self.index.match(event_states):
+                    indices_by_consumer.setdefault(consumer, []).append(index)
+
+            messages_by_indices: Dict[Tuple[int, ...], Dict] = {}
+            for consumer, indices in indices_by_consumer.items():
+                indices = tuple(indices)
+                consumer_message = messages_by_indices.get(indices, None)
+                if consumer_message is None:
+                    consumer_message = messages_by_indices[indices] = {
+                        **message,
+                        "data": [message["data"][index] for index in indices],
+                        "states": None,
+                        "frames": {}
+                    }
+                await self._send(consumer, "send_ema_record_updates", consumer_message)
+
+        elif message_type == EMA_RECORD_RESYNC_MESSAGE_TYPE:
+            for consumer in list(self.index.subscriptions):
+                await self._send(consumer, "send_ema_record_resync", message)
+        return None
+
+
+    def filter_message(self, consumer: Any, message: Dict) -> Dict | None:
+        """
+        Returns the part of an EMA record updates group message that matches the subscription of a consumer
+
+        :return: The message, with only the matching events if it is a batched message,
+            or None if no event matches or the consumer is not subscribed
+        """
+        subscription = self.index.subscriptions.get(consumer, None)
+        if subscription is None:
+            return None
+
+        def matches(states: List[Dict] | None) -> bool:
+            return states is None or any(subscription.matches(state) for state in states)
+
+        message_type = message.get("type", None)
+        if message_type == "send.ema_record_update":
+            return message if matches(message.get("states", None)) else None
+
+        if message_type == "send.ema_record_updates":
+            states = message.get("states", None) or [None] * len(message["data"])
+            events = [event for event, event_states in zip(message["data"], states) if matches(event_states)]
+            return {**message, "data": events, "states": None} if events else None
+        return None
+
+
+    async def _send(self, consumer: Any, handler_name: str, event: Dict) -> None:
+        try:
+            await getattr(consumer, handler_name)(event)
+        except Exception as exc:
+            log_exception(exc)
+        return None
+
+
+
+ema_record_event_router = EMARecordEventRouter("ema_record_updates")
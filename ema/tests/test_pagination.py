@@ -0,0 +1,67 @@
+import datetime
+from typing import Dict, List
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+
+from currency.models import Categories, Currency
+from ema.models import EMARecord
+from .test_upserts import EXISTING_VALUES
+
+
+class EMARecordCursorPaginationTests(TestCase):
+    """
+    Checks that cursor pagination walks through EMA records that share a timestamp,
+    as records written in bulk do, without skipping or repeating any of them.
+    """
+    @classmethod
+    def setUpTestData(cls) -> None:
+        for index in range(7):
+            currency = Currency.objects.create(
+                symbol=f"C{index}", category=Categories.CRYPTO, subcategory="Coins", exchange="BINANCE"
+            )
+            for hours in (1, 4):
+                EMARecord.objects.create(
+                    currency=currency, timeframe=datetime.timedelta(hours=hours), **EXISTING_VALUES
+                )
+        EMARecord.objects.update(timestamp=timezone.now())
+        cls.expected_ids = [
+            str(pk) for pk in EMARecord.objects.order_by("-timestamp", "-id").values_list("id", flat=True)
+        ]
+
+
+    def setUp(self) -> None:
+        _, key = APIKey.objects.create_key(name="test")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_KEY=key)
+
+
+    def get_pages(self, url: str, link: str) -> List[Dict]:
+        """Returns the pages from `url`, following the "next" or "previous" links"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data[link]
+        return pages
+
+
+    def test_pages_hold_every_record_once(self) -> None:
+        url = reverse("api:ema_records:ema-record__list-create") + "?pagination=cursor&limit=3&fields=id"
+        pages = self.get_pages(url, "next")
+        self.assertEqual(len(pages), 5)
+        self.assertEqual([record["id"] for page in pages for record in page["results"]], self.expected_ids)
+
+        previous_pages = self.get_pages(pages[-1]["previous"], "previous")
+        self.assertEqual(
+            [record["id"] for page in reversed(previous_pages) for record in page["results"]],
+            self.expected_ids[:-len(pages[-1]["results"])]
+        )
+
+
+    def test_invalid_cursor_is_not_found(self) -> None:
+        response = self.client.get(reverse("api:ema_records:ema-record__list-create") + "?cursor=abc")
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,222 @@
+import datetime
+import itertools
+import json
+import unittest
+from typing import Dict, Iterator, List
+from django.db import connection, models
+from django.test import TestCase
+
+from currency.models import Categories, Currency
+from currency.symbols import CurrencySymbolCache
+from ema.filters import EMARecordQSFilterer, WATCH_VALUE_QUERY_FILTERS
+from ema.models import EMARecord, TrendChoices
+from ema.views import ema_record_qs
+
+
+# A value for each of the EMA record list filters, as sent in query parameters.
+# The test data is built so that each value matches only a few records.
+FILTER_VALUES = {
+    "currency": "SYM7,EXCHANGE3",
+    "timeframe": "1:00:00,4:00:00",
+    "watch": "A",
+    "category": "forex",
+    "subcategory": "majors",
+}
+
+# Names of the indexes that serve each filter. The index on `watch_code` is
+# named by Django, so its name is looked up (see `get_index_names`).
+FILTER_INDEXES = {
+    "currency": ["currency_symbol_upper_idx", "currency_exchange_upper_idx"],
+    "timeframe": ["ema_record_timeframe_trend_idx"],
+    "watch": [],
+    "category": ["currency_category_upper_idx"],
+    "subcategory": ["currency_subcategory_upper_idx"],
+}
+
+# The trend filter matches too many records to be served by an index on its own,
+# but it is served by the timeframe index when combined with the timeframe filter
+TIMEFRAME_TREND_FILTER_VALUES = {
+    "timeframe": FILTER_VALUES["timeframe"],
+    "trend": "1",
+}
+
+# The EMA value filters are not index-backed. Records are read in list order, and checked
+# until the page is full.
+EMA_FILTER_VALUES = {
+    "ema20": "1.5",
+    "ema50": "1.5",
+    "ema100": "1.5",
+    "ema200": "1.5",
+}
+
+# Index that serves the list order of EMA records
+ORDERING_INDEX = "ema_record_timestamp_id_idx"
+
+# Timeframes of the records of most currencies
+TIMEFRAMES = [datetime.timedelta(hours=hours) for hours in (5, 6, 7, 8, 9)]
+# Timeframes of the records of the few currencies that match the timeframe filter value
+RARE_TIMEFRAMES = [datetime.timedelta(hours=hours) for hours in (1, 4, 5, 6, 7)]
+# Watch values of the records that do not match the watch filter value
+COMMON_WATCH_VALUES = ["B", "C", "D", "E", "F"]
+
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "Query plans are checked on PostgreSQL only")
+class EMARecordQueryPlanTests(TestCase):
+    """
+    Checks that the queries of the EMA record list filters, and of currency symbol
+    resolution, are served by indexes. Sequential scans are disabled, so the planner
+    only picks one for a query if no index can serve it.
+
+    Filtered queries must use the indexes of their filters. Otherwise, the planner can still
+    read the records in list order through the ordering index, and check the filters on every row.
+    """
+    @classmethod
+    def setUpTestData(cls) -> None:
+        # Only a few records match each of the filter values, so the planner prefers the filters'
+        # indexes to reading the records in list order and checking the filters on every row
+        currencies = Currency.objects.bulk_create([
+            Currency(
+                symbol=f"SYM{index}",
+                category=Categories.FOREX if index % 200 == 0 else Categories.CRYPTO,
+                subcategory="Majors" if index % 200 == 1 else "Coins",
+                exchange=f"EXCHANGE{index % 200}",
+            )
+            for index in range(400)
+        ])
+        records = []
+        for currency_index, currency in enumerate(currencies):
+            timeframes = RARE_TIMEFRAMES if currency_index % 200 == 2 else TIMEFRAMES
+            for timeframe in timeframes:
+                index = len(records)
+                watch_value = "A" if index % 200 == 3 else COMMON_WATCH_VALUES[index % len(COMMON_WATCH_VALUES)]
+                record = EMARecord(
+                    currency=currency,
+                    timeframe=timeframe,
+                    close=index,
+                    ema20=index,
+                    ema50=index,
+                    ema100=index,
+                    ema200=index,
+                    trend=TrendChoices.values[index % 3],
+                    monhigh=index,
+                    monlow=index,
+                    monmid=index,
+                    **WATCH_VALUE_QUERY_FILTERS[watch_value],
+                )
+                record.update_watch_code()
+                records.append(record)
+        EMARecord.objects.bulk_create(records)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE currency_currency, ema_emarecord")
+        cls.filter_indexes = {
+            **FILTER_INDEXES,
+            "watch": cls.get_index_names(EMARecord, ["watch_code"]),
+        }
+
+
+    def setUp(self) -> None:
+        # Reverted when the test's transaction is rolled back
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+
+    @staticmethod
+    def get_index_names(model: type[models.Model], columns: list[str]) -> list[str]:
+        """Returns the names of the indexes of the model's table on exactly the columns"""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        return [
+            name for name, constraint in constraints.items()
+            if constraint["index"] and constraint["columns"] == columns
+        ]
+
+
+    def get_list_plan(self, query_params: Dict[str, str]) -> Dict:
+        """Returns the query plan of the first page of EMA records listed with the filters"""
+        queryset = EMARecordQSFilterer(query_params).apply_filters(ema_record_qs)
+        return self.get_plan(queryset[:50])
+
+
+    def get_plan(self, queryset: models.QuerySet) -> Dict:
+        return json.loads(queryset.explain(format="json"))[0]["Plan"]
+
+
+    def get_nodes(self, plan: Dict) -> Iterator[Dict]:
+        """Yields the nodes of the plan"""
+        yield plan
+        for subplan in plan.get("Plans", []):
+            yield from self.get_nodes(subplan)
+
+
+    def get_scans(self, plan: Dict) -> Iterator[Dict]:
+        """Yields the scan nodes of the plan"""
+        return (node for node in self.get_nodes(plan) if node["Node Type"].endswith("Scan"))
+
+
+    def assertNoSeqScan(self, plan: Dict) -> None:
+        """
+        Asserts that no relation of the plan is read in full. Relations read in full through an index,
+        with the query's conditions checked on every row, count as sequential scans.
+        """
+        for scan in self.get_scans(plan):
+            full_index_scan = (
+                scan["Node Type"].startswith("Index")
+                and "Filter" in scan
+                and "Index Cond" not in scan
+            )
+            if scan["Node Type"] == "Seq Scan" or full_index_scan:
+                self.fail(f"Query plan scans {scan['Relation Name']} sequentially:\n{json.dumps(plan, indent=2)}")
+
+
+    def assertUsesIndex(self, plan: Dict, index_names: List[str]) -> None:
+        """Asserts that the plan reads any of the indexes"""
+        used_index_names = {scan.get("Index Name", None) for scan in self.get_scans(plan)}
+        if used_index_names.isdisjoint(index_names):
+            self.fail(f"Query plan does not use any of {index_names}:\n{json.dumps(plan, indent=2)}")
+
+
+    def test_filters_use_their_indexes(self) -> None:
+        self.assertTrue(self.filter_indexes["watch"])
+        for count in range(1, len(FILTER_VALUES) + 1):
+            for names in itertools.combinations(FILTER_VALUES, count):
+                query_params = {name: FILTER_VALUES[name] for name in names}
+                with self.subTest(filters=names):
+                    plan = self.get_list_plan(query_params)
+                    self.assertNoSeqScan(plan)
+                    # Any of the filters' indexes may be used, with the other filters checked on the rows it finds
+                    self.assertUsesIndex(plan, [index for name in names for index in self.filter_indexes[name]])
+
+
+    def test_timeframe_and_trend_filters_use_their_index(self) -> None:
+        plan = self.get_list_plan(TIMEFRAME_TREND_FILTER_VALUES)
+        self.assertNoSeqScan(plan)
+        self.assertUsesIndex(plan, FILTER_INDEXES["timeframe"])
+
+
+    def test_ema_filters_are_read_in_timestamp_order(self) -> None:
+        for name, value in EMA_FILTER_VALUES.items():
+            with self.subTest(filter=name):
+                plan = self.get_list_plan({name: value})
+                self.assertUsesIndex(plan, [ORDERING_INDEX])
+                self.assertNotIn("Sort", [node["Node Type"] for node in self.get_nodes(plan)])
+
+
+    def test_unfiltered_list_is_read_in_timestamp_order(self) -> None:
+        plan = self.get_list_plan({})
+        self.assertNoSeqScan(plan)
+        self.assertUsesIndex(plan, [ORDERING_INDEX])
+        self.assertNotIn("Sort", [node["Node Type"] for node in self.get_nodes(plan)])
+
+
+    def test_currency_symbol_lookups_do_not_scan_sequentially(self) -> None:
+        querysets = {
+            "resolution": CurrencySymbolCache.get_queryset(["SYM7", "SYM8"]),
+            "iexact": Currency.objects.filter(symbol__iexact="sym7"),
+        }
+        for name, queryset in querysets.items():
+            with self.subTest(lookup=name):
+                plan = self.get_plan(queryset)
+                self.assertNoSeqScan(plan)
+                self.assertUsesIndex(plan, ["currency_symbol_upper_idx"])
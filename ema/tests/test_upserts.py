@@ -0,0 +1,195 @@
+import datetime
+from typing import Dict, List, Tuple
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+
+from currency.models import Categories, Currency
+from ema.models import EMARecord, EMARecordHistory
+from ema.outbox import websocket_event_outbox
+from ema.serializers import EMARecordSerializer
+from ema.utils import get_dict_diff
+
+
+TIMEFRAME = datetime.timedelta(hours=1)
+
+EXISTING_VALUES = {
+    "close": 10.0,
+    "ema20": 1.0,
+    "ema50": 2.0,
+    "ema100": 3.0,
+    "ema200": 4.0,
+    "trend": "1",
+    "monhigh": 1.0,
+    "monlow": 1.0,
+    "monmid": 1.0,
+    "twenty_greater_than_fifty": True,
+    "fifty_greater_than_hundred": True,
+    "hundred_greater_than_twohundred": False,
+    "close_greater_than_hundred": True,
+}
+
+
+def get_payload(currency_symbol: str, **values) -> Dict:
+    """Returns an EMA record payload with the values of the existing records, updated with `values`"""
+    payload = {
+        "currency_symbol": currency_symbol,
+        "timeframe": "1:00:00",
+        "close": EXISTING_VALUES["close"],
+        "ema20": EXISTING_VALUES["ema20"],
+        "ema50": EXISTING_VALUES["ema50"],
+        "ema100": EXISTING_VALUES["ema100"],
+        "ema200": EXISTING_VALUES["ema200"],
+        "trend": EXISTING_VALUES["trend"],
+        "monhigh": EXISTING_VALUES["monhigh"],
+        "monlow": EXISTING_VALUES["monlow"],
+        "monmid": EXISTING_VALUES["monmid"],
+        "20>50": EXISTING_VALUES["twenty_greater_than_fifty"],
+        "50>100": EXISTING_VALUES["fifty_greater_than_hundred"],
+        "100>200": EXISTING_VALUES["hundred_greater_than_twohundred"],
+        "close>100": EXISTING_VALUES["close_greater_than_hundred"],
+    }
+    payload.update(values)
+    return payload
+
+
+
+class EMARecordBulkUpsertTests(TestCase):
+    """
+    Checks the records, errors and websocket events of bulk EMA record writes.
+
+    The currency "AAA" has no record yet, and the currencies "BBB" and "CCC" have a record
+    in the 1 hour timeframe, with the values of `EXISTING_VALUES`.
+    """
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.currencies = {
+            symbol: Currency.objects.create(
+                symbol=symbol, category=Categories.CRYPTO, subcategory="Coins", exchange="BINANCE"
+            )
+            for symbol in ("AAA", "BBB", "CCC")
+        }
+        cls.created_at = timezone.now() - datetime.timedelta(days=1)
+        for symbol in ("BBB", "CCC"):
+            EMARecord.objects.create(currency=cls.currencies[symbol], timeframe=TIMEFRAME, **EXISTING_VALUES)
+        # Existing records were created long before they are updated
+        EMARecord.objects.update(timestamp=cls.created_at, updated_at=cls.created_at)
+
+
+    def setUp(self) -> None:
+        _, key = APIKey.objects.create_key(name="test")
+        self.client = APIClient()
+        self.client.credentials(HTTP_X_API_KEY=key)
+
+
+    def post(self, data: List[Dict]) -> Tuple[Response, List[Dict]]:
+        """
+        Post EMA records in bulk, and commit the write.
+
+        :return: The response, and the websocket messages added to the outbox
+        """
+        with mock.patch.object(websocket_event_outbox, "put") as put:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse("api:ema_records:ema-record__list-create"), data, format="json"
+                )
+        return response, [message for _, message in (call.args for call in put.call_args_list)]
+
+
+    def get_record(self, symbol: str) -> EMARecord:
+        return EMARecord.objects.select_related("currency").get(
+            currency__symbol=symbol, timeframe=TIMEFRAME
+        )
+
+
+    def test_bulk_post_writes_valid_items_and_reports_errors_by_index(self) -> None:
+        previous_record = self.get_record("BBB")
+        previous_data = EMARecordSerializer(previous_record).data
+        history_count = EMARecordHistory.objects.count()
+
+        response, messages = self.post([
+            get_payload("aaa", close=20.0),
+            get_payload("BBB", close=30.0, ema20=5.0),
+            get_payload("nope"),
+            get_payload("AAA", close="abc"),
+            # Same currency and timeframe as the first item, so it wins
+            get_payload("AAA", close=21.0),
+            get_payload("CCC"),
+        ])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["status"], "success")
+        self.assertEqual(list(response.data["errors"]), ["2", "3"])
+        self.assertIn("currency_symbol", response.data["errors"]["2"])
+        self.assertIn("close", response.data["errors"]["3"])
+
+        created_record = self.get_record("AAA")
+        updated_record = self.get_record("BBB")
+        unchanged_record = self.get_record("CCC")
+        self.assertEqual(EMARecord.objects.filter(currency=self.currencies["AAA"]).count(), 1)
+        self.assertEqual(created_record.close, 21.0)
+        self.assertEqual((updated_record.close, updated_record.ema20), (30.0, 5.0))
+        self.assertEqual(updated_record.pk, previous_record.pk)
+        # Updated records keep the time they were created at
+        self.assertEqual(updated_record.timestamp, self.created_at)
+        self.assertEqual(unchanged_record.updated_at, self.created_at)
+
+        # Unchanged records are returned, but not written to the history
+        self.assertEqual(
+            response.data["data"],
+            EMARecordSerializer([created_record, updated_record, unchanged_record], many=True).data
+        )
+        self.assertEqual(EMARecordHistory.objects.count(), history_count + 2)
+
+        # Events are built before the write, the same way `ema.signals` builds them on `pre_save`:
+        # a new record is represented in full, before it has timestamps, and an update holds the
+        # fields whose representation differs from the previous record's
+        pending_record = self.get_record("BBB")
+        pending_record.close, pending_record.ema20 = 30.0, 5.0
+        pending_record.updated_at = previous_record.updated_at
+        expected_change_data = get_dict_diff(previous_data, EMARecordSerializer(pending_record).data)
+        expected_change_data["id"] = str(updated_record.pk)
+        expected_create_data = {
+            **EMARecordSerializer(created_record).data,
+            "timestamp": None,
+            "updated_at": None,
+        }
+        self.assertEqual(
+            [(message["type"], message["data"]) for message in messages],
+            [
+                ("send.ema_record_update", {"code": "create", "data": expected_create_data}),
+                ("send.ema_record_update", {"code": "update", "data": expected_change_data}),
+            ]
+        )
+        self.assertEqual(list(expected_change_data), ["close", "ema20", "id"])
+        # Updates are routed to the subscriptions that match the record before or after the change
+        self.assertEqual([state["ema20"] for state in messages[1]["states"]], [1.0, 5.0])
+
+
+    @override_settings(EMA_RECORDS_SKIP_UNCHANGED_WRITES=False)
+    def test_unchanged_records_are_written_if_not_skipped(self) -> None:
+        history_count = EMARecordHistory.objects.count()
+
+        response, messages = self.post([get_payload("CCC")])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(EMARecordHistory.objects.count(), history_count + 1)
+        self.assertGreater(self.get_record("CCC").updated_at, self.created_at)
+        self.assertEqual(self.get_record("CCC").timestamp, self.created_at)
+        # No field changed, so there is nothing to broadcast
+        self.assertEqual(messages, [])
+
+
+    def test_bulk_post_with_only_invalid_items_is_rejected(self) -> None:
+        response, messages = self.post([get_payload("nope"), get_payload("AAA", trend="5")])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["status"], "error")
+        self.assertEqual(list(response.data["errors"]), ["0", "1"])
+        self.assertEqual(response.data["data"], [])
+        self.assertFalse(EMARecord.objects.filter(currency=self.currencies["AAA"]).exists())
+        self.assertEqual(messages, [])
@@ -0,0 +1,250 @@
+from typing import Any, Dict, List, Tuple
+from django.conf import settings
+from django.db import transaction
+from rest_framework import exceptions
+
+from .models import EMARecord, EMARecordHistory
+from .serializers import EMARecordSerializer
+from .validators import EMARecordIngestValidator
+from .snapshots import apply_ema_record_changes
+from .subscriptions import get_ema_record_routing_states
+from .utils import (
+    EMA_RECORD_LOCK_NAMESPACE,
+    get_dict_diff,
+    get_series_keys_q,
+    lock_series_keys,
+    notify_group_of_ema_record_update_via_websocket
+)
+from currency.models import Currency
+from currency.symbols import currency_symbol_cache
+from helpers import metrics
+
+
+# Fields that are overwritten when an incoming record conflicts
+# with an existing record for the same currency and timeframe
+EMA_RECORD_UPSERT_FIELDS = [
+    "close",
+    "ema20",
+    "ema50",
+    "ema100",
+    "ema200",
+    "trend",
+    "monhigh",
+    "monlow",
+    "monmid",
+    "twenty_greater_than_fifty",
+    "fifty_greater_than_hundred",
+    "hundred_greater_than_twohundred",
+    "close_greater_than_hundred",
+    "watch_code",
+    "updated_at",
+]
+
+
+def resolve_currencies(symbols: List[str]) -> Dict[str, Currency]:
+    """
+    Resolve currency symbols to currencies, from the currency symbol cache.
+    Symbols that are not cached are resolved in a single query.
+
+    :param symbols: Currency symbols to resolve. The lookup is case-insensitive.
+    :return: A mapping of upper-cased symbols to currencies
+    """
+    return currency_symbol_cache.resolve(symbols)
+
+
+def get_existing_ema_records(keys: List[Tuple[Any, Any]]) -> Dict[Tuple[Any, Any], EMARecord]:
+    """
+    Fetch the existing EMA records for the given (currency_id, timeframe) keys in a single query.
+
+    :param keys: (currency_id, timeframe) pairs
+    :return: A mapping of (currency_id, timeframe) pairs to existing records
+    """
+    if not keys:
+        return {}
+
+    records = EMARecord.objects.select_related("currency").filter(get_series_keys_q(keys)).order_by()
+    return {(record.currency_id, record.timeframe): record for record in records}
+
+
+
+def bulk_upsert_ema_records(data: List[Dict]) -> Tuple[List[EMARecord], Dict[int, Dict]]:
+    """
+    Create or update EMA records in bulk.
+
+    Each item is validated with the `EMARecordIngestValidator`, which has the same results
+    and errors as the `EMARecordSerializer`. The currency symbols
+    of the valid items are resolved in a single query, and all the records are
+    written using a single `INSERT ... ON CONFLICT (currency_id, timeframe) DO UPDATE` query.
+
+    If more than one item is provided for the same currency and timeframe, the last one wins.
+
+    :param data: A list of EMA record payloads
+    :return: A tuple of the saved records and a mapping of
+        the indices of invalid items to their errors
+    """
+    # Building the serializer fields is expensive, so a single serializer
+    # instance is used to validate and represent all the records
+    serializer = EMARecordSerializer()
+    validator = EMARecordIngestValidator(serializer)
+    errors: Dict[int, Dict] = {}
+    validated_items: Dict[int, Dict] = {}
+    for index, item in enumerate(data):
+        try:
+            validated_items[index] = validator.validate(item)
+        except exceptions.ValidationError as exc:
+            errors[index] = exc.detail
+
+    currencies = resolve_currencies(
+        [validated_data["currency_symbol"] for validated_data in validated_items.values()]
+    )
+    items: List[Dict] = []
+    for index, validated_data in validated_items.items():
+        currency_symbol: str = validated_data.pop("currency_symbol")
+        currency = currencies.get(currency_symbol.upper(), None)
+        if currency is None:
+            errors[index] = {
+                "currency_symbol": [f"Currency symbol provided, '{currency_symbol}', is not recognized."]
+            }
+            continue
+        validated_data["currency"] = currency
+        items.append(validated_data)
+
+    if not items:
+        return [], errors
+    return upsert_ema_records(items, serializer=serializer), errors
+
+
+def upsert_ema_records(
+    items: List[Dict], 
+    serializer: EMARecordSerializer | None = None,
+    notify: bool = True
+) -> List[EMARecord]:
+    """
+    Write validated EMA record data using a single 
+    `INSERT ... ON CONFLICT (currency_id, timeframe) DO UPDATE` query.
+    The new values of the records are appended to the EMA record history in the same transaction.
+
+    If more than one item is provided for the same currency and timeframe, the last one wins.
+    The keys of the items are locked before the existing records are read, so concurrent writes
+    of the same records are applied one after the other.
+
+    Existing records whose values do not change are not written, added to the history or broadcast,
+    if `EMA_RECORDS_SKIP_UNCHANGED_WRITES` is enabled. They are still returned.
+
+    :param items: Validated EMA record data. The "currency" of each item must be a `Currency` instance.
+    :param serializer: The serializer used to represent the records in the websocket notifications
+    :param notify: Whether to notify websocket clients of the created and updated records
+    :return: The saved (and unchanged) records
+    """
+    serializer = serializer or EMARecordSerializer()
+    # Use a dict keyed by (currency_id, timeframe) so the last item wins on duplicates
+    items_by_key: Dict[Tuple[Any, Any], Dict] = {
+        (validated_data["currency"].pk, validated_data["timeframe"]): validated_data
+        for validated_data in items
+    }
+
+    skip_unchanged = settings.EMA_RECORDS_SKIP_UNCHANGED_WRITES
+    with transaction.atomic():
+        # Concurrent writes to the same records wait for each other, so records created by
+        # another write are read and updated here, instead of being reported as created
+        lock_series_keys(EMA_RECORD_LOCK_NAMESPACE, items_by_key.keys())
+        existing_records = get_existing_ema_records(list(items_by_key.keys()))
+        results: List[EMARecord] = []
+        records: List[EMARecord] = []
+        events: List[Tuple[Dict | None, List[Dict] | None]] = []
+        timestamps: Dict[Any, Any] = {}
+        for key, validated_data in items_by_key.items():
+            record = existing_records.get(key, None)
+            created = record is None
+            if created:
+                record = EMARecord(**validated_data)
+                record.update_watch_code()
+            else:
+                changed = record.apply_values(validated_data)
+                if skip_unchanged and not changed:
+                    # Nothing changed, so the record is not written, added to the history or broadcast
+                    results.append(record)
+                    continue
+                timestamps[record.pk] = record.timestamp
+            results.append(record)
+            records.append(record)
+            if notify:
+                events.append((
+                    get_ema_record_change_event(serializer, record, created=created),
+                    get_ema_record_routing_states(record, created=created),
+                ))
+
+        if records:
+            EMARecord.objects.bulk_create(
+                records,
+                update_conflicts=True,
+                unique_fields=["currency", "timeframe"],
+                update_fields=EMA_RECORD_UPSERT_FIELDS,
+            )
+            EMARecordHistory.objects.record(records)
+
+    for record in records:
+        if record.pk in timestamps:
+            # `bulk_create` sets `timestamp` on every record it inserts, but existing
+            # records keep their original timestamp in the database on conflict.
+            record.timestamp = timestamps[record.pk]
+        record.reset_loaded_values()
+    metrics.increment("ema_records.writes.saved", len(records))
+    metrics.increment("ema_records.writes.skipped", len(results) - len(records))
+    if records:
+        # `bulk_create` does not send `post_save` signals, so the snapshot
+        # and the data version are updated here
+        transaction.on_commit(lambda: apply_ema_record_changes(saved_records=records))
+
+    for event, states in events:
+        if not event:
+            continue
+        try:
+            notify_group_of_ema_record_update_via_websocket("ema_record_updates", event, states=states)
+        except Exception:
+            # Ignore any errors that occur while sending the notification
+            continue
+    return results
+
+
+def get_ema_record_change_event(
+    serializer: EMARecordSerializer,
+    record: EMARecord,
+    created: bool
+) -> Dict | None:
+    """
+    Get the websocket message for a record that is about to be created or updated.
+
+    A "create" message holds the new record. An "update" message holds the changes
+    made to the record, and the id of the record. Changes are found from the values 
+    the record was loaded with, so only the changed fields are serialized. If these values are 
+    not known, the previous record is fetched and both versions of the record are compared.
+
+    :param serializer: The serializer used to represent the record
+    :param record: The record to be saved
+    :param created: Whether the record is about to be created
+    :return: The websocket message, or None if the record did not change
+    """
+    if created:
+        return {
+            "code": "create",
+            "data": serializer.to_representation(record)
+        }
+
+    changed_fields = record.get_changed_fields()
+    if changed_fields is None or "currency_id" in changed_fields:
+        previous_record = EMARecord.objects.select_related("currency").get(pk=record.pk)
+        change_data = get_dict_diff(
+            serializer.to_representation(previous_record), 
+            serializer.to_representation(record)
+        )
+    else:
+        change_data = serializer.to_partial_representation(record, changed_fields)
+
+    if not change_data:
+        return None
+    change_data["id"] = str(record.pk)
+    return {
+        "code": "update",
+        "data": change_data
+    }
@@ -7,5 +7,6 @@ app_name = "ema_records"
 
 urlpatterns = [
     path("", views.ema_record_list_create_api_view, name="ema-record__list-create"),
+    path("candles/", views.ema_candle_ingest_api_view, name="ema-candle__ingest"),
 ]
 
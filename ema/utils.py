@@ -1,7 +1,55 @@
-from typing import Dict
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+from django.db import connection, models
 
+from .outbox import websocket_event_outbox
+
+
+# Data version namespace of the EMA records. The version is bumped
+# on every write to the EMA records (see `helpers.caching`)
+EMA_RECORDS_DATA_NAMESPACE = "ema_records"
+
+# Namespace of the advisory locks taken on the (currency_id, timeframe) keys of EMA records
+EMA_RECORD_LOCK_NAMESPACE = "ema_record"
+
+
+def get_series_keys_q(keys: Iterable[Tuple[Any, Any]]) -> models.Q:
+    """
+    Returns a filter matching exactly the given (currency_id, timeframe) keys,
+    as an OR of the pairs, which the unique (currency, timeframe) indexes serve.
+
+    :param keys: (currency_id, timeframe) pairs. Must not be empty, since an empty filter matches everything.
+    """
+    return models.Q(
+        *(models.Q(currency_id=currency_id, timeframe=timeframe) for currency_id, timeframe in keys),
+        _connector=models.Q.OR
+    )
+
+
+def lock_series_keys(namespace: str, keys: Iterable[Tuple[Any, Any]]) -> None:
+    """
+    Take transaction-level advisory locks on (currency_id, timeframe) keys, so concurrent writes
+    to the same keys are serialized, including writes that create the rows of the keys.
+
+    Locks are taken in a consistent order, so concurrent writes to overlapping keys do not deadlock.
+    They are released when the transaction ends. Must be called in a transaction.
+
+    :param namespace: Name of the rows the keys are locked for, e.g. "ema_record"
+    :param keys: (currency_id, timeframe) pairs
+    """
+    names = sorted({f"{namespace}:{currency_id}:{timeframe}" for currency_id, timeframe in keys})
+    if not names:
+        return None
+    with connection.cursor() as cursor:
+        # Volatile functions in the select list are evaluated after the rows are sorted
+        cursor.execute(
+            """
+            SELECT pg_advisory_xact_lock(lock_id)
+            FROM (SELECT DISTINCT hashtextextended(name, 0) AS lock_id FROM unnest(%s::text[]) AS name) AS lock_ids
+            ORDER BY lock_id
+            """,
+            [names]
+        )
+    return None
 
 
 def get_dict_diff(dict1: Dict, dict2: Dict) -> Dict:
@@ -40,6 +88,31 @@ WATCH_VALUES_EXTERNAL_TO_INTERNAL_NAME_MAPPING = {
 }
 
 
+# Bit of each watch value in an EMA record's watch code
+WATCH_VALUE_BITS = {
+    "twenty_greater_than_fifty": 0b1000,
+    "fifty_greater_than_hundred": 0b0100,
+    "hundred_greater_than_twohundred": 0b0010,
+    "close_greater_than_hundred": 0b0001,
+}
+
+
+def get_watch_code(watch_values: Mapping[str, Any]) -> int:
+    """
+    Get the watch code for the given watch values.
+
+    The watch code packs the four watch values into a single integer, 
+    with a bit set for each value that is True. See `WATCH_VALUE_BITS`.
+
+    :param watch_values: A mapping of the internal watch value names to their values
+    """
+    code = 0
+    for name, bit in WATCH_VALUE_BITS.items():
+        if watch_values[name]:
+            code |= bit
+    return code
+
+
 def convert_watch_values_external_names_to_internal_names(data: Dict) -> Dict:
     """Converts external watchlist names to internal watchlist names"""
     new_data = {}
@@ -64,18 +137,28 @@ def convert_watch_values_internal_names_to_external_names(data: Dict) -> Dict:
     return new_data
 
 
-def notify_group_of_ema_record_update_via_websocket(group_name: str, data: Dict) -> None:
+def notify_group_of_ema_record_update_via_websocket(
+    group_name: str, 
+    data: Dict, 
+    states: List[Dict[str, Any]] | None = None
+) -> None:
     """
     Notify the clients in the channel group of the EMA record update via websocket
 
+    The message is added to the websocket event outbox once the current transaction is committed,
+    and sent by the outbox's background publisher. So callers do not wait on the channel layer,
+    and updates made in a transaction that is rolled back are never sent.
+
     :param group_name: The name of the channel group to send the message to
     :param data: The data to send to the client
+    :param states: The routing states of the record (see `ema.subscriptions.get_ema_record_routing_states`),
+        used to send the update only to the clients subscribed to the record. If None, all the clients get the update.
     """
-    channel_layer = get_channel_layer("default")
-    async_to_sync(channel_layer.group_send)(
+    websocket_event_outbox.put_on_commit(
         group_name,
         {
             'type': 'send.ema_record_update',
-            'data': data
+            'data': data,
+            'states': states
         }
     )
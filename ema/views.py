@@ -1,26 +1,134 @@
+from typing import Dict, List
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import DisallowedHost
 from django.db import models
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
 from rest_framework import generics, response, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from django.views.decorators.csrf import csrf_exempt
 
 
 from .models import EMARecord
-from .serializers import EMARecordSerializer
+from .serializers import EMARecordSerializer, CandleSerializer, parse_fieldset, get_fieldset_model_fields
 from .filters import EMARecordQSFilterer
+from .pagination import EMARecordCursorPagination
+from .snapshots import ema_record_snapshot
+from .row_renderers import EMARecordRowRenderer
+from .upserts import bulk_upsert_ema_records
+from .engine import ingest_candles
+from .utils import EMA_RECORDS_DATA_NAMESPACE
+from api.etag_mixins import DataVersionETag
+from api.api_keys import api_key_verification_cache
+from api.permissions import HasAPIKey
 from helpers.logging import log_exception
+from helpers.caching import aget_data_version, get_query_cache_key, get_query_etag
+from helpers.db import closing_old_connections
+from helpers import metrics
 
 
 ema_record_qs = EMARecord.objects.select_related("currency").all()
 
+# Renders the EMA records listed from the database, with all fields
+ema_record_row_renderer = EMARecordRowRenderer()
 
-class EMARecordListCreateAPIView(generics.ListCreateAPIView):
+
+def get_row_renderer(fieldset: Dict[str, List[str] | None] | None) -> EMARecordRowRenderer:
+    """Returns the renderer for the EMA records listed from the database with a sparse fieldset"""
+    if fieldset is None:
+        return ema_record_row_renderer
+    return EMARecordRowRenderer(fieldset)
+
+
+def apply_fieldset(
+    queryset: models.QuerySet[EMARecord], 
+    fieldset: Dict[str, List[str] | None] | None,
+    *extra_fields: str
+) -> models.QuerySet[EMARecord]:
+    """
+    Only load the model fields needed to represent the EMA records with a sparse fieldset
+
+    :param queryset: The EMA records queryset
+    :param fieldset: A sparse fieldset, as returned by `ema.serializers.parse_fieldset`, or None for all fields
+    :param extra_fields: Other model fields to load, such as the fields the records are paginated by
+    """
+    if fieldset is None:
+        return queryset
+    if "currency" not in fieldset:
+        queryset = queryset.select_related(None)
+    return queryset.only(*get_fieldset_model_fields(fieldset), *extra_fields)
+
+
+def get_bulk_write_response(records: List[EMARecord], errors: Dict[int, Dict]) -> response.Response:
+    """
+    Returns the response for a bulk write of EMA records.
+
+    The errors for invalid items are keyed by their index in the request data.
+    """
+    message = f"{len(records)} EMA record(s) saved successfully!"
+    if errors:
+        message = f"{len(records)} EMA record(s) saved successfully, {len(errors)} item(s) had errors!"
+    data = {
+        "status": "success" if records else "error",
+        "message": message,
+        "data": EMARecordSerializer(records, many=True).data,
+        "errors": {str(index): errors[index] for index in sorted(errors)},
+    }
+    if errors and not records:
+        return response.Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+    return response.Response(data=data, status=status.HTTP_201_CREATED)
+
+
+
+class EMARecordListCreateAPIView(DataVersionETag, generics.ListCreateAPIView):
     """API view for retrieving, creating and updating EMA records"""
     model = EMARecord
     serializer_class = EMARecordSerializer
     queryset = ema_record_qs
     http_method_names = ["get", "post", "put"]
+    cursor_pagination_class = EMARecordCursorPagination
+    etag_data_namespace = EMA_RECORDS_DATA_NAMESPACE
+
+    @property
+    def paginator(self):
+        """
+        Returns the cursor paginator if the request opts in to cursor pagination, 
+        with "pagination=cursor" or a "cursor" query parameter. Otherwise, returns the default paginator.
+        """
+        if not hasattr(self, "_paginator"):
+            query_params = self.request.query_params
+            if query_params.get("pagination", None) == "cursor" or "cursor" in query_params:
+                self._paginator = self.cursor_pagination_class()
+                return self._paginator
+        return super().paginator
+    
+
+    @property
+    def uses_cursor_pagination(self) -> bool:
+        return isinstance(self.paginator, self.cursor_pagination_class)
+    
+
+    def get_fieldset(self) -> Dict[str, List[str] | None] | None:
+        """Returns the sparse fieldset requested with the "fields" query parameter of GET requests"""
+        if self.request.method != "GET":
+            return None
+        return parse_fieldset(self.request.query_params.get("fields", None))
+    
+
+    def get_serializer(self, *args, **kwargs) -> EMARecordSerializer:
+        kwargs.setdefault("fieldset", self.get_fieldset())
+        return super().get_serializer(*args, **kwargs)
+    
 
     def get_queryset(self) -> models.QuerySet[EMARecord]:
         ema_qs = super().get_queryset()
+        if self.request.method == "GET":
+            # The cursor paginator reads the timestamps of the records on the page
+            extra_fields = ("timestamp",) if self.uses_cursor_pagination else ()
+            ema_qs = apply_fieldset(ema_qs, self.get_fieldset(), *extra_fields)
         try:
             ema_qs_filterer = EMARecordQSFilterer(self.request.query_params)
             return ema_qs_filterer.apply_filters(ema_qs)
@@ -30,26 +138,117 @@ class EMARecordListCreateAPIView(generics.ListCreateAPIView):
         return ema_qs
     
 
+    def list(self, request, *args, **kwargs) -> response.Response:
+        timeout = settings.EMA_RECORDS_RESPONSE_CACHE_TIMEOUT
+        if not timeout:
+            return self.list_records(request, *args, version=self.get_data_version(), **kwargs)
+        
+        # The version is read before the records, so a response built from records that
+        # change while it is being built is cached under the old version, which is no longer used
+        version = self.get_data_version()
+        cache_key = get_query_cache_key(request, EMA_RECORDS_DATA_NAMESPACE, version)
+        data = cache.get(cache_key, None)
+        if data is not None:
+            metrics.increment("ema_records.response_cache.hits")
+            return response.Response(data)
+
+        metrics.increment("ema_records.response_cache.misses")
+        list_response = self.list_records(request, *args, version=version, **kwargs)
+        if list_response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, list_response.data, timeout)
+        return list_response
+    
+
+    def list_records(self, request, *args, version: int | None = None, **kwargs) -> response.Response:
+        """
+        Returns the list of EMA records, from the snapshot or the database
+
+        :param version: The current EMA records data version, if it was already fetched
+        """
+        if self.uses_cursor_pagination:
+            return super().list(request, *args, **kwargs)
+        if not settings.EMA_RECORDS_SNAPSHOT_ENABLED:
+            return self.list_database_records()
+
+        # Serve the records from the in-memory snapshot, without querying the database
+        fieldset = self.get_fieldset()
+        try:
+            records = ema_record_snapshot.filter(request.query_params, version=version, fieldset=fieldset)
+        except Exception as exc:
+            # Log the exception and return the unfiltered records
+            log_exception(exc)
+            records = ema_record_snapshot.filter({}, version=version, fieldset=fieldset)
+        if records is None:
+            # The snapshot does not hold the version yet, and the response may be cached under it
+            return self.list_database_records()
+
+        page = self.paginate_queryset(records)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return response.Response(list(records))
+    
+
+    def list_database_records(self) -> response.Response:
+        """
+        Returns the list of EMA records from the database. Records are fetched 
+        as rows of values, and rendered without building model instances.
+        """
+        renderer = get_row_renderer(self.get_fieldset())
+        rows = self.filter_queryset(self.get_queryset()).values_list(*renderer.fields)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(renderer.render_many(page))
+        return response.Response(renderer.render_many(rows))
+    
+
     def get(self, request, *args, **kwargs) -> response.Response:
         """
         Retrieve a list of EMA records
 
         Tne following query parameters are supported:
-        - timeframe: Duration of the timeframe in the format "HH:MM:SS" e.g. "1:00:00" for 1 hour
-        - currency: Symbol or name of the currency
+        - timeframe: Duration of the timeframe in the format "HH:MM:SS" e.g. "1:00:00" for 1 hour,
+            or a comma-separated list of durations e.g. "1:00:00,4:00:00"
+        - currency: Symbol or exchange of the currency, or a comma-separated list of them e.g. "BTCUSD,ETHUSD"
         - ema20: EMA20 value
         - ema50: EMA50 value
         - ema100: EMA100 value
         - ema200: EMA200 value
         - trend: Trend direction (1 for upwards, -1 for downwards, 0 for sideways)
         - watch: EMA watchlist type. Can be either be type "A", "B", "C", "D", "E" or "F"
+        - fields: Comma-separated list of the fields to return e.g. "currency.symbol,close,trend,watch_code".
+            Fields of the nested currency are given as "currency.<field>". All fields, 
+            except "watch_code", are returned by default.
+
+        Results are paginated with "limit" and "offset" query parameters by default.
+        Add "pagination=cursor" to use cursor pagination instead. Cursor pagination does not
+        return a count, and the "next" and "previous" links should be followed to move between pages.
+
+        Responses are cached by query, until any EMA record or currency changes.
+        Responses have an ETag. Send it in the "If-None-Match" header to get a 304 response if the records have not changed.
         """
         return super().get(request, *args, **kwargs)
     
 
+    def create(self, request, *args, **kwargs) -> response.Response:
+        if isinstance(request.data, list):
+            return self.bulk_create(request, *args, **kwargs)
+        return super().create(request, *args, **kwargs)
+    
+
+    def bulk_create(self, request, *args, **kwargs) -> response.Response:
+        """
+        Create or update a list of EMA records in bulk.
+
+        Valid records are saved even if some of the records are invalid.
+        The errors for invalid records are returned keyed by their index in the request data.
+        """
+        records, errors = bulk_upsert_ema_records(request.data)
+        return get_bulk_write_response(records, errors)
+    
+
     def put(self, request, *args, **kwargs) -> response.Response:
         """
-        Update an EMA record
+        Update an EMA record, or a list of EMA records
         """
         # User can update existing EMA records via a POST request already
         # Just add this so users can update records using a PUT request
@@ -62,4 +261,178 @@ class EMARecordListCreateAPIView(generics.ListCreateAPIView):
 
 
 
-ema_record_list_create_api_view = csrf_exempt(EMARecordListCreateAPIView.as_view())
+class EMACandleIngestAPIView(generics.GenericAPIView):
+    """API view for computing EMA records from raw OHLC candles"""
+    serializer_class = CandleSerializer
+    http_method_names = ["post"]
+
+    def post(self, request, *args, **kwargs) -> response.Response:
+        """
+        Ingest a candle, or a list of candles, and update the EMA records of their series.
+
+        Each candle should have the following fields:
+        - currency_symbol: Symbol of the currency
+        - timeframe: Duration of the timeframe in the format "HH:MM:SS" e.g. "1:00:00" for 1 hour
+        - time: Open time of the candle
+        - open, high, low, close: Prices of the candle
+
+        Only closed candles should be sent. Candles that are not newer than the last
+        candle received for their currency and timeframe are rejected.
+        """
+        data = request.data if isinstance(request.data, list) else [request.data]
+        records, errors = ingest_candles(data)
+        return get_bulk_write_response(records, errors)
+
+
+
+
+class AsyncEMARecordListView:
+    """
+    Async view for retrieving EMA records, that runs on the event loop under ASGI.
+
+    Serves GET requests with the same filters, pagination, response shape, caching and ETags as
+    `EMARecordListCreateAPIView.get`, so polling clients do not each take a thread from the
+    sync thread pool. API key verification, ETag checks and cached responses are handled on
+    the event loop. Records are listed from the snapshot in a worker thread, or with the async ORM
+    if the snapshot is disabled.
+
+    Other methods, cursor pagination and browsable API requests are passed on to the sync view.
+    """
+    sync_view = staticmethod(EMARecordListCreateAPIView.as_view())
+    renderer = JSONRenderer()
+
+    @classmethod
+    def as_view(cls):
+        """Returns the async view function"""
+        view = cls()
+
+        async def async_view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            return await view(request, *args, **kwargs)
+        return async_view
+
+
+    def can_handle(self, request: HttpRequest) -> bool:
+        """Returns True if the request can be handled without the sync view"""
+        if request.method != "GET":
+            return False
+        if request.GET.get("pagination", None) == "cursor" or "cursor" in request.GET:
+            return False
+        return "format" not in request.GET and "text/html" not in request.headers.get("Accept", "")
+
+
+    async def __call__(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if not self.can_handle(request):
+            return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+        try:
+            # Pagination links are built from the request's host, which must be allowed
+            request.get_host()
+        except DisallowedHost:
+            return self.render({"detail": "Invalid host header."}, status_code=status.HTTP_400_BAD_REQUEST)
+
+        api_key = request.META.get(settings.API_KEY_CUSTOM_HEADER, None)
+        if not api_key or not await api_key_verification_cache.ais_valid(api_key):
+            return self.render({"detail": HasAPIKey.message}, status_code=status.HTTP_403_FORBIDDEN)
+
+        version = await aget_data_version(EMA_RECORDS_DATA_NAMESPACE)
+        # Same as the sync view's ETag for the JSON responses it negotiates
+        etag = get_query_etag(request, EMA_RECORDS_DATA_NAMESPACE, version, media_type=self.renderer.media_type)
+        not_modified_response = get_conditional_response(request, etag=etag)
+        if not_modified_response is not None:
+            not_modified_response["ETag"] = etag
+            return not_modified_response
+
+        timeout = settings.EMA_RECORDS_RESPONSE_CACHE_TIMEOUT
+        cache_key = get_query_cache_key(request, EMA_RECORDS_DATA_NAMESPACE, version)
+        data = await cache.aget(cache_key, None) if timeout else None
+        if data is not None:
+            metrics.increment("ema_records.response_cache.hits")
+        else:
+            if timeout:
+                metrics.increment("ema_records.response_cache.misses")
+            data = await self.list_records(Request(request), version)
+            if timeout:
+                await cache.aset(cache_key, data, timeout)
+
+        list_response = self.render(data)
+        list_response["ETag"] = etag
+        return list_response
+
+
+    def render(self, data, status_code: int = status.HTTP_200_OK) -> HttpResponse:
+        """Renders the data the same way as the sync view's JSON responses"""
+        rendered_response = HttpResponse(
+            self.renderer.render(data), 
+            status=status_code, 
+            content_type="application/json"
+        )
+        rendered_response["Vary"] = "Accept"
+        rendered_response["Allow"] = "GET, POST, PUT"
+        return rendered_response
+
+
+    async def list_records(self, request: Request, version: int):
+        """
+        Returns the (paginated) data of the EMA records that match the request's filters
+
+        :param request: The request
+        :param version: The current EMA records data version
+        """
+        fieldset = parse_fieldset(request.query_params.get("fields", None))
+        if settings.EMA_RECORDS_SNAPSHOT_ENABLED:
+            data = await sync_to_async(
+                closing_old_connections(self.list_snapshot_records), thread_sensitive=False
+            )(request, version, fieldset)
+            if data is not None:
+                return data
+            # The snapshot does not hold the version yet, so the records are listed from the database
+
+        try:
+            queryset = EMARecordQSFilterer(request.query_params).apply_filters(ema_record_qs)
+        except Exception as exc:
+            # Log the exception and return the unfiltered queryset
+            log_exception(exc)
+            queryset = ema_record_qs
+        renderer = get_row_renderer(fieldset)
+        rows = queryset.values_list(*renderer.fields)
+        
+        # Same as `LimitOffsetPagination.paginate_queryset`, with async queries
+        paginator = EMARecordListCreateAPIView.pagination_class()
+        paginator.request = request
+        paginator.limit = paginator.get_limit(request)
+        if paginator.limit is None:
+            return renderer.render_many([row async for row in rows])
+        
+        paginator.count = await rows.acount()
+        paginator.offset = paginator.get_offset(request)
+        page = []
+        if paginator.count and paginator.offset <= paginator.count:
+            page = [row async for row in rows[paginator.offset:paginator.offset + paginator.limit]]
+        return paginator.get_paginated_response(renderer.render_many(page)).data
+
+
+    def list_snapshot_records(self, request: Request, version: int, fieldset: Dict | None):
+        """
+        Returns the (paginated) data of the EMA records from the snapshot,
+        or None if the snapshot does not hold the version yet
+        """
+        try:
+            records = ema_record_snapshot.filter(request.query_params, version=version, fieldset=fieldset)
+        except Exception as exc:
+            # Log the exception and return the unfiltered records
+            log_exception(exc)
+            records = ema_record_snapshot.filter({}, version=version, fieldset=fieldset)
+        if records is None:
+            return None
+
+        paginator = EMARecordListCreateAPIView.pagination_class()
+        page = paginator.paginate_queryset(records, request)
+        if page is None:
+            return list(records)
+        return paginator.get_paginated_response(page).data
+
+
+
+
+ema_record_list_create_api_view = csrf_exempt(AsyncEMARecordListView.as_view())
+ema_candle_ingest_api_view = csrf_exempt(EMACandleIngestAPIView.as_view())
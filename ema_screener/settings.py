@@ -31,6 +31,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     # apps
+    'api.apps.ApiConfig',
     'ema.apps.EmaConfig',
     'currency.apps.CurrencyConfig',
     'users.apps.UsersConfig',
@@ -80,6 +81,21 @@ CHANNEL_LAYERS = {
     },
 }
 
+if os.getenv("REDIS_SERVICE_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            # Use a separate database from the channel layer
+            "LOCATION": f"redis://{os.getenv('REDIS_SERVICE_HOST')}:6379/1",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 DATABASES = {
    'default': {
        'ENGINE': 'django.db.backends.postgresql',
@@ -166,6 +182,39 @@ REST_FRAMEWORK = {
 }
 
 API_KEY_CUSTOM_HEADER = "HTTP_X_API_KEY" # Request header should have "X-API-KEY" key
+# Number of seconds API key verification results are cached for, per process. Set to 0 to disable the cache.
+# Cached results are cleared as soon as any API key is saved or deleted.
+API_KEY_VERIFICATION_CACHE_TTL = float(os.getenv("API_KEY_VERIFICATION_CACHE_TTL", "60"))
+
+# Resolve the currency symbols of EMA record writes from a process-local map of the currencies
+CURRENCY_SYMBOL_CACHE_ENABLED = os.getenv("CURRENCY_SYMBOL_CACHE_ENABLED", "true").lower() == "true"
+# Redis server on which currency changes are published, to clear the maps of all processes.
+# Without it, the maps are not used, and every write looks its currency symbols up in the database.
+CURRENCY_SYMBOLS_REDIS_URL = f"redis://{os.getenv('REDIS_SERVICE_HOST')}:6379" if os.getenv("REDIS_SERVICE_HOST") else None
+
+# Serve EMA record list requests from an in-memory snapshot of the EMA records
+EMA_RECORDS_SNAPSHOT_ENABLED = os.getenv("EMA_RECORDS_SNAPSHOT_ENABLED", "false").lower() == "true"
+# Number of seconds after which the snapshot is reloaded in the background, to pick up writes made by other processes
+EMA_RECORDS_SNAPSHOT_MAX_AGE = float(os.getenv("EMA_RECORDS_SNAPSHOT_MAX_AGE", "5"))
+# Number of seconds EMA record list responses are cached for. Set to 0 to disable the response cache.
+# Cached responses are invalidated as soon as any EMA record or currency changes.
+EMA_RECORDS_RESPONSE_CACHE_TIMEOUT = int(os.getenv("EMA_RECORDS_RESPONSE_CACHE_TIMEOUT", "60"))
+# Skip writes of EMA records whose values are the same as the stored values. Skipped records
+# keep their "updated_at", and are not added to the history or broadcast to websocket clients.
+EMA_RECORDS_SKIP_UNCHANGED_WRITES = os.getenv("EMA_RECORDS_SKIP_UNCHANGED_WRITES", "true").lower() == "true"
+# Number of seconds EMA record websocket events are collected for, before they are merged by record
+# and sent as a single "batch" frame, e.g. 0.25. Set to 0 to send every event as its own frame.
+EMA_RECORDS_WEBSOCKET_COALESCE_WINDOW = float(os.getenv("EMA_RECORDS_WEBSOCKET_COALESCE_WINDOW", "0"))
+# Number of recent EMA record websocket broadcasts kept for clients that reconnect to resume from.
+# Clients that missed more broadcasts, or broadcasts older than the resume timeout (in seconds), get a snapshot.
+EMA_RECORDS_WEBSOCKET_RESUME_BUFFER_SIZE = int(os.getenv("EMA_RECORDS_WEBSOCKET_RESUME_BUFFER_SIZE", "10000"))
+EMA_RECORDS_WEBSOCKET_RESUME_TIMEOUT = int(os.getenv("EMA_RECORDS_WEBSOCKET_RESUME_TIMEOUT", "600"))
+# Maximum number of messages queued for each EMA record websocket connection, and what happens when
+# a connection's queue is full: "coalesce" (merge the queued events by record), "drop_oldest" or "disconnect".
+EMA_RECORDS_WEBSOCKET_SEND_QUEUE_SIZE = int(os.getenv("EMA_RECORDS_WEBSOCKET_SEND_QUEUE_SIZE", "1000"))
+EMA_RECORDS_WEBSOCKET_SEND_QUEUE_POLICY = os.getenv("EMA_RECORDS_WEBSOCKET_SEND_QUEUE_POLICY", "coalesce").lower()
+# Number of seconds a connection can lag behind before it is closed, with the "disconnect" policy
+EMA_RECORDS_WEBSOCKET_MAX_LAG = float(os.getenv("EMA_RECORDS_WEBSOCKET_MAX_LAG", "30"))
 
 CORS_ALLOW_HEADERS = (*default_headers, 'x-api-key')
 
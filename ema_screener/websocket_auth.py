@@ -1,11 +1,12 @@
 from typing import Dict, Union
-from rest_framework_api_key.models import APIKey
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
 from urllib.parse import parse_qs
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 
+from api.api_keys import api_key_verification_cache
+
 
 
 @database_sync_to_async
@@ -13,13 +14,12 @@ def api_key_is_valid(api_key: str) -> bool:
     """
     Check if an API key is valid.
 
+    Verification results are cached (see `api.api_keys.APIKeyVerificationCache`).
+
     :param api_key: The API key to check
     :return: True if the API key exists, False otherwise
     """
-    try:
-        return APIKey.objects.is_valid(api_key)
-    except APIKey.DoesNotExist:
-        return False
+    return api_key_verification_cache.is_valid(api_key)
 
 
 def get_api_key_from_scope(scope: Dict) -> str | None:
@@ -0,0 +1,100 @@
+import time
+import hashlib
+from typing import Any
+from django.core.cache import cache
+from django.http import HttpRequest
+
+
+def get_data_version_cache_key(namespace: str) -> str:
+    return f"data_version:{namespace}"
+
+
+def get_data_version(namespace: str) -> int:
+    """
+    Returns the current data version of a namespace.
+
+    Data versions are shared through the default cache, so all processes see the same version.
+    A missing version is initialized from the current time, so a version that was evicted from
+    the cache does not restart at a value that was already used.
+
+    :param namespace: Name of the data, e.g. "ema_records"
+    """
+    key = get_data_version_cache_key(namespace)
+    version = cache.get(key, None)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key, 0)
+    return version
+
+
+async def aget_data_version(namespace: str) -> int:
+    """Async version of `get_data_version`, for use on the event loop"""
+    key = get_data_version_cache_key(namespace)
+    version = await cache.aget(key, None)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key, 0)
+    return version
+
+
+def bump_data_version(namespace: str) -> int:
+    """
+    Increments the data version of a namespace, invalidating everything cached for the previous version.
+
+    Call this after the changes to the data have been committed.
+
+    :param namespace: Name of the data, e.g. "ema_records"
+    :return: The new data version
+    """
+    key = get_data_version_cache_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The version does not exist yet
+        get_data_version(namespace)
+        return cache.incr(key)
+
+
+def get_query_digest(request: HttpRequest) -> str:
+    """
+    Returns a digest of the normalized query of a request.
+
+    Query parameters are sorted so that the same query always gets the same digest,
+    regardless of the order of the parameters in the URL. The scheme and host are included since
+    paginated responses contain absolute links.
+    """
+    query_params = sorted(
+        (key, tuple(values)) for key, values in request.GET.lists()
+    )
+    return hashlib.sha256(
+        repr((request.scheme, request.get_host(), request.path, query_params)).encode()
+    ).hexdigest()
+
+
+def get_query_cache_key(request: HttpRequest, namespace: str, version: Any) -> str:
+    """
+    Returns a cache key for the response to a request, based on its normalized query parameters.
+
+    :param request: The request
+    :param namespace: Name of the data the response is built from
+    :param version: The data version of the namespace
+    """
+    return f"response:{namespace}:{version}:{get_query_digest(request)}"
+
+
+def get_query_etag(request: HttpRequest, namespace: str, version: Any, media_type: str | None = None) -> str:
+    """
+    Returns a strong ETag for the response to a request, based on its normalized query parameters.
+
+    Responses to the same query are identical for the same data version and media type,
+    so the ETag changes whenever the version does.
+
+    :param request: The request
+    :param namespace: Name of the data the response is built from
+    :param version: The data version of the namespace
+    :param media_type: The media type the response is rendered as, if it is negotiated with the "Accept" header
+    """
+    digest = hashlib.sha256(
+        f"{namespace}:{version}:{media_type}:{get_query_digest(request)}".encode()
+    ).hexdigest()
+    return f'"{digest[:32]}"'
@@ -0,0 +1,25 @@
+import functools
+from typing import Callable, TypeVar
+from django.db import close_old_connections
+
+
+F = TypeVar("F", bound=Callable)
+
+
+def closing_old_connections(func: F) -> F:
+    """
+    Wrap a function that queries the database from an executor thread,
+    e.g. with `sync_to_async(..., thread_sensitive=False)`.
+
+    Django only closes the connections of the threads that handle requests, so connections
+    opened by executor threads would stay open for as long as the threads live.
+    Old connections are closed before and after each call instead, as Django does around requests.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
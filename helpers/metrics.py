@@ -0,0 +1,44 @@
+import threading
+from collections import Counter
+from typing import Callable, Dict
+
+
+_counters: Counter = Counter()
+_counters_lock = threading.Lock()
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """
+    Increment a process-local counter.
+
+    :param name: Name of the counter, e.g. "ema_records.response_cache.hits"
+    :param amount: Amount to increment the counter by
+    """
+    with _counters_lock:
+        _counters[name] += amount
+    return None
+
+
+def get_counters() -> Dict[str, int]:
+    """Returns the current values of the counters of this process"""
+    with _counters_lock:
+        return dict(_counters)
+
+
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+def register_gauge(name: str, func: Callable[[], float]) -> None:
+    """
+    Register a process-local gauge, a value that is read when the metrics are collected.
+
+    :param name: Name of the gauge, e.g. "websocket.send_queue.depth"
+    :param func: Function that returns the current value of the gauge
+    """
+    _gauges[name] = func
+    return None
+
+
+def get_gauges() -> Dict[str, float]:
+    """Returns the current values of the gauges of this process"""
+    return {name: func() for name, func in list(_gauges.items())}